@@ -0,0 +1,112 @@
+#!/usr/bin/python
+#
+# Author:
+# Henri Doreau <henri.doreau@greenbone.net>
+#
+# Copyright:
+# Copyright (C) 2011 Greenbone Networks GmbH, http://www.greenbone.net
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2
+# (or any later version), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301 USA.
+##
+
+
+"""Microbenchmark: bit-parallel bounded edit distance (cpelab.tools.similarity)
+against the former pure Python dynamic programming implementation.
+
+Usage: python -m bench.levenshtein [signatures] [candidates]
+"""
+
+import sys
+import time
+import random
+
+from cpelab.tools.similarity import levenshtein, best_matches
+
+
+WORDS = ['microsoft', 'windows', 'xp', 'vista', 'server', '2003', 'sp1', 'sp2',
+    'linux', 'kernel', '2.6.32', '2.4.20', 'cisco', 'ios', '12.4', 'freebsd',
+    'release', 'apple', 'mac', 'os', 'x', '10.5.8', 'leopard', 'professional']
+
+
+def naive_levenshtein(str0, str1):
+    """Reference implementation (former FuzzyTranslator._levenshtein)."""
+    n, m = len(str0), len(str1)
+    if n > m:
+        str0, str1 = str1, str0
+        n, m = m, n
+
+    curr = range(n+1)
+    for i in range(1, m+1):
+        prev, curr = curr, [i] + [0]*n
+        for j in range(1, n+1):
+            add, delete = prev[j] + 1, curr[j-1] + 1
+            change = prev[j-1]
+            if str0[j-1] != str1[i-1]:
+                change = change + 1
+            curr[j] = min(add, delete, change)
+    return curr[n]
+
+def naive_best(ref, candidates, max_dist):
+    """Former scoring loop: compute every distance, keep the best ones."""
+    best_dist, best_idx = None, []
+    for idx, candidate in enumerate(candidates):
+        dist = naive_levenshtein(ref, candidate)
+        if dist > max_dist:
+            continue
+        if best_dist is None or dist < best_dist:
+            best_dist, best_idx = dist, [idx]
+        elif dist == best_dist:
+            best_idx.append(idx)
+    return best_dist, best_idx
+
+def make_title(rnd):
+    """Return a random OS-like title."""
+    return ' '.join([rnd.choice(WORDS) for _ in xrange(rnd.randint(2, 6))])
+
+def timed(func, *args):
+    """Return the execution time of func(*args) and its result."""
+    start = time.time()
+    res = func(*args)
+    return time.time() - start, res
+
+def main():
+    """Benchmark entry point."""
+    nsigs = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    ncands = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    rnd = random.Random(42)
+    sigs = [make_title(rnd) for _ in xrange(nsigs)]
+    cands = [[make_title(rnd) for _ in xrange(ncands)] for _ in xrange(nsigs)]
+    pairs = [(s, c) for s, cl in zip(sigs, cands) for c in cl]
+
+    print '%d signatures x %d candidates' % (nsigs, ncands)
+
+    t_naive, ref = timed(lambda: [naive_levenshtein(a, b) for a, b in pairs])
+    t_fast, res = timed(lambda: [levenshtein(a, b) for a, b in pairs])
+    assert ref == res
+    print 'unbounded distance:  naive %.3fs  bit-parallel %.3fs  (x%.1f)' \
+        % (t_naive, t_fast, t_naive / t_fast)
+
+    for max_dist in [2, 10]:
+        t_naive, ref = timed(lambda: [naive_best(s, c, max_dist) for s, c in zip(sigs, cands)])
+        t_fast, res = timed(lambda: [best_matches(s, c, max_dist) for s, c in zip(sigs, cands)])
+        assert ref == res
+        print 'best matches (<=%2d): naive %.3fs  bit-parallel %.3fs  (x%.1f)' \
+            % (max_dist, t_naive, t_fast, t_naive / t_fast)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/python
+#
+# Author:
+# Henri Doreau <henri.doreau@greenbone.net>
+#
+# Copyright:
+# Copyright (C) 2011 Greenbone Networks GmbH, http://www.greenbone.net
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2
+# (or any later version), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301 USA.
+##
+
+
+
+"""Startup time benchmark: scanners run labctl once per lookup, so the cost of
+starting it must stay small compared to the lookup itself.
+
+Each command is run several times as a separate process, in a scratch
+directory holding an empty database. The median wall time, minus the one of
+the bare interpreter, is checked against a budget. Listing commands (usage,
+help) must only import the modules of the commands concerned.
+
+Results are printed as JSON, the exit status is 1 if the budget is exceeded.
+
+Usage: python -m bench.startup [--runs N] [--budget ms] [--output file.json]
+"""
+
+import os
+import sys
+import json
+import time
+import getopt
+import shutil
+import tempfile
+import subprocess
+
+from cpelab.databases.db import DATADIR, SQLITE_INIT_SCRIPT
+
+
+RUNS = 15
+
+# maximum time spent by labctl on top of the interpreter startup, in ms
+BUDGET_MS = 25.
+
+# (name, arguments, whether heavy modules are allowed)
+COMMANDS = [
+    ('usage', [], False),
+    ('help', ['help', 'match'], True),
+    ('match', ['match', '--limit', '1', 'cpe:/o:linux'], True),
+    ('search', ['search', '--limit', '1', 'linux', 'cpeos'], True),
+]
+
+# modules which listing commands (usage) must not import
+HEAVY_MODULES = ['sqlite3', 'xml.sax', 'urllib2', 'multiprocessing', 'json',
+    'cpelab.databases.db', 'cpelab.tools.toolbase']
+
+MODULES_MARKER = '@modules'
+
+# runs labctl and reports the heavy modules loaded on exit
+MODULES_PROBE = """import sys, atexit
+def report():
+    sys.__stderr__.write('%%s %%s\\n' %% (MARKER,
+        ' '.join([m for m in %r if m in sys.modules])))
+atexit.register(report)
+sys.argv = ['labctl'] + sys.argv[1:]
+from cpelab.cli import main
+main()
+""".replace('MARKER', repr(MODULES_MARKER)) % HEAVY_MODULES
+
+
+def labctl_path():
+    """Return the path of the labctl script."""
+    return os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        'labctl.py')
+
+def median_time(argv, runs, workdir):
+    """Run argv runs times in workdir, return the median wall time (ms)."""
+    devnull = open(os.devnull, 'w')
+    # warm up the page cache
+    subprocess.call(argv, cwd=workdir, stdout=devnull, stderr=devnull)
+    times = []
+    for _ in xrange(runs):
+        start = time.time()
+        subprocess.call(argv, cwd=workdir, stdout=devnull, stderr=devnull)
+        times.append((time.time() - start) * 1000.)
+    devnull.close()
+    times.sort()
+    return times[len(times) / 2]
+
+def loaded_modules(args, workdir):
+    """Return the heavy modules imported by labctl args."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.path.dirname(labctl_path())
+    proc = subprocess.Popen([sys.executable, '-c', MODULES_PROBE] + args,
+        cwd=workdir, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, err = proc.communicate()
+    for line in err.splitlines():
+        if line.startswith(MODULES_MARKER):
+            return line.split()[1:]
+    raise RuntimeError('labctl %s failed: %s' % (' '.join(args), err))
+
+def run(runs, budget, workdir):
+    """Measure every command in workdir. Return the results as a dict."""
+    datadir = os.path.join(workdir, DATADIR)
+    os.makedirs(datadir)
+    shutil.copy(os.path.join(os.getcwd(), DATADIR, SQLITE_INIT_SCRIPT), datadir)
+    subprocess.check_call([sys.executable, labctl_path(), 'init'], cwd=workdir,
+        stdout=open(os.devnull, 'w'))
+
+    base = median_time([sys.executable, '-c', 'pass'], runs, workdir)
+    results = {
+        'runs': runs,
+        'budget_ms': budget,
+        'interpreter_ms': round(base, 2),
+        'commands': {},
+        'ok': True
+    }
+    sys.stderr.write('%-12s %8.2fms\n' % ('interpreter', base))
+
+    for name, args, heavy_allowed in COMMANDS:
+        wall = median_time([sys.executable, labctl_path()] + args, runs, workdir)
+        modules = loaded_modules(args, workdir)
+        ok = wall - base <= budget and (heavy_allowed or len(modules) == 0)
+        results['commands'][name] = {
+            'wall_ms': round(wall, 2),
+            'overhead_ms': round(wall - base, 2),
+            'heavy_modules': modules,
+            'ok': ok
+        }
+        results['ok'] = results['ok'] and ok
+        sys.stderr.write('%-12s %8.2fms  +%.2fms  %s%s\n' % (name, wall,
+            wall - base, 'ok' if ok else 'OVER BUDGET',
+            ' (%s)' % ' '.join(modules) if modules else ''))
+    return results
+
+def main():
+    """Benchmark entry point."""
+    try:
+        opts, _ = getopt.gnu_getopt(sys.argv[1:], '', ['runs=', 'budget=', 'output='])
+    except getopt.GetoptError, err:
+        sys.exit(str(err))
+
+    runs = RUNS
+    budget = BUDGET_MS
+    output = None
+    for opt, val in opts:
+        if opt == '--runs':
+            runs = int(val)
+        elif opt == '--budget':
+            budget = float(val)
+        elif opt == '--output':
+            output = val
+
+    workdir = tempfile.mkdtemp(prefix='cpelab-startup-')
+    try:
+        results = run(runs, budget, workdir)
+    finally:
+        shutil.rmtree(workdir)
+
+    dump = json.dumps(results, indent=2, sort_keys=True)
+    if output is None:
+        print dump
+    else:
+        fout = open(output, 'w')
+        fout.write(dump + '\n')
+        fout.close()
+    sys.exit(0 if results['ok'] else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+#!/usr/bin/python
+#
+# Author:
+# Henri Doreau <henri.doreau@greenbone.net>
+#
+# Copyright:
+# Copyright (C) 2011 Greenbone Networks GmbH, http://www.greenbone.net
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2
+# (or any later version), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301 USA.
+##
+
+
+"""cpelab benchmark suite.
+
+Generate synthetic databases (see bench.synthetic) in a scratch directory, then
+time the main operations: loading (populate), searching (SearchDB), lookups
+(Database.lookup), translation (FuzzyTranslator) and comparison (VendorDiff).
+Each phase runs in its own process, to report its own peak memory usage.
+Results are printed as JSON, to be compared between versions.
+
+Usage: python -m bench.suite [--scale N] [--output file.json] [--keep]
+"""
+
+import os
+import sys
+import json
+import time
+import getopt
+import random
+import shutil
+import sqlite3
+import platform
+import resource
+import tempfile
+import multiprocessing
+from Queue import Empty
+
+from bench import synthetic
+
+from cpelab.databases.db import DATADIR, SQLITE_INIT_SCRIPT, Database
+from cpelab.databases.cpedict import CPEOS
+from cpelab.databases.nmapos import NmapOS
+from cpelab.tools.toolbase import SearchDB
+from cpelab.tools.comparison import VendorDiff
+from cpelab.tools.translation import FuzzyTranslator
+
+
+# Number of operations of the query phases
+SEARCH_QUERIES = 50
+LOOKUP_QUERIES = 2000
+TRANSLATED_SIGNATURES = 500
+
+# Seconds between checks that a phase process is still alive
+PHASE_POLL_INTERVAL = 1
+
+SEARCH_PATTERNS = ['%windows%', '%linux%kernel%', '%ios 12%', '%solaris%',
+    '%mac os%', '%sp2%', '%junos%', 'openbsd%']
+
+
+def phase_init(ctx):
+    """Create an empty database."""
+    Database().initialize()
+    return 0
+
+def phase_populate_cpeos(ctx):
+    """Load the CPE dictionary."""
+    db = CPEOS()
+    db.populate(source=ctx['cpe_path'])
+    return db.count()
+
+def phase_populate_nmapos(ctx):
+    """Load the nmap OS database."""
+    db = NmapOS()
+    db.populate(source=ctx['nmap_path'])
+    return db.count()
+
+def phase_search(ctx):
+    """Run the search tool on the CPE dictionary."""
+    for i in xrange(SEARCH_QUERIES):
+        SearchDB().start([SEARCH_PATTERNS[i % len(SEARCH_PATTERNS)], 'cpeos'])
+    return SEARCH_QUERIES
+
+def phase_lookup(ctx):
+    """Strict lookups on vendor and product."""
+    db = CPEOS(readonly=True)
+    rnd = random.Random(synthetic.SEED)
+    pairs = db.db_cnx.execute('select distinct cpe_vendor, cpe_product'
+        ' from cpeos').fetchall()
+    for _ in xrange(LOOKUP_QUERIES):
+        vendor, product = rnd.choice(pairs)
+        for _ in db.lookup({'vendor': vendor, 'product': product}):
+            pass
+    return LOOKUP_QUERIES
+
+def phase_translate(ctx):
+    """Translate nmap signatures with the fuzzy translator."""
+    translator = FuzzyTranslator(NmapOS(readonly=True), CPEOS(readonly=True),
+        use_cache=False)
+    count = 0
+    for sig in translator.db0.lookup_ids(1, TRANSLATED_SIGNATURES):
+        translator.translate_names(sig)
+        count += 1
+    return count
+
+def phase_diff(ctx):
+    """Compare vendors of both databases."""
+    VendorDiff().start(['nmapos', 'cpeos'])
+    return NmapOS(readonly=True).count() + CPEOS(readonly=True).count()
+
+PHASES = [
+    ('init', phase_init),
+    ('populate_cpeos', phase_populate_cpeos),
+    ('populate_nmapos', phase_populate_nmapos),
+    ('search', phase_search),
+    ('lookup', phase_lookup),
+    ('translate', phase_translate),
+    ('diff', phase_diff),
+]
+
+
+def _run_phase(func, ctx, queue):
+    """Child process: run func quietly and report its measurements."""
+    devnull = open(os.devnull, 'w')
+    os.dup2(devnull.fileno(), sys.stdout.fileno())
+
+    start = time.time()
+    try:
+        rows = func(ctx)
+    except Exception, err:
+        queue.put({'error': repr(err), 'wall': 0})
+        raise
+    wall = time.time() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put({
+        'wall': round(wall, 4),
+        'rows': rows,
+        'rows_per_sec': round(rows / wall, 1) if wall > 0 else None,
+        'peak_rss_kb': peak
+    })
+
+def _wait_phase(proc, queue):
+    """Return the measurements reported by the phase process proc, or an error
+    if it died without reporting (eg. killed by the OOM killer).
+    """
+    while True:
+        try:
+            return queue.get(timeout=PHASE_POLL_INTERVAL)
+        except Empty:
+            if not proc.is_alive():
+                break
+    # the result may have been sent right before exiting
+    try:
+        return queue.get(timeout=PHASE_POLL_INTERVAL)
+    except Empty:
+        return {'error': 'phase process exited with code %s' % proc.exitcode,
+            'wall': 0}
+
+def run(scale, workdir):
+    """Run all the phases in workdir. Return the results as a dict."""
+    datadir = os.path.join(workdir, DATADIR)
+    os.makedirs(datadir)
+    shutil.copy(os.path.join(os.getcwd(), DATADIR, SQLITE_INIT_SCRIPT), datadir)
+
+    start = time.time()
+    nmap_path, cpe_path = synthetic.generate(workdir, scale)
+    ctx = {'nmap_path': nmap_path, 'cpe_path': cpe_path}
+    results = {
+        'scale': scale,
+        'generation_time': round(time.time() - start, 4),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'phases': {}
+    }
+
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        for name, func in PHASES:
+            queue = multiprocessing.Queue()
+            proc = multiprocessing.Process(target=_run_phase, args=(func, ctx, queue))
+            proc.start()
+            res = _wait_phase(proc, queue)
+            proc.join()
+            results['phases'][name] = res
+            sys.stderr.write('%-16s %8.3fs\n' % (name, res['wall']))
+    finally:
+        os.chdir(cwd)
+    return results
+
+def main():
+    """Benchmark entry point."""
+    try:
+        opts, _ = getopt.gnu_getopt(sys.argv[1:], '', ['scale=', 'output=', 'keep'])
+    except getopt.GetoptError, err:
+        sys.exit(str(err))
+
+    scale = 1.
+    output = None
+    keep = False
+    for opt, val in opts:
+        if opt == '--scale':
+            scale = float(val)
+        elif opt == '--output':
+            output = val
+        elif opt == '--keep':
+            keep = True
+
+    workdir = tempfile.mkdtemp(prefix='cpelab-bench-')
+    try:
+        results = run(scale, workdir)
+    finally:
+        if keep:
+            sys.stderr.write('Data kept in %s\n' % workdir)
+        else:
+            shutil.rmtree(workdir)
+
+    dump = json.dumps(results, indent=2, sort_keys=True)
+    if output is None:
+        print dump
+    else:
+        fout = open(output, 'w')
+        fout.write(dump + '\n')
+        fout.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+#!/usr/bin/python
+#
+# Author:
+# Henri Doreau <henri.doreau@greenbone.net>
+#
+# Copyright:
+# Copyright (C) 2011 Greenbone Networks GmbH, http://www.greenbone.net
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2
+# (or any later version), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301 USA.
+##
+
+
+"""Deterministic generator of synthetic upstream databases.
+
+Produce nmap-os-db and CPE dictionary (2.2 XML) files which look like the real
+feeds (vendors, products, version schemes, deprecated items, non OS entries)
+at a configurable scale, so that benchmarks don't depend on the live feeds.
+
+Usage: python -m bench.synthetic [scale] [output directory]
+"""
+
+import os
+import sys
+import random
+from xml.sax.saxutils import quoteattr, escape
+
+
+# Size of the real feeds at scale 1
+NMAP_FINGERPRINTS = 5000
+CPE_ITEMS = 100000
+
+# Share of CPE items which are applications (filtered out on load)
+CPE_APPLICATIONS_RATIO = 0.6
+# Share of deprecated CPE items
+CPE_DEPRECATED_RATIO = 0.03
+
+SEED = 2011
+
+VENDORS = [
+    ('microsoft', 'windows', ['xp', 'vista', '7', '2000', 'server_2003', 'server_2008', 'nt']),
+    ('linux', 'linux_kernel', ['2.4.%d', '2.6.%d', '3.%d']),
+    ('freebsd', 'freebsd', ['%d.0', '%d.1', '%d.2']),
+    ('openbsd', 'openbsd', ['4.%d', '3.%d']),
+    ('netbsd', 'netbsd', ['%d.0', '%d.1']),
+    ('apple', 'mac_os_x', ['10.%d', '10.%d.8']),
+    ('apple', 'iphone_os', ['%d.0', '%d.1']),
+    ('sun', 'solaris', ['%d', '2.%d']),
+    ('ibm', 'aix', ['%d.1', '%d.2', '%d.3']),
+    ('hp', 'hp-ux', ['11.%d', '10.%d']),
+    ('cisco', 'ios', ['12.%d', '15.%d']),
+    ('juniper', 'junos', ['%d.1', '%d.4']),
+    ('netgear', 'firmware', ['%d.0.1']),
+    ('d-link', 'dir-%d00_firmware', ['1.%d']),
+    ('hp', 'jetdirect', ['%d']),
+    ('vmware', 'esx_server', ['%d.0', '%d.5']),
+]
+
+UPDATES = ['', '', '', 'sp1', 'sp2', 'sp3', 'rc1', 'beta']
+EDITIONS = ['', '', '', 'professional', 'enterprise', 'x64']
+DEVTYPES = ['general purpose', 'general purpose', 'router', 'switch', 'WAP',
+    'printer', 'firewall', 'storage-misc', 'phone']
+APP_WORDS = ['server', 'client', 'browser', 'office', 'player', 'manager',
+    'suite', 'studio', 'toolkit', 'engine', 'agent', 'viewer']
+
+
+def _version(rnd, scheme):
+    """Return a version number following scheme."""
+    if '%d' in scheme:
+        return scheme % rnd.randint(0, 40)
+    return scheme
+
+def _product(rnd, product):
+    """Instantiate product name templates."""
+    if '%d' in product:
+        return product % rnd.randint(1, 9)
+    return product
+
+def _title(*words):
+    """Return a human readable title from CPE components."""
+    return ' '.join([x.replace('_', ' ') for x in words if x]).title()
+
+def _cpe_name(*components):
+    """Return a CPE name from its components, empty trailing ones omitted."""
+    components = list(components)
+    while components[-1] == '':
+        components.pop()
+    return 'cpe:/' + ':'.join(components)
+
+def write_cpe_dictionary(fout, count, seed=SEED):
+    """Write a CPE dictionary of count items to the file object fout."""
+    rnd = random.Random(seed)
+    fout.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    fout.write('<cpe-list xmlns="http://cpe.mitre.org/dictionary/2.0">\n')
+
+    seen = set()
+    for idx in xrange(count):
+        vendor, product, schemes = rnd.choice(VENDORS)
+        product = _product(rnd, product)
+        if rnd.random() < CPE_APPLICATIONS_RATIO:
+            part = 'a'
+            product = '%s_%s' % (product, rnd.choice(APP_WORDS))
+        elif rnd.random() < 0.1:
+            part = 'h'
+        else:
+            part = 'o'
+        version = _version(rnd, rnd.choice(schemes))
+        update = rnd.choice(UPDATES)
+        edition = rnd.choice(EDITIONS)
+
+        name = _cpe_name(part, vendor, product, version, update, edition)
+        if name in seen:
+            # the space of realistic names is limited: tell duplicates apart
+            # with an update only used here (and unique as idx is)
+            update = 'build%d' % idx
+            name = _cpe_name(part, vendor, product, version, update, edition)
+        else:
+            seen.add(name)
+
+        attrs = 'name=%s' % quoteattr(name)
+        if rnd.random() < CPE_DEPRECATED_RATIO:
+            attrs += ' deprecated="true" deprecation_date="2010-12-28T17:36:02.240Z"'
+        fout.write('  <cpe-item %s>\n' % attrs)
+        fout.write('    <title xml:lang="en-US">%s</title>\n' \
+            % escape(_title(vendor, product, version, update, edition)))
+        fout.write('    <title xml:lang="ja-JP">%s</title>\n' % escape(name))
+        fout.write('  </cpe-item>\n')
+
+    fout.write('</cpe-list>\n')
+
+def write_nmap_os_db(fout, count, seed=SEED):
+    """Write a nmap-os-db of count fingerprints to the file object fout."""
+    rnd = random.Random(seed)
+    fout.write('# Synthetic nmap-os-db, see bench/synthetic.py\n\n')
+
+    for idx in xrange(count):
+        vendor, product, schemes = rnd.choice(VENDORS)
+        product = _product(rnd, product).replace('_', ' ')
+        version = _version(rnd, rnd.choice(schemes))
+        fout.write('# fingerprint %d\n' % idx)
+        fout.write('Fingerprint %s\n' % _title(vendor, product, version,
+            rnd.choice(UPDATES)))
+        for _ in xrange(rnd.randint(1, 3)):
+            nmap_version = '.'.join(version.split('.')[:2])
+            if rnd.random() < 0.5:
+                nmap_version += '.X'
+            fout.write('Class %s | %s | %s | %s\n' % (vendor.title(),
+                product.title(), nmap_version, rnd.choice(DEVTYPES)))
+            fout.write('CPE cpe:/o:%s:%s:%s\n' % (vendor, product.replace(' ', '_'),
+                version))
+        fout.write('SEQ(SP=%X%%GCD=1%%ISR=%X%%TI=I%%II=I%%SS=S%%TS=7)\n' \
+            % (rnd.randint(0, 255), rnd.randint(0, 255)))
+        fout.write('OPS(O1=M5B4NW2NNT11%O2=M5B4NW2NNT11%O3=M5B4NW2NNT11)\n')
+        fout.write('WIN(W1=FFFF%W2=FFFF%W3=FFFF%W4=FFFF%W5=FFFF%W6=FFFF)\n')
+        fout.write('ECN(R=Y%DF=Y%T=40%W=FFFF%O=M5B4NW2SLL%CC=N%Q=)\n\n')
+
+def generate(directory, scale=1):
+    """Generate both databases in directory, at the given scale. Return the
+    paths of the nmap-os-db and of the CPE dictionary.
+    """
+    nmap_path = os.path.join(directory, 'nmap-os-db')
+    cpe_path = os.path.join(directory, 'official-cpe-dictionary_v2.2.xml')
+
+    fout = open(nmap_path, 'w')
+    write_nmap_os_db(fout, int(NMAP_FINGERPRINTS * scale))
+    fout.close()
+
+    fout = open(cpe_path, 'w')
+    write_cpe_dictionary(fout, int(CPE_ITEMS * scale))
+    fout.close()
+
+    return nmap_path, cpe_path
+
+
+if __name__ == '__main__':
+    SCALE = float(sys.argv[1]) if len(sys.argv) > 1 else 1
+    OUTDIR = sys.argv[2] if len(sys.argv) > 2 else '.'
+    for path in generate(OUTDIR, SCALE):
+        print path
@@ -28,23 +28,26 @@
 
 import sys
 
-from cpelab.databases.utils import DBSpecParser, DBSpecError
-from cpelab.tools.toolbase import RuntimeToolError, InitDB, UpdateDB, StatsDB
-from cpelab.tools.toolbase import SearchDB
-from cpelab.tools.comparison import VendorDiff, VendorCommon
-from cpelab.tools.translation import NmapOS2CPE
-
-
-# List of available processing modules
-TOOLS_MAP = {
-    InitDB.str_id: InitDB,
-    UpdateDB.str_id: UpdateDB,
-    StatsDB.str_id: StatsDB,
-    SearchDB.str_id: SearchDB,
-    VendorDiff.str_id: VendorDiff,
-    VendorCommon.str_id: VendorCommon,
-    NmapOS2CPE.str_id: NmapOS2CPE
-}
+from cpelab.registry import Registry
+from cpelab.databases.utils import DB_MAP
+
+
+# List of available processing modules. labctl is run once per lookup by
+# scanners: modules are only imported when their command runs.
+TOOLS_MAP = Registry([
+    ('init', 'cpelab.tools.toolbase:InitDB'),
+    ('update', 'cpelab.tools.toolbase:UpdateDB'),
+    ('stats', 'cpelab.tools.toolbase:StatsDB'),
+    ('search', 'cpelab.tools.toolbase:SearchDB'),
+    ('vendor-diff', 'cpelab.tools.comparison:VendorDiff'),
+    ('vendor-common', 'cpelab.tools.comparison:VendorCommon'),
+    ('diff', 'cpelab.tools.comparison:FieldDiff'),
+    ('common', 'cpelab.tools.comparison:FieldCommon'),
+    ('nmapos2cpe', 'cpelab.tools.translation:NmapOS2CPE'),
+    ('serve', 'cpelab.tools.server:Serve'),
+    ('match', 'cpelab.tools.matching:CPEMatch'),
+    ('export', 'cpelab.tools.export:Export')
+])
 
 
 class LabCLI:
@@ -54,6 +57,8 @@ class LabCLI:
     def __init__(self, args=sys.argv):
         """Initialize a new CLI instance."""
         self._args = args
+        self._profile = False
+        self._profile_dump = None
         try:
             self.run_cmd()
         except IndexError:
@@ -61,21 +66,71 @@ class LabCLI:
 
     def run_cmd(self):
         """Quickly parse command line and execute desired actions."""
-        cmd = self._args[1]
+        args = self._parse_global_options(self._args[1:])
+        cmd = args[0]
 
         if cmd == 'help':
             # specific case for help, which is not implemented as a tool
-            sys.exit(self._cmd_help(self._args[2]))
+            sys.exit(self._cmd_help(args[1]))
 
         if not TOOLS_MAP.has_key(cmd):
             raise LabCLIError('Unknown command: %s' % cmd)
 
         tool = TOOLS_MAP[cmd]
+        # tool modules all depend on toolbase
+        from cpelab.tools.toolbase import RuntimeToolError
         try:
-            tool().start(self._args[2::])
+            self._run_tool(tool, args[1:])
         except RuntimeToolError, err:
             sys.exit(tool.help_msg(err=str(err)))
 
+    def _parse_global_options(self, args):
+        """Handle the options preceding the command. Return the remaining
+        arguments.
+        """
+        args = list(args)
+        trace_sql = False
+        while len(args) > 0 and args[0].startswith('--'):
+            opt = args.pop(0)
+            if opt == '--profile':
+                self._profile = True
+            elif opt.startswith('--profile='):
+                self._profile = True
+                self._profile_dump = opt.split('=', 1)[1]
+            elif opt == '--trace-sql':
+                trace_sql = True
+            else:
+                raise LabCLIError('Unknown option: %s' % opt)
+
+        if self._profile or trace_sql:
+            from cpelab import profiling
+            profiling.enable(trace_sql)
+        return args
+
+    def _run_tool(self, tool, args):
+        """Run a tool, and report profiling information if requested."""
+        if not self._profile:
+            tool().start(args)
+            return
+
+        import cProfile
+        from cpelab import profiling
+        profiler = None
+        if self._profile_dump is not None:
+            profiler = cProfile.Profile()
+        try:
+            with profiling.timer('total'):
+                if profiler is not None:
+                    profiler.runcall(tool().start, args)
+                else:
+                    tool().start(args)
+        finally:
+            sys.stderr.write('\n%s\n' % profiling.summary())
+            if profiler is not None:
+                profiler.dump_stats(self._profile_dump)
+                sys.stderr.write('cProfile statistics written to %s\n' \
+                    % self._profile_dump)
+
     def _cmd_help(self, modname):
         """Display help for a specific external processing module."""
         if TOOLS_MAP.has_key(modname):
@@ -88,11 +143,16 @@ class LabCLIError(Exception):
 
 def usage(reason=''):
     """Print usage hint and exit."""
-    dblist = ' '.join([x.str_id for x in DBSpecParser('all')])
+    dblist = ' '.join(DB_MAP.keys())
     modlist = '\n  '.join(TOOLS_MAP.keys())
 
     sys.exit("""%s
-Usage: cpelab <cmd> [parameters...]
+Usage: cpelab [options] <cmd> [parameters...]
+options:
+  --profile[=<file>]  Display time spent per phase and event counters on exit,
+                      optionally dump cProfile statistics to file
+  --trace-sql         Log every SQL statement and its duration to stderr
+
 commands:
   help <cmd>  Display help for a given command
 
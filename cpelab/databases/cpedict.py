@@ -25,26 +25,44 @@
 
 """CPE dictionary manipulation module"""
 
-import urllib
-import tempfile
 import xml.sax
 
 from xml.sax.handler import ContentHandler
 
-from cpelab.databases.db import Database, DBEntry
+from cpelab import profiling
+from cpelab.databases.db import Database, DBEntry, DBError, BulkLoader
+from cpelab.databases.db import BULK_BATCH_SIZE
+from cpelab.databases.source import open_source, READ_CHUNK
+from cpelab.databases.versions import version_key
 
 
 CPE_DICT_LOCATION = 'http://static.nvd.nist.gov/feeds/xml/cpe/dictionary/official-cpe-dictionary_v2.2.xml'
 
+# Temporary table receiving the upstream dictionary during incremental updates
+CPE_STAGING_TABLE = 'cpeos_staging'
+
+# Components of a CPE (2.2) name, in order
+CPE_COMPONENTS = ['part', 'vendor', 'product', 'version', 'update', 'edition',
+    'language']
+
+
+def split_cpe_name(name):
+    """Return the list of the components of a CPE name (cpe:/part:vendor:...),
+    missing trailing components are empty.
+    """
+    items = name[5:].split(':')
+    while len(items) < len(CPE_COMPONENTS):
+        items.append('')
+    return items
+
 
 class CPEOS(Database):
     """CPE dictionary subset: operating systems and hardware."""
     str_id = 'cpeos'
 
-    def __init__(self):
-        """
-        """
-        Database.__init__(self)
+    def __init__(self, readonly=False):
+        """Initialize a new CPE dictionary instance."""
+        Database.__init__(self, readonly)
         self.fields_map = {
             'title': 'cpe_title',
             'name': 'cpe_name',
@@ -54,42 +72,164 @@ class CPEOS(Database):
             'version': 'cpe_version',
             'update': 'cpe_update',
             'edition': 'cpe_edition',
-            'language': 'cpe_language'
+            'language': 'cpe_language',
+            'version_key': 'cpe_version_key'
         }
         self._search_fields = ['title', 'name']
-
-    def populate(self):
-        """Load items into the corresponding table of the database."""
-        print '[+] Updating %s...' % str(CPEOS.str_id)
-
-        full_db, _ = urllib.urlretrieve(CPE_DICT_LOCATION)
-        #full_db = "official-cpe-dictionary_v2.2.xml"
-
+        self._dead_column = 'deprecated'
+        self._breakdown_fields = ['part']
+
+    def read_source(self, source=None, incremental=False):
+        """Stream the dictionary from source (defaults to the upstream
+        location) and yield lists of rows: the item values followed by their
+        deprecation flag and version key. Deprecated items are only kept in
+        incremental mode.
+        """
+        fin = open_source(source or CPE_DICT_LOCATION)
+        self.check_source(fin)
+        return self._parse(fin, incremental)
+
+    def _parse(self, fin, incremental):
+        """Parse the dictionary from fin, see read_source()."""
+        rows = []
+        parser = xml.sax.make_parser()
+        parser.setContentHandler(CPEFilter(rows.append, 'oh',
+            keep_deprecated=incremental))
+
+        while True:
+            chunk = fin.read(READ_CHUNK)
+            if chunk:
+                parser.feed(chunk)
+            else:
+                parser.close()
+            if len(rows) >= BULK_BATCH_SIZE or (not chunk and len(rows) > 0):
+                # the handler keeps appending to the same list
+                yield list(rows)
+                del rows[:]
+            if not chunk:
+                break
+        fin.close()
+
+    def begin_load(self, incremental=False):
+        """Prepare the table (or, in incremental mode, a staging table) for
+        loading and return a started BulkLoader.
+        """
         print '[+] Storing base...'
 
-        xml.sax.parse(full_db, CPEFilter(self, 'oh'))
-
-        self.db_cnx.commit()
-
-        # XXX display statistics
-        print '[+] Update complete!'
+        columns = CPEItem.db_columns + ['deprecated', 'cpe_version_key']
+        if incremental:
+            self.db_cnx.execute('CREATE TEMP TABLE IF NOT EXISTS %s AS'
+                ' SELECT %s FROM %s WHERE 0' % (CPE_STAGING_TABLE,
+                ','.join(columns), self.str_id))
+            loader = BulkLoader(self, columns, table=CPE_STAGING_TABLE)
+        else:
+            loader = BulkLoader(self, columns)
+
+        loader.start()
+        return loader
+
+    def end_load(self, loader, incremental=False):
+        """Complete the loading. In incremental mode, the existing table is
+        only updated with the differences from the new dictionary (see
+        _merge_staging), and so are the search index and the statistics.
+        """
+        loader.finish()
+
+        print '[+] %s' % str(loader)
+
+        if incremental:
+            counts = self._merge_staging()
+            print '[+] %s: %d added, %d changed, %d deprecated' \
+                % (self.str_id, counts['added'],
+                   counts['changed'] + counts['restored'], counts['deprecated'])
+            if sum(counts.values()) == 0:
+                # same content
+                return
+
+        if not incremental or not self.has_search_index():
+            if not self.build_search_index():
+                print '[!] No FTS5 support in SQLite, searches will be slower'
+
+        self.set_fingerprint(loader.fingerprint())
+        # statistics only depend on the set of live items, not on titles
+        if not incremental or counts['added'] + counts['restored'] \
+                + counts['deprecated'] > 0:
+            self.store_stats()
+
+    @profiling.timed('merge')
+    def _merge_staging(self):
+        """Apply the differences between the staging table and the current
+        content of the database. New items are inserted, items which title
+        changed (or which are not deprecated anymore) are updated and items
+        deprecated upstream are flagged as such. The search index, if any,
+        is updated accordingly. Return the number of items per status: added,
+        changed (title), restored (not deprecated anymore) and deprecated.
+        """
+        cnx = self.db_cnx
+        cnx.execute('CREATE INDEX IF NOT EXISTS %(s)s_name_idx ON %(s)s (cpe_name)' \
+            % {'s': CPE_STAGING_TABLE})
+        cnx.execute('DROP TABLE IF EXISTS temp.cpeos_delta')
+        cnx.execute('CREATE TEMP TABLE cpeos_delta (cpe_name PRIMARY KEY, status)')
+        cnx.execute("""INSERT INTO cpeos_delta
+            SELECT s.cpe_name, CASE WHEN c.id IS NULL THEN 'added'
+                                    WHEN s.deprecated THEN 'deprecated'
+                                    WHEN c.deprecated THEN 'restored'
+                                    ELSE 'changed' END
+            FROM %(s)s s LEFT JOIN %(t)s c ON c.cpe_name = s.cpe_name
+            WHERE (c.id IS NULL AND NOT s.deprecated)
+               OR (c.id IS NOT NULL AND s.deprecated AND NOT c.deprecated)
+               OR (c.id IS NOT NULL AND NOT s.deprecated
+                   AND (c.cpe_title != s.cpe_title OR c.deprecated))""" \
+            % {'s': CPE_STAGING_TABLE, 't': self.str_id})
+
+        counts = dict([(x, 0) for x in ['added', 'changed', 'restored', 'deprecated']])
+        counts.update(cnx.execute('SELECT status, COUNT(*) FROM cpeos_delta GROUP BY status'))
+
+        # titles are indexed: modified rows are removed from the index first
+        updated = "cpe_name IN (SELECT cpe_name FROM cpeos_delta WHERE" \
+            " status IN ('changed', 'restored'))"
+        self.update_search_index(updated, remove=True)
+
+        columns = ','.join(CPEItem.db_columns + ['cpe_version_key'])
+        cnx.execute("""INSERT INTO %(t)s (%(c)s, deprecated)
+            SELECT %(c)s, 0 FROM %(s)s WHERE cpe_name IN
+                (SELECT cpe_name FROM cpeos_delta WHERE status = 'added')""" \
+            % {'s': CPE_STAGING_TABLE, 't': self.str_id, 'c': columns})
+        cnx.execute("""UPDATE %(t)s SET deprecated = 0, last_update = date(),
+                cpe_title = (SELECT cpe_title FROM %(s)s s WHERE s.cpe_name = %(t)s.cpe_name)
+            WHERE %(u)s""" % {'s': CPE_STAGING_TABLE, 't': self.str_id, 'u': updated})
+        cnx.execute("""UPDATE %(t)s SET deprecated = 1, last_update = date()
+            WHERE cpe_name IN (SELECT cpe_name FROM cpeos_delta WHERE status = 'deprecated')""" \
+            % {'t': self.str_id})
+        self.update_search_index("cpe_name IN (SELECT cpe_name FROM cpeos_delta"
+            " WHERE status IN ('added', 'changed', 'restored'))")
+
+        cnx.execute('DROP TABLE %s' % CPE_STAGING_TABLE)
+        cnx.execute('DROP TABLE cpeos_delta')
+        self.commit()
+
+        return counts
 
     def _make_item(self, data):
         """Make and return an item (object) from selected fields from the database."""
-        item = CPEItem()
-        # data[0] is the DB id, discard it
-        item.update({'title': data[1], 'name': data[2]})
-        return item
+        # data[0] is the DB id, discard it along with trailing columns
+        return CPEItem(data[1:len(CPEItem.fields_order) + 1])
 
 class CPEFilter(ContentHandler):
-    """Produce a reduced CPE dict with only non-deprecated OS related entries
-    and store the valid entries into the database."""
-    def __init__(self, db, valid_parts):
-        """Initialize a new CPEFilter instance."""
+    """Produce a reduced CPE dict with only (non-deprecated) OS related
+    entries, handed over as rows to be loaded into the database."""
+    def __init__(self, add_row, valid_parts, keep_deprecated=False):
+        """Initialize a new CPEFilter instance. Valid items are handed over to
+        the add_row callback as rows, followed by their deprecation flag and
+        version key. Deprecated items are discarded unless keep_deprecated is
+        set.
+        """
         ContentHandler.__init__(self)
-        self.db = db
+        self.add_row = add_row
         self._tmp_item = None
+        self._tmp_deprecated = False
         self._valid_parts = valid_parts
+        self._keep_deprecated = keep_deprecated
 
         # internal parsing flag
         self._in_title = False
@@ -105,13 +245,15 @@ class CPEFilter(ContentHandler):
             return
 
         if name == 'cpe-item':
-            if attrs.has_key('deprecated'):
+            deprecated = attrs.has_key('deprecated')
+            if deprecated and not self._keep_deprecated:
                 self._discard = True
             else:
                 # 5th char of a CPE name is the part (cpe:/a:...)
                 if attrs['name'][5] in self._valid_parts:
                     self._tmp_item = CPEItem()
                     self._tmp_item.update({'name': attrs['name']})
+                    self._tmp_deprecated = deprecated
                 else:
                     self._discard = True
         elif (not self._discard) and (name == 'title') and (attrs['xml:lang'] == 'en-US'):
@@ -122,7 +264,8 @@ class CPEFilter(ContentHandler):
         """Callback: ending XML tag"""
         if name == 'cpe-item':
             if self._tmp_item is not None:
-                self._tmp_item.save(self.db)
+                self.add_row(self._tmp_item.as_row() + (int(self._tmp_deprecated),
+                    version_key(self._tmp_item['version'])))
             self._tmp_item = None
             self._discard = False
         elif name == 'title':
@@ -138,6 +281,13 @@ class CPEFilter(ContentHandler):
 
 class CPEItem(DBEntry):
     """Represent a single entry from the CPE dictionary."""
+    __slots__ = ()
+
+    fields_order = ['title', 'name', 'part', 'vendor', 'product', 'version',
+        'update', 'edition', 'language']
+    db_columns = ['cpe_' + x for x in fields_order]
+    _field_index = dict([(x, i) for i, x in enumerate(fields_order)])
+
     def update(self, components):
         """Update an existing instance."""
         if components.has_key('title'):
@@ -146,11 +296,7 @@ class CPEItem(DBEntry):
             name = components['name'].lower()
             self.fields['name'] = name
 
-            name = name[5::]
-            items = name.split(':')
-            while len(items) < 7:
-                items.append('')
-
+            items = split_cpe_name(name)
             self.fields['part'] = items[0]
             self.fields['vendor'] = items[1]
             self.fields['product'] = items[2]
@@ -159,16 +305,6 @@ class CPEItem(DBEntry):
             self.fields['edition'] = items[5]
             self.fields['language'] = items[6]
 
-    def save(self, db):
-        """Store a new item into the database."""
-        fields = ['title', 'name', 'part', 'vendor', 'product', 'version',
-            'update', 'edition', 'language']
-
-        t = tuple([self.fields[x] for x in fields])
-        fdesc = ','.join(['cpe_' + x for x in fields])
-
-        db.db_cnx.execute('INSERT INTO %s (%s) VALUES (?,?,?,?,?,?,?,?,?)' % (db.str_id, fdesc), t)
-
     def __str__(self):
         """Return a human readable representation."""
         lines = []
@@ -176,3 +312,85 @@ class CPEItem(DBEntry):
             lines.append('%s => %s' % (k.encode("utf-8"), self.fields[k].encode("utf-8")))
         return '\n'.join(lines) + '\n'
 
+class CPENameMatcher:
+    """Match CPE names against the dictionary, component by component.
+
+    Queries are CPE names (lower case) which components may hold wildcards:
+    '*' matches any sequence of characters and '?' any single character. An
+    empty (or missing) component stands for any value in superset mode, and
+    for an empty one in the other modes: use '*' for any value.
+    Matching modes are:
+      equal     names equal to the query
+      superset  names the query is a superset of: the query matches them
+      subset    names the query is a subset of: they match the query, ie.
+                each of their components is either empty or matches the
+                query
+    Conditions map to the composite index over the name components, so that
+    the cost depends on the number of matches rather than on the size of the
+    dictionary, as long as the first components have no leading wildcard.
+    """
+    modes = ['equal', 'superset', 'subset']
+
+    def __init__(self, db):
+        """Initialize a new matcher on the given CPEOS instance."""
+        self.db = db
+
+    def match(self, name, mode='superset', limit=None):
+        """Iterate over the items matching the CPE name."""
+        if mode not in self.modes:
+            raise DBError('Unknown matching mode: %s' % mode)
+        if not name.startswith('cpe:/') or name.count(':') > len(CPE_COMPONENTS):
+            raise DBError('Invalid CPE name: %s' % name)
+        if isinstance(name, str):
+            name = name.decode('utf-8')
+
+        conditions = []
+        elems = []
+        for field, value in zip(CPE_COMPONENTS, split_cpe_name(name.lower())):
+            cond, args = self._condition(self.db.dbfield(field), value, mode)
+            if cond is not None:
+                conditions.append(cond)
+                elems.extend(args)
+        conditions.append(self.db.live_filter())
+
+        query = 'select * from %s where %s order by %s' % (self.db.str_id,
+            ' and '.join(conditions),
+            ','.join([self.db.dbfield(x) for x in CPE_COMPONENTS]))
+        if limit is not None:
+            query += ' limit %d' % limit
+
+        for res in self.db.db_cnx.execute(query, elems):
+            yield self.db._make_item(res)
+
+    def _condition(self, column, value, mode):
+        """Return the SQL condition (or None) on column for a query component,
+        and its parameters.
+        """
+        if value == '':
+            if mode == 'superset':
+                return None, []
+            return '%s = ?' % column, ['']
+
+        if value.strip('*') == '':
+            return None, []
+
+        if '*' not in value and '?' not in value:
+            if mode == 'subset':
+                return '%s in (?, ?)' % column, ['', value]
+            return '%s = ?' % column, [value]
+
+        if mode == 'subset':
+            return "(%s = '' or %s glob ?)" % (column, column), [_glob(value)]
+
+        prefix = value.rstrip('*')
+        if '*' not in prefix and '?' not in prefix:
+            # literal prefix: index range scan
+            upper = prefix[:-1] + unichr(ord(prefix[-1]) + 1)
+            return '%s >= ? and %s < ?' % (column, column), [prefix, upper]
+        return '%s glob ?' % column, [_glob(value)]
+
+def _glob(pattern):
+    """Return the GLOB expression for a component pattern (only '*' and '?'
+    are special).
+    """
+    return pattern.replace('[', '[[]')
@@ -26,50 +26,290 @@
 """Base cpelab databases manipulation module"""
 
 import os
+import re
+import time
+import hashlib
+import itertools
 import sqlite3
+import threading
+
+from cpelab import profiling
 
 DATADIR = 'data'
 SQLITE_DB_FILE = 'cpelab.db'
 SQLITE_INIT_SCRIPT = 'cpelab_init.sql'
 
+# Bookkeeping tables, see cpelab_init.sql
+DBINFO_TABLE = 'dbinfo'
+TRANSCACHE_TABLE = 'transcache'
+DBSTATS_TABLE = 'dbstats'
+
+# Number of vendors listed in the statistics
+STATS_TOP_VENDORS = 10
+
+# Number of rows sent to the database per executemany() call while bulk loading
+BULK_BATCH_SIZE = 5000
+
+# Pragmas applied to every connection. WAL lets readers run concurrently with
+# a writer, reads are served from a memory mapping of the file when possible.
+CONNECTION_PRAGMAS = [
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('mmap_size', '268435456'),
+    ('cache_size', '-32768')
+]
+
+# Pragmas applied for the duration of a load transaction. The tables are being
+# rebuilt from upstream data anyway, so there is no point paying for durability.
+BULK_PRAGMAS = {
+    'synchronous': 'OFF',
+    'cache_size': '-65536'
+}
+
+# Full-text search indexes use the FTS5 trigram tokenizer, which indexes every
+# 3-characters substring and can therefore serve arbitrary LIKE patterns, as
+# long as their literal parts are at least that long.
+FTS_MIN_TERM_LENGTH = 3
+
+# Approximate lookups only read the posting lists of the rarest trigrams of the
+# text, which bounds their cost whatever the size of the table.
+SIMILAR_MAX_GRAMS = 8
+
+
+# Connections shared by the Database instances, per thread
+_CONNECTIONS = threading.local()
+
+# Load transactions in progress, see LoadTransaction
+# {connection id: [nesting depth, failed, regular isolation level and pragmas]}
+_LOAD_TRANSACTIONS = {}
+
+
+def get_connection(path, readonly=False):
+    """Return a connection to the SQLite database at path. Connections are
+    opened on first use and then shared by all the callers of the current
+    thread (and process). Read-only connections reject any modification.
+    """
+    pid = os.getpid()
+    if getattr(_CONNECTIONS, 'pid', None) != pid:
+        # first use in this thread, or forked process: never reuse connections
+        # inherited from the parent
+        _CONNECTIONS.pid = pid
+        _CONNECTIONS.pool = {}
+
+    key = (path, readonly)
+    if not _CONNECTIONS.pool.has_key(key):
+        if profiling.enabled():
+            cnx = sqlite3.connect(path, factory=profiling.TracingConnection)
+        else:
+            cnx = sqlite3.connect(path)
+        for pragma, value in CONNECTION_PRAGMAS:
+            cnx.execute('PRAGMA %s = %s' % (pragma, value))
+        if readonly:
+            cnx.execute('PRAGMA query_only = ON')
+        _CONNECTIONS.pool[key] = cnx
+    return _CONNECTIONS.pool[key]
 
 class Database:
     """Base (abstract) class for DB. Define a common interface for subclasses."""
 
     str_id = None
 
-    def __init__(self):
-        """Initialize a new DB."""
+    def __init__(self, readonly=False):
+        """Initialize a new DB. Read-only instances are meant for query tools
+        and reject modifications.
+        """
         self.path = os.path.join(os.getcwd(), DATADIR, SQLITE_DB_FILE)
-        self.db_cnx = sqlite3.connect(self.path)  # eager connection
+        self.db_cnx = get_connection(self.path, readonly)
         self.fields_map = {}
         self._search_fields = []
+        # column flagging the items lookups and counts ignore, if any (see
+        # live_filter())
+        self._dead_column = None
+        # fields for which statistics give the number of distinct values (they
+        # should be indexed) and the number of items per value
+        self._distinct_fields = ['vendor', 'product']
+        self._breakdown_fields = []
+        self._has_fts = None
+        # digest of the source being read, if known (see check_source())
+        self.read_digest = None
+        # digest of the source of the last update, if given by the caller
+        # (see assume_loaded_digest())
+        self._loaded_digest = None
+        self._loaded_digest_given = False
 
     def initialize(self):
         """Call the DB initialization script. Delete everything and re-create
         empty tables.
         """
+        # views go first: the script can't drop them by name, as older
+        # versions of the schema had tables instead
+        cursor = self.db_cnx.execute('select name from sqlite_master where'
+            " type = 'view'")
+        for (name,) in cursor.fetchall():
+            self.db_cnx.execute('DROP VIEW %s' % name)
+
         initfile = os.path.join(os.getcwd(), DATADIR, SQLITE_INIT_SCRIPT)
         fin = open(initfile)
         self.db_cnx.executescript(fin.read())
         self.db_cnx.commit()
         fin.close()
 
+    def populate(self, source=None, incremental=False):
+        """Update the local copy of the database from source (URL, local file,
+        possibly gzip or xz compressed, or '-' for stdin), defaults to the
+        upstream location. In incremental mode, only the differences are
+        applied (when supported).
+        """
+        print '[+] Updating %s...' % self.str_id
+        try:
+            batches = self.read_source(source, incremental)
+        except SourceUnchanged:
+            print '[+] %s: source unchanged since the last update' % self.str_id
+            return
+
+        # parse the beginning of the source before touching the tables, so
+        # that empty or malformed sources are rejected right away
+        with profiling.timer('parse'):
+            rows = next(batches, None)
+        if rows is None:
+            raise DBError('No entries found in the %s source' % self.str_id)
+
+        # a failure past this point restores the previous content
+        with LoadTransaction(self.db_cnx):
+            loader = self.begin_load(incremental)
+            try:
+                while rows is not None:
+                    loader.extend(rows)
+                    with profiling.timer('parse'):
+                        rows = next(batches, None)
+            except:
+                loader.abort()
+                raise
+            self.end_load(loader, incremental)
+            self.set_loaded_digest(self.read_digest)
+        print '[+] Update complete!'
+
+    def read_source(self, source=None, incremental=False):
+        """Open source and return an iterator over lists of rows to be stored,
+        parsed as the source is read. Unavailable sources are reported right
+        away, before the tables are modified. The local database is only
+        queried by loaded_digest(), which other processes can be given the
+        answer of: several sources can be read concurrently while a single
+        writer stores their rows.
+
+        Raise SourceUnchanged if the source is the one of the last update (see
+        check_source()).
+        """
+        raise NotImplementedError('Abstract method subclasses must implement')
+
+    def check_source(self, fin):
+        """Remember the digest of the source opened as fin (see
+        cpelab.databases.source.open_source()) and raise SourceUnchanged if it
+        was already loaded by the last update.
+        """
+        self.read_digest = fin.digest
+        if fin.digest is not None and fin.digest == self.loaded_digest():
+            fin.close()
+            raise SourceUnchanged('Source already loaded (%s)' % fin.digest)
+
+    def begin_load(self, incremental=False):
+        """Prepare the database for loading, return a started BulkLoader."""
+        raise NotImplementedError('Abstract method subclasses must implement')
+
+    def end_load(self, loader, incremental=False):
+        """Complete the loading of the rows added to loader: store the last
+        rows and update the search index, fingerprint and statistics.
+        """
+        raise NotImplementedError('Abstract method subclasses must implement')
+
     def count(self, field=None):
         """Count the number of items or distinct entries for a given field if
         supplied.
         """
         if field is None:
             # default: count the number of items
-            cursor = self.db_cnx.execute('select COUNT(*) from %s' % self.str_id)
-            return cursor.fetchone()
+            cursor = self.db_cnx.execute('select COUNT(*) from %s where %s' \
+                % (self.str_id, self.live_filter()))
+            return cursor.fetchone()[0]
         else:
             # count unique entries for a given field
-            cursor = self.db_cnx.execute('select COUNT(*) from (select distinct %s from %s)' \
-                % (self.dbfield(field), self.str_id))
+            cursor = self.db_cnx.execute('select COUNT(*) from (select distinct %s from %s where %s)' \
+                % (self.dbfield(field), self.str_id, self.live_filter()))
             return cursor.fetchone()[0]
 
-    def lookup(self, spec, strict=True):
+    def stats(self):
+        """Return statistics about the database, as a dict:
+          'total': number of items
+          'distinct': {field: number of distinct values}
+          'top_vendors': [[vendor, number of items], ...]
+          'breakdown': {field: {value: number of items}}
+
+        Statistics are maintained by populate() (see store_stats), they are
+        only computed on the fly if missing.
+        """
+        try:
+            cursor = self.db_cnx.execute('select stat, stat_key, value from %s'
+                ' where db_name = ?' % DBSTATS_TABLE, (self.str_id,))
+            rows = cursor.fetchall()
+        except sqlite3.OperationalError:
+            # database created by an older version
+            rows = []
+        if len(rows) == 0:
+            rows = self._compute_stats()
+
+        res = {'total': 0, 'distinct': {}, 'top_vendors': [], 'breakdown': {}}
+        for stat, key, value in rows:
+            if stat == 'total':
+                res['total'] = value
+            elif stat == 'distinct':
+                res['distinct'][key] = value
+            elif stat == 'top_vendor':
+                res['top_vendors'].append([key, value])
+            else:
+                res['breakdown'].setdefault(stat, {})[key] = value
+        res['top_vendors'].sort(key=lambda x: (-x[1], x[0]))
+        return res
+
+    @profiling.timed('stats')
+    def store_stats(self):
+        """Compute statistics and store them into the database."""
+        rows = self._compute_stats()
+        try:
+            self.db_cnx.execute('DELETE FROM %s WHERE db_name = ?' % DBSTATS_TABLE,
+                (self.str_id,))
+        except sqlite3.OperationalError:
+            # database created by an older version, statistics are computed
+            # on the fly
+            return
+        self.db_cnx.executemany('INSERT INTO %s (db_name, stat, stat_key, value)'
+            ' VALUES (?,?,?,?)' % DBSTATS_TABLE,
+            [(self.str_id,) + x for x in rows])
+        self.commit()
+
+    def _compute_stats(self):
+        """Compute statistics from the content of the database. Return a list
+        of (stat, key, value) tuples.
+        """
+        rows = [('total', '', self.count())]
+        for field in self._distinct_fields + self._breakdown_fields:
+            rows.append(('distinct', field, self.count(field)))
+
+        cursor = self.db_cnx.execute('select %(f)s, COUNT(*) from %(t)s where'
+            ' %(live)s group by %(f)s order by COUNT(*) desc limit ?' \
+            % {'f': self.dbfield('vendor'), 't': self.str_id,
+               'live': self.live_filter()}, (STATS_TOP_VENDORS,))
+        for vendor, count in cursor:
+            rows.append(('top_vendor', vendor, count))
+
+        for field in self._breakdown_fields:
+            cursor = self.db_cnx.execute('select %(f)s, COUNT(*) from %(t)s'
+                ' where %(live)s group by %(f)s' % {'f': self.dbfield(field),
+                't': self.str_id, 'live': self.live_filter()})
+            for value, count in cursor:
+                rows.append((field, value or '', count))
+        return rows
+
+    def lookup(self, spec, strict=True, ranges=None):
         """Perform lookup queries on the database.
 
         spec is a dict, which keys are non db-specific fields (like 'vendor', or
@@ -81,6 +321,9 @@ class Database:
 
         The strict arguments allows you to choose between a strict matching mode
         ('field = value') or a more flexible one ('field like pattern').
+
+        ranges is a dict of additional conditions, which keys are fields and
+        values tuples (low, high) of bounds, high being excluded.
         """
         if strict:
             op = '='
@@ -92,19 +335,290 @@ class Database:
         for k, v in spec.iteritems():
             search_filter.append('%s %s ?' % (self.dbfield(k), op))
             elems.append(v)
+        for k, (low, high) in (ranges or {}).iteritems():
+            search_filter.append('%s >= ? and %s < ?' % (self.dbfield(k), self.dbfield(k)))
+            elems.extend([low, high])
+        search_filter.append(self.live_filter())
         search_filter = ' and '.join(search_filter)
+        profiling.count('lookups')
         query = 'select * from %s where (%s)' % (self.str_id, search_filter)
-        for res in self.db_cnx.execute(query, tuple(elems)):
-            yield self._make_item(res)
+        cursor = self.db_cnx.execute(query, tuple(elems))
+        return itertools.imap(self._make_item, cursor)
 
+    def lookup_ids(self, first, last):
+        """Iterate over the items which database ids are between first and last
+        (included).
+        """
+        query = 'select * from %s where id between ? and ? and %s' \
+            % (self.str_id, self.live_filter())
+        cursor = self.db_cnx.execute(query, (first, last))
+        return itertools.imap(self._make_item, cursor)
+
+    @profiling.timed('search')
     def lookup_all(self, pattern):
-        """Provided for conveniency, look for pattern on all the search-relevant
-        fields of a database.
+        """Provided for conveniency, look for pattern (LIKE syntax) on all the
+        search-relevant fields of a database. Each matching item is returned
+        once, best matches first when the full-text search index is available.
+        """
+        clause, elems, fts = self._search_clause(pattern)
+        query = 'select t.* %s' % clause
+        if fts:
+            query += ' order by f.rank'
+        return [self._make_item(res) for res in self.db_cnx.execute(query, elems)]
+
+    def search(self, pattern, limit=None, offset=0, after=None):
+        """Streaming version of lookup_all(): iterate over tuples (id, item) of
+        the matching items, by increasing id. At most limit items are
+        returned, skipping the first offset ones, or the ones up to id after
+        (keyset pagination: pass the last id seen to get the next page).
+
+        Rows are read from the cursor as they are consumed, so that memory
+        usage doesn't depend on the number of results.
         """
-        items = []
-        for field in self._search_fields:
-            items += self.lookup({field: pattern}, strict=False)
-        return items
+        clause, elems, fts = self._search_clause(pattern)
+        # the full-text index naturally yields rows by rowid: no sort needed,
+        # and the keyset condition is applied by the index itself
+        id_column = 't.id'
+        if fts:
+            id_column = 'f.rowid'
+
+        query = 'select t.* %s' % clause
+        if after is not None:
+            query += ' and %s > ?' % id_column
+            elems += (after,)
+        query += ' order by %s' % id_column
+        if limit is not None or offset > 0:
+            query += ' limit ? offset ?'
+            elems += (-1 if limit is None else limit, offset)
+
+        for res in self.db_cnx.execute(query, elems):
+            yield res[0], self._make_item(res)
+
+    @profiling.timed('search')
+    def search_count(self, pattern):
+        """Return the number of items lookup_all() would return."""
+        clause, elems, _ = self._search_clause(pattern)
+        return self.db_cnx.execute('select count(*) %s' % clause, elems).fetchone()[0]
+
+    def _search_clause(self, pattern):
+        """Return the FROM/WHERE clause (table aliased as t) selecting the items
+        matching pattern on the search-relevant fields, its parameters and
+        whether the full-text search index is used (aliased as f).
+        """
+        fields = [self.dbfield(x) for x in self._search_fields]
+        like_filter = ' or '.join(['t.%s like ?' % x for x in fields])
+        elems = [pattern] * len(fields)
+
+        terms = [x for x in re.split('[%_]+', pattern) if len(x) > 0]
+        fts_usable = len(terms) > 0 and \
+            min([len(x) for x in terms]) >= FTS_MIN_TERM_LENGTH
+
+        if fts_usable and self.has_search_index():
+            # The index selects candidates containing every literal part of the
+            # pattern, the LIKE filter then enforces the exact pattern.
+            match = ' AND '.join(['"%s"' % x.replace('"', '""') for x in terms])
+            clause = 'from %(fts)s f join %(t)s t on t.id = f.rowid' \
+                ' where %(fts)s match ? and (%(like)s) and %(live)s' \
+                % {'fts': self._fts_table(), 't': self.str_id,
+                   'like': like_filter, 'live': self.live_filter('t')}
+            return clause, tuple([match] + elems), True
+
+        clause = 'from %s t where (%s) and %s' \
+            % (self.str_id, like_filter, self.live_filter('t'))
+        return clause, tuple(elems), False
+
+    @profiling.timed('similar lookup')
+    def lookup_similar(self, text, limit):
+        """Approximate lookup: return up to limit items which search-relevant
+        fields share the most character trigrams with text, best first.
+
+        Candidates are only read from the posting lists of the rarest
+        trigrams of text (at most SIMILAR_MAX_GRAMS), frequent ones would
+        select a large part of the table while barely contributing to the
+        ranking. An empty list is returned if the full-text search index is not
+        available.
+        """
+        if not self.has_search_index():
+            return []
+
+        grams = set()
+        for word in re.split(r'[^\w.]+', text.lower(), flags=re.UNICODE):
+            for i in xrange(len(word) - FTS_MIN_TERM_LENGTH + 1):
+                grams.add(word[i:i + FTS_MIN_TERM_LENGTH])
+        grams = self._rarest_grams(grams, SIMILAR_MAX_GRAMS)
+        if len(grams) == 0:
+            return []
+
+        match = ' OR '.join(['"%s"' % x.replace('"', '""') for x in sorted(grams)])
+        query = 'select t.* from %(fts)s f join %(t)s t on t.id = f.rowid' \
+            ' where %(fts)s match ? and %(live)s order by f.rank limit ?' \
+            % {'fts': self._fts_table(), 't': self.str_id, 'live': self.live_filter('t')}
+        return [self._make_item(res) for res in self.db_cnx.execute(query, (match, limit))]
+
+    def _rarest_grams(self, grams, count):
+        """Return the count trigrams of grams found in the fewest rows, those
+        found in none being left out.
+        """
+        freqs = []
+        query = 'select doc from %s_vocab where term = ?' % self._fts_table()
+        try:
+            for gram in grams:
+                res = self.db_cnx.execute(query, (gram,)).fetchone()
+                if res is not None:
+                    freqs.append((res[0], gram))
+        except sqlite3.OperationalError:
+            # index built by an older version, without vocabulary table
+            return list(grams)
+        freqs.sort()
+        return [x[1] for x in freqs[:count]]
+
+    @profiling.timed('search index')
+    def build_search_index(self):
+        """(Re)build the full-text search index over the search-relevant
+        fields. Return False if the SQLite library has no FTS5 support, in which
+        case searches fall back to table scans.
+        """
+        fts = self._fts_table()
+        fields = [self.dbfield(x) for x in self._search_fields]
+        self._has_fts = None
+        try:
+            self.db_cnx.execute('DROP TABLE IF EXISTS %s_vocab' % fts)
+            self.db_cnx.execute('DROP TABLE IF EXISTS %s' % fts)
+            self.db_cnx.execute('CREATE VIRTUAL TABLE %s USING fts5(%s,'
+                ' content=%s, content_rowid=id, tokenize=trigram)' \
+                % (fts, ','.join(fields), self.str_id))
+            # number of rows per trigram, see lookup_similar()
+            self.db_cnx.execute('CREATE VIRTUAL TABLE %s_vocab USING'
+                ' fts5vocab(%s, row)' % (fts, fts))
+        except sqlite3.OperationalError:
+            return False
+        self.db_cnx.execute("INSERT INTO %s(%s) VALUES('rebuild')" % (fts, fts))
+        self.commit()
+        return True
+
+    def update_search_index(self, condition, remove=False):
+        """Add the rows matching condition (SQL expression over the columns of
+        the table) to the full-text search index, or remove them from it.
+        Rows must be removed before they are modified, the index being
+        updated from their current values. Nothing is done if there is no
+        index.
+        """
+        if not self.has_search_index():
+            return
+        fts = self._fts_table()
+        fields = ','.join([self.dbfield(x) for x in self._search_fields])
+        if remove:
+            query = "INSERT INTO %(fts)s(%(fts)s, rowid, %(f)s)" \
+                " SELECT 'delete', id, %(f)s FROM %(t)s WHERE %(cond)s"
+        else:
+            query = 'INSERT INTO %(fts)s(rowid, %(f)s)' \
+                ' SELECT id, %(f)s FROM %(t)s WHERE %(cond)s'
+        self.db_cnx.execute(query % {'fts': fts, 'f': fields, 't': self.str_id,
+            'cond': condition})
+
+    def has_search_index(self):
+        """Return whether the full-text search index exists."""
+        if self._has_fts is None:
+            cursor = self.db_cnx.execute('select 1 from sqlite_master where'
+                " type = 'table' and name = ?", (self._fts_table(),))
+            self._has_fts = cursor.fetchone() is not None
+        return self._has_fts
+
+    def _fts_table(self):
+        """Return the name of the full-text search index table."""
+        return '%s_fts' % self.str_id
+
+    def fingerprint(self):
+        """Return the fingerprint of the content of the database, as recorded
+        by the last update, or None if unknown.
+        """
+        try:
+            cursor = self.db_cnx.execute('select fingerprint from %s where'
+                ' db_name = ?' % DBINFO_TABLE, (self.str_id,))
+        except sqlite3.OperationalError:
+            # database created by an older version
+            return None
+        res = cursor.fetchone()
+        if res is None:
+            return None
+        return res[0]
+
+    def aliases_fingerprint(self):
+        """Return a digest of the locally maintained spelling aliases used to
+        translate the items of the database, which fingerprint() doesn't
+        cover, or None if there are none.
+        """
+        return None
+
+    def set_fingerprint(self, fingerprint):
+        """Record the fingerprint of the new content of the database. Cached
+        translation results are dropped if it changed.
+        """
+        if fingerprint == self.fingerprint():
+            return
+        try:
+            self.db_cnx.execute('INSERT OR REPLACE INTO %s (db_name, fingerprint)'
+                ' VALUES (?, ?)' % DBINFO_TABLE, (self.str_id, fingerprint))
+            self.db_cnx.execute('DELETE FROM %s' % TRANSCACHE_TABLE)
+        except sqlite3.OperationalError:
+            # database created by an older version, caching is unavailable
+            return
+        self.commit()
+
+    def loaded_digest(self):
+        """Return the digest of the source loaded by the last update, or None
+        if unknown.
+        """
+        if self._loaded_digest_given:
+            return self._loaded_digest
+        try:
+            res = self.db_cnx.execute('select source_digest from %s where'
+                ' db_name = ?' % DBINFO_TABLE, (self.str_id,)).fetchone()
+        except sqlite3.OperationalError:
+            # database created by an older version
+            return None
+        if res is None:
+            return None
+        return res[0]
+
+    def assume_loaded_digest(self, digest):
+        """Make loaded_digest() return digest without querying the database,
+        for processes which must not use the connection they inherited (see
+        cpelab.tools.toolbase.ConcurrentUpdate).
+        """
+        self._loaded_digest = digest
+        self._loaded_digest_given = True
+
+    def set_loaded_digest(self, digest):
+        """Record the digest of the source just loaded (None if unknown)."""
+        try:
+            self.db_cnx.execute('INSERT OR IGNORE INTO %s (db_name) VALUES (?)' \
+                % DBINFO_TABLE, (self.str_id,))
+            self.db_cnx.execute('UPDATE %s SET source_digest = ? WHERE db_name = ?' \
+                % DBINFO_TABLE, (digest, self.str_id))
+        except sqlite3.OperationalError:
+            # database created by an older version
+            return
+        self.commit()
+
+    def commit(self):
+        """Commit the pending changes, unless a load transaction is in
+        progress on the connection: they are then committed (or rolled back)
+        along with the whole load, see LoadTransaction.
+        """
+        if not _LOAD_TRANSACTIONS.has_key(id(self.db_cnx)):
+            self.db_cnx.commit()
+
+    def live_filter(self, alias=None):
+        """Return the SQL condition selecting the items lookups and counts
+        operate on, for the table of the database or, in joins, the table
+        named alias.
+        """
+        if self._dead_column is None:
+            return '1'
+        if alias is not None:
+            return 'NOT %s.%s' % (alias, self._dead_column)
+        return 'NOT %s' % self._dead_column
 
     def dbfield(self, field):
         """Get the internal name of a field from its application wide
@@ -116,16 +630,304 @@ class Database:
         """Return an item (object) created from database information."""
         raise NotImplementedError('Abstract method subclasses must implement!')
 
-class DBEntry:
-    """Represent a single database item"""
-    def __init__(self):
-        """instanciate a new item"""
-        self.fields = {}
+class LoadTransaction:
+    """Run a load (dropping indexes, replacing rows, rebuilding indexes and
+    updating the bookkeeping tables) as a single transaction, so that a failed
+    load leaves the database as it was. Typical usage:
 
-    def save(self, db):
-        """Store a new item into the database."""
-        raise NotImplementedError('Abstract method subclasses must implement')
+    with LoadTransaction(db.db_cnx):
+        ...
+
+    Python's sqlite3 module commits before every DDL statement (eg. DROP
+    INDEX): the connection is switched to manual transactions meanwhile, and
+    Database.commit() defers to the end of the transaction. SQLite pragmas
+    are tuned for throughput (see BULK_PRAGMAS) and restored afterwards.
+
+    Transactions can be nested, only the outermost one commits, or rolls back
+    if any of them failed.
+    """
+    def __init__(self, cnx):
+        """Initialize a new transaction on the connection cnx."""
+        self.cnx = cnx
+
+    def __enter__(self):
+        """Begin the transaction."""
+        cnx = self.cnx
+        if _LOAD_TRANSACTIONS.has_key(id(cnx)):
+            _LOAD_TRANSACTIONS[id(cnx)][0] += 1
+            return self
+
+        cnx.commit()
+        saved_pragmas = {}
+        for pragma, value in BULK_PRAGMAS.iteritems():
+            saved_pragmas[pragma] = cnx.execute('PRAGMA %s' % pragma).fetchone()[0]
+            cnx.execute('PRAGMA %s = %s' % (pragma, value))
+        _LOAD_TRANSACTIONS[id(cnx)] = [1, False, cnx.isolation_level, saved_pragmas]
+        cnx.isolation_level = None
+        cnx.execute('BEGIN')
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Commit the transaction, or roll it back if an exception was
+        raised.
+        """
+        cnx = self.cnx
+        state = _LOAD_TRANSACTIONS[id(cnx)]
+        state[0] -= 1
+        state[1] = state[1] or exc_type is not None
+        if state[0] > 0:
+            return False
+
+        del _LOAD_TRANSACTIONS[id(cnx)]
+        try:
+            if state[1]:
+                cnx.execute('ROLLBACK')
+            else:
+                cnx.execute('COMMIT')
+        finally:
+            cnx.isolation_level = state[2]
+            for pragma, value in state[3].iteritems():
+                cnx.execute('PRAGMA %s = %s' % (pragma, value))
+        return False
+
+class BulkLoader:
+    """Efficiently (re)load a whole table of a database.
+
+    Rows are batched into executemany() calls and secondary indexes are
+    dropped during the load and rebuilt at the end. Loading happens in a
+    LoadTransaction, the enclosing one if any. Typical usage:
+
+    loader = BulkLoader(db, ['col0', 'col1'])
+    loader.start()
+    try:
+        for row in rows:
+            loader.add(row)
+    except:
+        loader.abort()
+        raise
+    loader.finish()
+    """
+    def __init__(self, db, columns, table=None, batch_size=BULK_BATCH_SIZE):
+        """Initialize a new loader for the given columns of a table (default to
+        the table of the database).
+        """
+        self.db = db
+        self.table = table or db.str_id
+        self.count = 0
+        self.elapsed = 0.
+        self._batch_size = batch_size
+        self._batch = []
+        self._digest = hashlib.sha1()
+        self._indexes = []
+        self._start_time = None
+        self._transaction = None
+        self._query = 'INSERT INTO %s (%s) VALUES (%s)' % (self.table,
+            ','.join(columns), ','.join(['?'] * len(columns)))
+
+    def start(self, truncate=True):
+        """Prepare the table for loading. Existing rows are deleted unless
+        truncate is False.
+        """
+        cnx = self.db.db_cnx
+        self._start_time = time.time()
+        self._transaction = LoadTransaction(cnx).__enter__()
+
+        # automatic indexes (UNIQUE constraints) have no SQL and can't be dropped
+        cursor = cnx.execute("SELECT name, sql FROM sqlite_master WHERE"
+            " type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (self.table,))
+        self._indexes = cursor.fetchall()
+        try:
+            for name, _ in self._indexes:
+                cnx.execute('DROP INDEX %s' % name)
+
+            if truncate:
+                cnx.execute('DELETE FROM %s' % self.table)
+        except:
+            self.abort()
+            raise
+
+    def add(self, row):
+        """Queue a row (tuple of values, in the order of the columns) for
+        insertion.
+        """
+        self._batch.append(row)
+        self._digest.update(repr(row))
+        if len(self._batch) >= self._batch_size:
+            self.flush()
+
+    def extend(self, rows):
+        """Queue several rows for insertion."""
+        for row in rows:
+            self.add(row)
+
+    def flush(self):
+        """Send pending rows to the database."""
+        if len(self._batch) > 0:
+            with profiling.timer('insert'):
+                self.db.db_cnx.executemany(self._query, self._batch)
+            profiling.count('rows inserted', len(self._batch))
+            self.count += len(self._batch)
+            self._batch = []
+
+    def finish(self):
+        """Store remaining rows and rebuild indexes. Changes are committed
+        unless an enclosing load transaction is in progress.
+        """
+        cnx = self.db.db_cnx
+        try:
+            self.flush()
+            with profiling.timer('index rebuild'):
+                for _, sql in self._indexes:
+                    cnx.execute(sql)
+        except:
+            self.abort()
+            raise
+
+        transaction, self._transaction = self._transaction, None
+        transaction.__exit__(None, None, None)
+        self.elapsed = time.time() - self._start_time
+
+    def abort(self):
+        """Cancel the loading: discard pending rows and roll the transaction
+        back (the enclosing one, if any, is rolled back when it ends), which
+        restores the deleted rows and the dropped indexes.
+        """
+        self._batch = []
+        if self._transaction is not None:
+            transaction, self._transaction = self._transaction, None
+            transaction.__exit__(DBError, None, None)
+
+    def fingerprint(self):
+        """Return a digest of the rows loaded so far."""
+        return self._digest.hexdigest()
+
+    def rate(self):
+        """Return the loading throughput, in rows per second."""
+        if self.elapsed > 0:
+            return self.count / self.elapsed
+        return 0.
+
+    def __str__(self):
+        """Human readable loading summary."""
+        return '%s: %d rows stored in %.2fs (%d rows/sec)' % (self.db.str_id,
+            self.count, self.elapsed, self.rate())
+
+class MultiLoader:
+    """Bulk load several related tables at once (see BulkLoader), from records
+    (table name, row). Typical usage:
+
+    loader = MultiLoader(db, [('table0', ['col0', 'col1']), ('table1', ['col0'])])
+    loader.start()
+    for record in records:
+        loader.add(record)
+    loader.finish()
+    """
+    def __init__(self, db, tables, batch_size=BULK_BATCH_SIZE):
+        """Initialize a new loader for the given tables and columns."""
+        self.db = db
+        self.count = 0
+        self.elapsed = 0.
+        self._tables = [x[0] for x in tables]
+        self._loaders = {}
+        self._start_time = None
+        for table, columns in tables:
+            self._loaders[table] = BulkLoader(db, columns, table, batch_size)
+
+    def start(self, truncate=True):
+        """Prepare the tables for loading."""
+        self._start_time = time.time()
+        for table in self._tables:
+            self._loaders[table].start(truncate)
+
+    def add(self, record):
+        """Queue a record (table, row) for insertion."""
+        self._loaders[record[0]].add(record[1])
+
+    def extend(self, records):
+        """Queue several records for insertion."""
+        loaders = self._loaders
+        for table, row in records:
+            loaders[table].add(row)
+
+    def finish(self):
+        """Store remaining rows and rebuild the indexes of all the tables."""
+        for table in self._tables:
+            self._loaders[table].finish()
+        self.count = sum([self._loaders[x].count for x in self._tables])
+        self.elapsed = time.time() - self._start_time
+
+    def abort(self):
+        """Cancel the loading of all the tables."""
+        for table in self._tables:
+            self._loaders[table].abort()
+
+    def fingerprint(self):
+        """Return a digest of the rows loaded so far in all the tables."""
+        digest = hashlib.sha1()
+        for table in self._tables:
+            digest.update(self._loaders[table].fingerprint())
+        return digest.hexdigest()
+
+    def rate(self):
+        """Return the loading throughput, in rows per second (all the tables
+        together).
+        """
+        if self.elapsed > 0:
+            return self.count / self.elapsed
+        return 0.
+
+    def __str__(self):
+        """Human readable loading summary."""
+        counts = ['%d %s' % (self._loaders[x].count, x) for x in self._tables]
+        return '%s: %d rows stored in %.2fs (%d rows/sec: %s)' % (
+            self.db.str_id, self.count, self.elapsed, self.rate(),
+            ', '.join(counts))
+
+class DBEntry(object):
+    """Represent a single database item.
+
+    Items read from the database keep the row they come from (a tuple of
+    values ordered as fields_order) and only decode it into the fields dict
+    when it is accessed. Use item['field'] to read a single value without
+    decoding.
+    """
+    __slots__ = ('_row', '_fields')
+
+    fields_order = []
+    _field_index = {}
+
+    def __init__(self, row=None):
+        """instanciate a new item, optionally from a row of values"""
+        self._row = row
+        self._fields = None
+
+    @property
+    def fields(self):
+        """Dict of the item values, built on first access."""
+        if self._fields is None:
+            if self._row is None:
+                self._fields = {}
+            else:
+                self._fields = dict(zip(self.fields_order, self._row))
+                # the dict is the reference from now on, it may be modified
+                self._row = None
+        return self._fields
+
+    def __getitem__(self, field):
+        """Return the value of a single field."""
+        if self._row is not None:
+            return self._row[self._field_index[field]]
+        return self.fields[field]
+
+    def as_row(self):
+        """Return the item as a tuple of values, ordered as fields_order."""
+        if self._row is not None:
+            return tuple(self._row)
+        return tuple([self.fields[x] for x in self.fields_order])
 
 class DBError(Exception):
     """Base error raised on invalid DB operations"""
 
+
+class SourceUnchanged(DBError):
+    """Raised when reading a source which was already loaded."""
@@ -25,102 +25,154 @@
 
 """Nmap OS database manipulation module"""
 
-import urllib
+import hashlib
+import sqlite3
 
-from cpelab.databases.db import Database, DBEntry
+from cpelab.databases.db import Database, DBEntry, MultiLoader, BULK_BATCH_SIZE
+from cpelab.databases.source import open_source
+from cpelab.databases.versions import version_key
 
 
 NMAP_OS_DICT_LOCATION = 'http://nmap.org/svn/nmap-os-db'
 
+# Tables behind the nmapos view (see cpelab_init.sql)
+NMAPOS_FP_TABLE = 'nmapos_fp'
+NMAPOS_CLASS_TABLE = 'nmapos_class'
+NMAPOS_CPE_TABLE = 'nmapos_cpe'
+
+# Known CPE spellings of (vendor, product) classes
+NMAPOS_ALIAS_TABLE = 'nmapos_alias'
+
 
 class NmapOS(Database):
     """Nmap OS fingerprints database."""
 
     str_id = 'nmapos'
 
-    def __init__(self):
+    def __init__(self, readonly=False):
         """Initialize a new Nmap OS DB instance"""
-        Database.__init__(self)
+        Database.__init__(self, readonly)
         self._item_title = None
         self.fields_map = {
             'title': 'n_title',
             'vendor': 'n_vendor',
             'product': 'n_product',
             'version': 'n_version',
-            'devtype': 'n_devtype'
+            'devtype': 'n_devtype',
+            'cpe_hints': 'n_cpe_hints',
+            'version_key': 'n_version_key'
         }
         self._search_fields = ['title']
+        self._breakdown_fields = ['devtype']
 
-    def populate(self):
-        """Download latest version of the database from a remote location and
-        store it locally.
-        """
-        print '[+] Updating %s...' % str(NmapOS.str_id)
+    def read_source(self, source=None, incremental=False):
+        """Stream the database from source (defaults to the latest upstream
+        version) and yield lists of records (table, row) for the fingerprint,
+        class and CPE hint tables. The parser is a single pass state machine:
+        Class lines belong to the last fingerprint and CPE lines to the last
+        class, ids are assigned on the fly.
 
-        full_db, _ = urllib.urlretrieve(NMAP_OS_DICT_LOCATION)
-        #full_db = "nmap-os-db"
+        Fingerprints have no stable identifier, incremental updates are not
+        supported and the whole database is always reloaded.
+        """
+        fin = open_source(source or NMAP_OS_DICT_LOCATION)
+        self.check_source(fin)
+        return self._parse(fin)
+
+    def _parse(self, fin):
+        """Parse the database from fin, see read_source()."""
+        records = []
+        fp_id = 0
+        class_id = 0
+        curr_fp = None
+        curr_class = None
+        for line in fin:
+            if line.startswith('Fingerprint '):
+                fp_id += 1
+                curr_fp = fp_id
+                curr_class = None
+                records.append((NMAPOS_FP_TABLE, (fp_id, line[12:].strip().lower())))
+            elif line.startswith('Class ') and curr_fp is not None:
+                class_id += 1
+                curr_class = class_id
+                items = [x.strip().lower() for x in line[6:].split('|')]
+                while len(items) < 4:
+                    items.append('')
+                records.append((NMAPOS_CLASS_TABLE, (class_id, curr_fp) \
+                    + tuple(items[:4]) + (version_key(items[2]),)))
+            elif line.startswith('CPE ') and curr_class is not None:
+                # eg. "CPE cpe:/o:linux:linux_kernel:2.6 auto"
+                name = line[4:].split()
+                if len(name) > 0:
+                    records.append((NMAPOS_CPE_TABLE, (curr_class, name[0].lower())))
+            else:
+                continue
+
+            if len(records) >= BULK_BATCH_SIZE:
+                yield records
+                records = []
+        fin.close()
+        if len(records) > 0:
+            yield records
 
+    def begin_load(self, incremental=False):
+        """Prepare the tables for loading and return a started MultiLoader."""
+        if incremental:
+            print '[+] Incremental update not supported, reloading everything'
         print '[+] Storing base...'
 
-        fin = open(full_db)
-        tmp_item = None
-        for line in fin:
-            if line.startswith('Fingerprint'):
-                tmp_item = NmapOSItem()
-                tmp_item.update(line)
-            elif line.startswith('Class'):
-                tmp_item.update(line)
-                if tmp_item is not None:
-                    tmp_item.save(self)
-        fin.close()
+        loader = MultiLoader(self, [
+            (NMAPOS_FP_TABLE, ['id', 'n_title']),
+            (NMAPOS_CLASS_TABLE, ['id', 'fp_id', 'n_vendor', 'n_product',
+                'n_version', 'n_devtype', 'n_version_key']),
+            (NMAPOS_CPE_TABLE, ['class_id', 'cpe_name'])
+        ])
+        loader.start()
+        return loader
 
-        self.db_cnx.commit()
+    def end_load(self, loader, incremental=False):
+        """Complete the loading."""
+        loader.finish()
 
-        # XXX display statistics
-        print '[+] Update complete!'
+        print '[+] %s' % str(loader)
+
+        if not self.build_search_index():
+            print '[!] No FTS5 support in SQLite, searches will be slower'
+
+        self.set_fingerprint(loader.fingerprint())
+        self.store_stats()
+
+    def aliases_fingerprint(self):
+        """Return a digest of the CPE spellings of the classes (see
+        NMAPOS_ALIAS_TABLE).
+        """
+        digest = hashlib.sha1()
+        try:
+            cursor = self.db_cnx.execute('select n_vendor, n_product, cpe_vendor,'
+                ' cpe_product from %s order by 1, 2, 3, 4' % NMAPOS_ALIAS_TABLE)
+            for row in cursor:
+                digest.update(repr(row))
+        except sqlite3.OperationalError:
+            # database created by an older version
+            return None
+        return digest.hexdigest()
 
     def _make_item(self, data):
         """Create and return an item (object) from database information."""
-        item = NmapOSItem()
-        # data[0] is the DB id, discard it
-        item.fields['title'] = data[1]
-        item.fields['vendor'] = data[2]
-        item.fields['product'] = data[3]
-        item.fields['version'] = data[4]
-        item.fields['devtype'] = data[5]
-
-        return item
+        # data[0] is the DB id, discard it along with trailing columns
+        return NmapOSItem(data[1:len(NmapOSItem.fields_order) + 1])
 
 class NmapOSItem(DBEntry):
-    """Represent a single entry from the Nmap OS database."""
-
-    def update(self, line):
-        """Process a single line of the nmap OS database."""
-        if line.startswith('Fingerprint'):
-            line = line.replace('Fingerprint', '', 1)
-            self.fields['title'] = line.strip().lower()
-        elif line.startswith('Class'):
-            line = line.replace('Class', '', 1)
-            items = [x.strip().lower() for x in line.split('|')]
-            self.fields['vendor'] = items[0]
-            self.fields['product'] = items[1]
-            self.fields['version'] = items[2]
-            self.fields['devtype'] = items[3]
-
-    def save(self, db):
-        """Store a new item into the database."""
-        t = (self.fields['title'],
-             self.fields['vendor'],
-             self.fields['product'],
-             self.fields['version'],
-             self.fields['devtype'])
-
-        db.db_cnx.execute('INSERT INTO %s'
-            ' (n_title,n_vendor,n_product,n_version,n_devtype)'
-            ' VALUES (?,?,?,?,?)' % db.str_id, t)
+    """Represent a single class of a fingerprint from the Nmap OS database,
+    along with the CPE hints of this class (space separated).
+    """
+    __slots__ = ()
+
+    fields_order = ['title', 'vendor', 'product', 'version', 'devtype',
+        'cpe_hints']
+    _field_index = dict([(x, i) for i, x in enumerate(fields_order)])
 
     def __str__(self):
         """Return a human readable representation."""
         lines = ['%s => %s' % (k, v) for k, v in self.fields.iteritems()]
         return '\n'.join(lines) + '\n'
-
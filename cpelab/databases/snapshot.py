@@ -0,0 +1,279 @@
+#!/usr/bin/python
+#
+# Author:
+# Henri Doreau <henri.doreau@greenbone.net>
+#
+# Copyright:
+# Copyright (C) 2011 Greenbone Networks GmbH, http://www.greenbone.net
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2
+# (or any later version), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301 USA.
+##
+
+
+
+"""Memory-mappable binary snapshots of the CPE dictionary.
+
+A snapshot is a read-only copy of the cpeos table, meant to be used by other
+tools without SQLite. The file is mapped in memory and binary searched, so
+opening it costs a few system calls, its pages are shared by all the processes
+reading it and lookups only copy the few strings they compare.
+
+Layout (little endian, offsets in bytes from the beginning of the file):
+
+  header    magic, format version, number of entries, number of (vendor,
+            product) pairs, offsets of the sections below and of the
+            fingerprint of the exported database (in the string table)
+  entries   one record per entry, sorted by vendor, product and name: the
+            offsets of its fields in the string table
+  names     entry indexes, sorted by name
+  pairs     one record per distinct (vendor, product), sorted: offsets of the
+            vendor and product in the string table, index of the first entry
+            and number of entries
+  strings   deduplicated strings, each one prefixed by its length (uint16),
+            UTF-8 encoded
+
+Missing fields have offset NULL_REF.
+"""
+
+import os
+import mmap
+import struct
+
+from cpelab.databases.db import DBError
+from cpelab.databases.cpedict import CPEItem
+
+
+SNAPSHOT_MAGIC = 'CPESNAP\x00'
+SNAPSHOT_VERSION = 1
+
+# fields of each entry, in record order
+SNAPSHOT_FIELDS = CPEItem.fields_order + ['version_key']
+
+NULL_REF = 0xffffffff
+
+_HEADER = struct.Struct('<8sIIIIIIII')
+_ENTRY = struct.Struct('<%dI' % len(SNAPSHOT_FIELDS))
+_INDEX = struct.Struct('<I')
+_PAIR = struct.Struct('<IIII')
+_LENGTH = struct.Struct('<H')
+
+_VENDOR = SNAPSHOT_FIELDS.index('vendor')
+_PRODUCT = SNAPSHOT_FIELDS.index('product')
+_NAME = SNAPSHOT_FIELDS.index('name')
+
+
+def write_snapshot(db, path):
+    """Export the live entries of db (CPEOS) into a snapshot file at path.
+    Return the number of entries written.
+
+    The file is written aside and renamed, so that readers of a previous
+    version keep a consistent mapping.
+    """
+    columns = ','.join([db.dbfield(x) for x in SNAPSHOT_FIELDS])
+    rows = db.db_cnx.execute('select %s from %s where %s order by %s, %s, %s' \
+        % (columns, db.str_id, db.live_filter(), db.dbfield('vendor'),
+           db.dbfield('product'), db.dbfield('name'))).fetchall()
+
+    strings = _StringTable()
+    entries = []
+    pairs = []
+    for idx, row in enumerate(rows):
+        refs = [strings.add(x) for x in row]
+        entries.append(_ENTRY.pack(*refs))
+        # strings are deduplicated: same offsets, same vendor and product
+        if len(pairs) > 0 and pairs[-1][:2] == [refs[_VENDOR], refs[_PRODUCT]]:
+            pairs[-1][3] += 1
+        else:
+            pairs.append([refs[_VENDOR], refs[_PRODUCT], idx, 1])
+    # readers compare encoded strings, like SQLite sorted vendors and products
+    names = sorted(xrange(len(rows)), key=lambda x: rows[x][_NAME].encode('utf-8'))
+    fingerprint = strings.add(db.fingerprint())
+
+    entries_offset = _HEADER.size
+    names_offset = entries_offset + len(entries) * _ENTRY.size
+    pairs_offset = names_offset + len(names) * _INDEX.size
+    strings_offset = pairs_offset + len(pairs) * _PAIR.size
+
+    tmp_path = path + '.tmp'
+    try:
+        with open(tmp_path, 'wb') as fout:
+            fout.write(_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION,
+                len(entries), len(pairs), entries_offset, names_offset,
+                pairs_offset, strings_offset, fingerprint))
+            fout.write(''.join(entries))
+            fout.write(''.join([_INDEX.pack(x) for x in names]))
+            fout.write(''.join([_PAIR.pack(*x) for x in pairs]))
+            fout.write(strings.data())
+        os.rename(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return len(entries)
+
+class _StringTable:
+    """Deduplicated strings, addressed by offset."""
+    def __init__(self):
+        """Initialize an empty table."""
+        self._offsets = {}
+        self._chunks = []
+        self._size = 0
+
+    def add(self, value):
+        """Add value (unicode string or None) if needed and return its
+        offset.
+        """
+        if value is None:
+            return NULL_REF
+        offset = self._offsets.get(value)
+        if offset is None:
+            data = value.encode('utf-8')
+            if len(data) > 0xffff:
+                raise DBError('String too long for a snapshot: %s...' % data[:40])
+            offset = self._size
+            self._offsets[value] = offset
+            self._chunks.append(_LENGTH.pack(len(data)) + data)
+            self._size += _LENGTH.size + len(data)
+        return offset
+
+    def data(self):
+        """Return the content of the table."""
+        return ''.join(self._chunks)
+
+class Snapshot:
+    """Read-only CPE dictionary, backed by a memory-mapped snapshot file.
+    Searches compare encoded strings, copied out of the mapping one at a time
+    (slicing an mmap copies, but wrapping the bytes in buffer objects costs
+    more for such short strings). Only the returned entries are decoded (as
+    CPEItem objects).
+    """
+    def __init__(self, path):
+        """Map the snapshot file at path."""
+        try:
+            with open(path, 'rb') as fin:
+                self._map = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, mmap.error), err:
+            raise DBError('Cannot map snapshot %s (%s)' % (path, str(err)))
+
+        if len(self._map) < _HEADER.size:
+            raise DBError('Invalid snapshot: %s' % path)
+        header = _HEADER.unpack_from(self._map)
+        if header[0] != SNAPSHOT_MAGIC:
+            raise DBError('Invalid snapshot: %s' % path)
+        if header[1] != SNAPSHOT_VERSION:
+            raise DBError('Unsupported snapshot version %d: %s' % (header[1], path))
+
+        self._count, self._pair_count = header[2:4]
+        self._entries, self._names, self._pairs, self._strings = header[4:8]
+        self.fingerprint = self._string(header[8])
+
+    def close(self):
+        """Unmap the file."""
+        self._map.close()
+
+    def __len__(self):
+        """Return the number of entries."""
+        return self._count
+
+    def __iter__(self):
+        """Iterate over all the entries, by vendor, product and name."""
+        for idx in xrange(self._count):
+            yield self._item(idx)
+
+    def lookup_name(self, name):
+        """Return the entry named name (CPE name, lower case), or None."""
+        name = _encode(name)
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._name_at(mid) < name:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._count and self._name_at(lo) == name:
+            return self._item(self._name_index(lo))
+        return None
+
+    def lookup(self, vendor, product=None):
+        """Return the list of entries of vendor, restricted to product if
+        given, sorted by product and name.
+        """
+        vendor = _encode(vendor)
+        key = (vendor, _encode(product or ''))
+        lo, hi = 0, self._pair_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._pair_key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        items = []
+        while lo < self._pair_count:
+            pair_vendor, pair_product = self._pair_key(lo)
+            if pair_vendor != vendor or (product is not None and pair_product != key[1]):
+                break
+            _, _, first, count = _PAIR.unpack_from(self._map, self._pairs + lo * _PAIR.size)
+            items.extend([self._item(x) for x in xrange(first, first + count)])
+            lo += 1
+        return items
+
+    def _item(self, idx):
+        """Return the entry at index idx (in vendor, product, name order)."""
+        refs = _ENTRY.unpack_from(self._map, self._entries + idx * _ENTRY.size)
+        return CPEItem([self._string(x) for x in refs[:len(CPEItem.fields_order)]])
+
+    def _name_index(self, pos):
+        """Return the index of the entry which name is at position pos in
+        sorted order.
+        """
+        return _INDEX.unpack_from(self._map, self._names + pos * _INDEX.size)[0]
+
+    def _name_at(self, pos):
+        """Return (a copy of) the encoded name at position pos in sorted
+        order.
+        """
+        refs = _ENTRY.unpack_from(self._map, self._entries \
+            + self._name_index(pos) * _ENTRY.size)
+        return self._bytes(refs[_NAME])
+
+    def _pair_key(self, pos):
+        """Return (copies of) the encoded vendor and product of the pair at
+        position pos.
+        """
+        vendor, product = _PAIR.unpack_from(self._map, self._pairs + pos * _PAIR.size)[:2]
+        return self._bytes(vendor), self._bytes(product)
+
+    def _string(self, ref):
+        """Return the string at offset ref of the string table."""
+        if ref == NULL_REF:
+            return None
+        return self._bytes(ref).decode('utf-8')
+
+    def _bytes(self, ref):
+        """Return a copy of the encoded string at offset ref of the string
+        table.
+        """
+        start = self._strings + ref
+        length = _LENGTH.unpack_from(self._map, start)[0]
+        start += _LENGTH.size
+        return self._map[start:start + length]
+
+def _encode(value):
+    """Return value UTF-8 encoded, as stored in snapshots."""
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
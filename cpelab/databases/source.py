@@ -0,0 +1,344 @@
+#!/usr/bin/python
+#
+# Author:
+# Henri Doreau <henri.doreau@greenbone.net>
+#
+# Copyright:
+# Copyright (C) 2011 Greenbone Networks GmbH, http://www.greenbone.net
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2
+# (or any later version), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301 USA.
+##
+
+
+"""Streaming access to upstream database sources.
+
+Sources can be remote (http/ftp URL), local files or the standard input.
+Compressed contents (gzip, xz) are transparently decompressed on the fly, based
+on their magic number, so that nothing is ever fully loaded in memory.
+
+Remote sources are downloaded into a local cache first. Conditional requests
+(ETag, Last-Modified) avoid downloading them again when they didn't change,
+interrupted transfers are resumed (Range requests) and the SHA-256 digest of
+each download is recorded, so that callers can tell an unchanged source from a
+new one before parsing it.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import zlib
+import hashlib
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+from cpelab import profiling
+from cpelab.databases.db import DBError, DATADIR
+
+
+READ_CHUNK = 64 * 1024
+
+# Remote sources cache, relative to the working directory like the database
+DOWNLOAD_DIR = os.path.join(DATADIR, 'downloads')
+
+GZIP_MAGIC = '\x1f\x8b'
+XZ_MAGIC = '\xfd7zXZ\x00'
+
+
+@profiling.timed('open source')
+def open_source(location):
+    """Open location for streamed reading and return a buffered binary file
+    object. Location is either an URL, a path to a local file or '-' for the
+    standard input.
+
+    The digest attribute of the returned object is the SHA-256 digest of the
+    (compressed) content for remote sources, None otherwise.
+    """
+    digest = None
+    if location == '-':
+        fileobj = sys.stdin
+    elif '://' in location:
+        path, digest = download(location)
+        fileobj = open(path, 'rb')
+    else:
+        try:
+            fileobj = open(location, 'rb')
+        except IOError, err:
+            raise DBError('Cannot open source %s (%s)' % (location, str(err)))
+
+    head = fileobj.read(len(XZ_MAGIC))
+    raw = _RawStream(fileobj, head)
+
+    if head.startswith(GZIP_MAGIC):
+        # 16 + MAX_WBITS: expect gzip header and trailer
+        raw = _DecompressedStream(raw, lambda: zlib.decompressobj(16 + zlib.MAX_WBITS))
+    elif head.startswith(XZ_MAGIC):
+        if lzma is None:
+            raise DBError('xz compressed sources require the lzma module')
+        raw = _DecompressedStream(raw, lzma.LZMADecompressor)
+
+    reader = io.BufferedReader(raw, READ_CHUNK)
+    reader.digest = digest
+    return reader
+
+@profiling.timed('download')
+def download(url):
+    """Bring the local copy of url up to date. Return a tuple (path, digest)
+    with the path of the copy and its SHA-256 digest (hex).
+    """
+    # slow to import and only needed for updates
+    import urllib2
+    import urlparse
+    # distinct URLs may end with the same file name
+    name = '%s-%s' % (hashlib.sha1(url).hexdigest()[:16],
+        os.path.basename(urlparse.urlparse(url).path) or 'index')
+    path = os.path.join(os.getcwd(), DOWNLOAD_DIR, name)
+    cached = _CachedDownload(path, url)
+    try:
+        return cached.refresh()
+    except (urllib2.URLError, IOError, OSError), err:
+        raise DBError('Cannot download %s (%s)' % (url, str(err)))
+
+class _CachedDownload:
+    """Local copy of a remote source, along with its metadata (JSON): URL,
+    validators (ETag, Last-Modified), digest and size. Transfers go to a
+    .part file, renamed once complete.
+    """
+    def __init__(self, path, url):
+        """Initialize a new cached download, loading the existing metadata."""
+        self.path = path
+        self.url = url
+        self._part = path + '.part'
+        self._meta_path = path + '.json'
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        self.meta = {}
+        try:
+            with open(self._meta_path) as fin:
+                self.meta = json.load(fin)
+        except (IOError, ValueError):
+            pass
+
+        if self.meta.get('url') != url:
+            # unknown or damaged metadata: start over
+            self.meta = {'url': url}
+            for stale in (self.path, self._part):
+                if os.path.exists(stale):
+                    os.unlink(stale)
+
+    def refresh(self):
+        """Resume or revalidate the download, see download()."""
+        import urllib2
+        headers = {}
+        validator = self.meta.get('etag') or self.meta.get('last_modified')
+        resume = 0
+        if os.path.exists(self._part) and validator is not None:
+            # only resume if the remote file is the same as the partial one
+            resume = os.path.getsize(self._part)
+            headers['Range'] = 'bytes=%d-' % resume
+            headers['If-Range'] = validator
+        elif os.path.exists(self.path) and self.meta.has_key('sha256'):
+            if self.meta.get('etag') is not None:
+                headers['If-None-Match'] = self.meta['etag']
+            if self.meta.get('last_modified') is not None:
+                headers['If-Modified-Since'] = self.meta['last_modified']
+
+        try:
+            response = urllib2.urlopen(urllib2.Request(self.url, headers=headers))
+        except urllib2.HTTPError, err:
+            if err.code == 304:
+                print '[+] %s: not modified' % self.url
+                return self.path, self.meta['sha256']
+            if err.code == 416 and resume > 0:
+                # the partial file is not a prefix of the remote one
+                os.unlink(self._part)
+                return self.refresh()
+            raise
+
+        if response.getcode() == 206:
+            print '[+] %s: resuming download at %d bytes' % (self.url, resume)
+        else:
+            resume = 0
+        self._fetch(response, resume)
+        return self.path, self.meta['sha256']
+
+    def _fetch(self, response, offset):
+        """Write response into the .part file, after the first offset bytes
+        already there, and rename it once complete.
+        """
+        digest = hashlib.sha256()
+        if offset > 0:
+            with open(self._part, 'rb') as fin:
+                for chunk in iter(lambda: fin.read(READ_CHUNK), ''):
+                    digest.update(chunk)
+
+        # record the validators first, so that an interrupted transfer can be
+        # resumed
+        info = response.info()
+        self.meta['etag'] = info.getheader('ETag')
+        self.meta['last_modified'] = info.getheader('Last-Modified')
+        self.meta.pop('sha256', None)
+        self._save_meta()
+
+        received = 0
+        with open(self._part, 'ab' if offset > 0 else 'wb') as fout:
+            while True:
+                start = time.time()
+                chunk = response.read(READ_CHUNK)
+                profiling.record('read source', time.time() - start)
+                if not chunk:
+                    break
+                profiling.count('bytes downloaded', len(chunk))
+                digest.update(chunk)
+                fout.write(chunk)
+                received += len(chunk)
+        response.close()
+
+        # httplib doesn't report truncated responses
+        length = info.getheader('Content-Length')
+        if length is not None and received != int(length):
+            raise IOError('transfer interrupted after %d of %s bytes, run the'
+                ' update again to resume' % (offset + received, int(length) + offset))
+
+        os.rename(self._part, self.path)
+        self.meta['sha256'] = digest.hexdigest()
+        self.meta['size'] = os.path.getsize(self.path)
+        self._save_meta()
+
+    def _save_meta(self):
+        """Write the metadata file."""
+        tmp_path = self._meta_path + '.tmp'
+        with open(tmp_path, 'w') as fout:
+            json.dump(self.meta, fout, indent=2, sort_keys=True)
+        os.rename(tmp_path, self._meta_path)
+
+class _RawStream(io.RawIOBase):
+    """Unbuffered reader on top of any file-like object, replaying the few
+    bytes already consumed to sniff the content type.
+    """
+    def __init__(self, fileobj, head=''):
+        """Initialize a new stream."""
+        io.RawIOBase.__init__(self)
+        self._fileobj = fileobj
+        self._head = head
+
+    def readable(self):
+        """Always true."""
+        return True
+
+    def readinto(self, buf):
+        """Read up to len(buf) bytes into buf. Return the number of bytes
+        read, 0 on EOF.
+        """
+        if self._head:
+            data = self._head[:len(buf)]
+            self._head = self._head[len(data):]
+        else:
+            start = time.time()
+            data = self._fileobj.read(len(buf))
+            profiling.record('read source', time.time() - start)
+            profiling.count('bytes read', len(data))
+        buf[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        """Close the underlying file object."""
+        if self._fileobj is not sys.stdin:
+            self._fileobj.close()
+        io.RawIOBase.close(self)
+
+class _DecompressedStream(io.RawIOBase):
+    """Unbuffered reader decompressing a stream on the fly.
+
+    new_decompressor is a callable returning a decompressor object (zlib or
+    lzma style). Concatenated compressed streams are supported.
+    """
+    def __init__(self, raw, new_decompressor):
+        """Initialize a new stream."""
+        io.RawIOBase.__init__(self)
+        self._raw = raw
+        self._new_decompressor = new_decompressor
+        self._decompressor = new_decompressor()
+        self._started = False
+        self._buffer = ''
+        self._offset = 0
+        self._eof = False
+
+    def readable(self):
+        """Always true."""
+        return True
+
+    def readinto(self, buf):
+        """Read up to len(buf) decompressed bytes into buf. Return the number
+        of bytes read, 0 on EOF.
+        """
+        while self._offset >= len(self._buffer):
+            if self._eof:
+                return 0
+            self._fill()
+
+        data = self._buffer[self._offset:self._offset + len(buf)]
+        self._offset += len(data)
+        buf[:len(data)] = data
+        return len(data)
+
+    @profiling.timed('decompress')
+    def _fill(self):
+        """Decompress the next chunk of input."""
+        chunk = self._raw.read(READ_CHUNK)
+        if not chunk:
+            if self._started and not _stream_ended(self._decompressor):
+                raise DBError('Truncated compressed source')
+            self._eof = True
+            self._buffer = ''
+            self._offset = 0
+            return
+
+        self._started = True
+        self._buffer = self._decompressor.decompress(chunk)
+        self._offset = 0
+
+        # beginning of another concatenated stream
+        unused = self._decompressor.unused_data
+        while unused:
+            self._decompressor = self._new_decompressor()
+            self._buffer += self._decompressor.decompress(unused)
+            unused = self._decompressor.unused_data
+
+    def close(self):
+        """Close the underlying stream."""
+        self._raw.close()
+        io.RawIOBase.close(self)
+
+def _stream_ended(decompressor):
+    """Return whether decompressor reached the end of its compressed stream."""
+    if hasattr(decompressor, 'eof'):
+        # lzma, and zlib since Python 3.3
+        return decompressor.eof
+    # zlib objects leave the data following the end of the stream unused
+    probe = decompressor.copy()
+    try:
+        probe.decompress('\0')
+    except zlib.error:
+        return False
+    return probe.unused_data == '\0'
@@ -0,0 +1,107 @@
+#!/usr/bin/python
+#
+# Author:
+# Henri Doreau <henri.doreau@greenbone.net>
+#
+# Copyright:
+# Copyright (C) 2011 Greenbone Networks GmbH, http://www.greenbone.net
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2
+# (or any later version), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301 USA.
+##
+
+
+"""Persistent cache of translation results"""
+
+import hashlib
+import sqlite3
+
+from cpelab.databases.db import TRANSCACHE_TABLE
+
+
+class TranslationCache:
+    """Store the results of a translator between runs.
+
+    Results are tagged with a fingerprint of the translator identifier, of
+    the content of both the source and destination databases and of their
+    spelling aliases, so that they are only served as long as none of them
+    changed. Entries are keyed on the signature title, vendor, product and
+    version.
+    """
+    def __init__(self, translator_id, db0, db1):
+        """Initialize a new cache for translations from db0 to db1. The cache
+        is disabled (see enabled()) if the content of the databases is
+        unknown.
+        """
+        self.db_cnx = db0.db_cnx
+        self.hits = 0
+        self.misses = 0
+
+        fingerprints = [db0.fingerprint(), db1.fingerprint()]
+        if None in fingerprints:
+            self._fingerprint = None
+        else:
+            digest = hashlib.sha1(translator_id)
+            for fingerprint in fingerprints:
+                digest.update(fingerprint)
+            for db in [db0, db1]:
+                digest.update(db.aliases_fingerprint() or '')
+            self._fingerprint = digest.hexdigest()
+
+    def enabled(self):
+        """Return whether results can be cached."""
+        return self._fingerprint is not None
+
+    def get(self, sig_fields):
+        """Look for the cached translation of a signature, given its fields
+        (NmapOSItem, or dict of the same fields). Return a tuple (score, cpe
+        names) or None on cache miss.
+        """
+        if not self.enabled():
+            return None
+
+        cursor = self.db_cnx.execute('select score, cpe_names from %s where'
+            ' fingerprint = ? and n_title = ? and n_vendor = ? and n_product = ?'
+            ' and n_version = ?' % TRANSCACHE_TABLE, self._key(sig_fields))
+        res = cursor.fetchone()
+        if res is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return res[0], res[1].split()
+
+    def put(self, sig_fields, score, names):
+        """Store the translation of a signature, given its fields."""
+        if not self.enabled():
+            return
+
+        try:
+            self.db_cnx.execute('INSERT OR REPLACE INTO %s (fingerprint, n_title,'
+                ' n_vendor, n_product, n_version, score, cpe_names)'
+                ' VALUES (?,?,?,?,?,?,?)' % TRANSCACHE_TABLE,
+                self._key(sig_fields) + (score, ' '.join(names)))
+        except sqlite3.OperationalError:
+            # read-only connection
+            pass
+
+    def commit(self):
+        """Make stored results persistent."""
+        self.db_cnx.commit()
+
+    def _key(self, sig_fields):
+        """Return the tuple of values identifying a cached translation."""
+        return (self._fingerprint, sig_fields['title'], sig_fields['vendor'],
+            sig_fields['product'], sig_fields['version'])
@@ -25,44 +25,50 @@
 
 """misc database utilities"""
 
-from cpelab.databases.nmapos import NmapOS
-from cpelab.databases.cpedict import CPEOS
+from cpelab.registry import Registry
 
 
-# List of available databases
-DB_MAP = { NmapOS.str_id: NmapOS,
-           CPEOS.str_id: CPEOS }
+# List of available databases, imported on first use
+DB_MAP = Registry([
+    ('nmapos', 'cpelab.databases.nmapos:NmapOS'),
+    ('cpeos', 'cpelab.databases.cpedict:CPEOS')
+])
 
 
-def get_db(db_spec):
+def get_db(db_spec, readonly=False):
     """Get a single DB by name."""
     if DB_MAP.has_key(db_spec):
-        return DB_MAP[db_spec]()
+        return DB_MAP[db_spec](readonly)
 
 class DBSpecParser:
     """Analyze a database specification pattern and provide accessors to the
     corresponding instances.
     """
-    def __init__(self, pattern=None):
+    def __init__(self, pattern=None, readonly=False):
         """initialize a new DBSpecParser instance"""
-        self._dbs = []
+        self._readonly = readonly
+        self._names = []
         if pattern == 'all':
-            self._dbs = DB_MAP.values()
+            self._names = DB_MAP.keys()
         else:
             for spec in pattern.split(' '):
                 if DB_MAP.has_key(spec):
-                    self._dbs.append(DB_MAP[spec])
+                    self._names.append(spec)
                 else:
                     raise DBSpecError('Invalid DB specification: %s' % pattern)
 
+    def names(self):
+        """Return the names of the selected databases, without opening them."""
+        return list(self._names)
+
     def __iter__(self):
         """Iterate through the selected databases."""
-        for val in self._dbs:
-            yield val()
+        for name in self._names:
+            yield DB_MAP[name](self._readonly)
 
     def __str__(self):
         """Human readable representation of an instance."""
-        return ' '.join([str(x) for x in self._dbs])
+        return ' '.join(self._names)
 
 class DBSpecError(Exception):
     """Error raised for invalid DB specification patterns"""
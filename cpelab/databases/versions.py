@@ -0,0 +1,90 @@
+#!/usr/bin/python
+#
+# Author:
+# Henri Doreau <henri.doreau@greenbone.net>
+#
+# Copyright:
+# Copyright (C) 2011 Greenbone Networks GmbH, http://www.greenbone.net
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2
+# (or any later version), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301 USA.
+##
+
+
+
+"""Version strings normalization.
+
+Numeric versions (2.6.32, 10.5.8-rc1...) are mapped to keys which compare like
+the versions they come from, as plain strings: each number is zero-padded. Keys
+are stored next to the versions, so that ranges of versions (2.6.x, 2.4 - 2.6)
+are index range scans. Non numeric versions (xp, vista, sp2) have no key.
+"""
+
+import re
+
+
+# width of each number in keys
+KEY_WIDTH = 8
+
+# upper bound of the keys sharing a given prefix
+KEY_MAX = u'\uffff'
+
+_NUMERIC_RE = re.compile(r'(\d+(?:\.\d+)*)(.*)$')
+
+# trailing wildcards, as in nmap versions (2.6.x)
+_WILDCARD_RE = re.compile(r'(\.[x*])+$')
+
+
+def version_key(version):
+    """Return the sortable key of a version string, or None if it doesn't start
+    with a number.
+    """
+    if version is None:
+        return None
+    match = _NUMERIC_RE.match(version.strip().lower())
+    if match is None:
+        return None
+
+    numbers, suffix = match.groups()
+    key = '.'.join(['%0*d' % (KEY_WIDTH, int(x)) for x in numbers.split('.')])
+    return key + _WILDCARD_RE.sub('', suffix)
+
+def version_range(version):
+    """Return the bounds (low, high) of the keys of the versions covered by a
+    version string, high being excluded: '2.6.x' (or '2.6') covers 2.6 and
+    every 2.6.* version, '2.4 - 2.6' covers everything between 2.4 and 2.6.*
+    Return None for non numeric versions.
+    """
+    if version is None:
+        return None
+    parts = version.split(' - ')
+    if len(parts) == 2:
+        low = _prefix_key(parts[0])
+        high = _prefix_key(parts[1])
+        if low is None or high is None:
+            return None
+        return low, high + KEY_MAX
+
+    prefix = _prefix_key(version)
+    if prefix is None:
+        return None
+    return prefix, prefix + KEY_MAX
+
+def _prefix_key(version):
+    """Return the key of the numeric part of a version, or None."""
+    match = _NUMERIC_RE.match(version.strip().lower())
+    if match is None:
+        return None
+    return version_key(match.group(1))
@@ -0,0 +1,160 @@
+#!/usr/bin/python
+#
+# Author:
+# Henri Doreau <henri.doreau@greenbone.net>
+#
+# Copyright:
+# Copyright (C) 2011 Greenbone Networks GmbH, http://www.greenbone.net
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2
+# (or any later version), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301 USA.
+##
+
+
+"""Lightweight profiling and SQL tracing.
+
+Tools record the time spent in their main phases (timer, timed) and count
+relevant events (count). Nothing is recorded unless profiling has been enabled
+(see enable), which labctl does when given --profile or --trace-sql.
+"""
+
+import sys
+import time
+import sqlite3
+
+
+_ENABLED = False
+_TRACE_SQL = False
+
+# phase name -> [number of calls, total time]
+_TIMERS = {}
+# event name -> count
+_COUNTERS = {}
+
+
+def enable(trace_sql=False):
+    """Start recording timers and counters. SQL statements are logged to
+    stderr if trace_sql is set.
+    """
+    global _ENABLED, _TRACE_SQL
+    _ENABLED = True
+    _TRACE_SQL = trace_sql
+
+def enabled():
+    """Return whether profiling is enabled."""
+    return _ENABLED
+
+def count(name, value=1):
+    """Increment the counter name."""
+    if _ENABLED:
+        _COUNTERS[name] = _COUNTERS.get(name, 0) + value
+
+def record(phase, elapsed):
+    """Account elapsed seconds to phase."""
+    if _ENABLED:
+        stat = _TIMERS.setdefault(phase, [0, 0.])
+        stat[0] += 1
+        stat[1] += elapsed
+
+class timer:
+    """Context manager accounting the time spent in a block to a phase.
+
+    with timer('parse'):
+        ...
+    """
+    def __init__(self, phase):
+        """Initialize a new timer for phase."""
+        self.phase = phase
+        self._start = None
+
+    def __enter__(self):
+        """Start timing."""
+        if _ENABLED:
+            self._start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Stop timing, exceptions are propagated."""
+        if self._start is not None:
+            record(self.phase, time.time() - self._start)
+            self._start = None
+        return False
+
+def timed(phase):
+    """Decorator accounting the execution time of a function to phase."""
+    def decorator(func):
+        """Wrap func."""
+        def wrapper(*args, **kwargs):
+            """Time the call to func."""
+            if not _ENABLED:
+                return func(*args, **kwargs)
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(phase, time.time() - start)
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+    return decorator
+
+class TracingConnection(sqlite3.Connection):
+    """SQLite connection counting, timing and optionally logging every
+    statement it executes. Only the execution is timed, not fetching the
+    results from the returned cursor.
+    """
+    def execute(self, sql, *args):
+        """Execute a single statement."""
+        start = time.time()
+        try:
+            return sqlite3.Connection.execute(self, sql, *args)
+        finally:
+            _trace(sql, time.time() - start)
+
+    def executemany(self, sql, *args):
+        """Execute a statement for each set of parameters."""
+        start = time.time()
+        try:
+            return sqlite3.Connection.executemany(self, sql, *args)
+        finally:
+            _trace(sql, time.time() - start, many=True)
+
+    def executescript(self, sql):
+        """Execute a SQL script."""
+        start = time.time()
+        try:
+            return sqlite3.Connection.executescript(self, sql)
+        finally:
+            _trace(sql, time.time() - start)
+
+def _trace(sql, elapsed, many=False):
+    """Account a SQL statement."""
+    count('sql statements')
+    record('sql', elapsed)
+    if _TRACE_SQL:
+        sys.stderr.write('[sql] %8.3fms %s%s\n' % (elapsed * 1000,
+            many and '(many) ' or '', ' '.join(sql.split())))
+
+def summary():
+    """Return a summary table of the timers and counters."""
+    lines = ['%-24s %10s %12s' % ('phase', 'calls', 'time (s)')]
+    for phase, (calls, total) in sorted(_TIMERS.iteritems(), key=lambda x: -x[1][1]):
+        lines.append('%-24s %10d %12.4f' % (phase, calls, total))
+    if len(_COUNTERS) > 0:
+        lines.append('')
+        lines.append('%-24s %10s' % ('counter', 'value'))
+        for name, value in sorted(_COUNTERS.iteritems()):
+            lines.append('%-24s %10d' % (name, value))
+    return '\n'.join(lines)
@@ -0,0 +1,75 @@
+#!/usr/bin/python
+#
+# Author:
+# Henri Doreau <henri.doreau@greenbone.net>
+#
+# Copyright:
+# Copyright (C) 2011 Greenbone Networks GmbH, http://www.greenbone.net
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2
+# (or any later version), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301 USA.
+##
+
+
+"""Lazily resolved registries of tools and databases.
+
+Classes are referenced by name, and their module is only imported when the
+class is first requested, so that listing the available commands or databases
+costs no import (nor database connection).
+"""
+
+
+class Registry:
+    """Ordered mapping of identifiers (str_id) to classes, given as
+    'package.module:ClassName' references and imported on first access.
+    """
+    def __init__(self, entries):
+        """Initialize a new registry from a list of tuples (str_id,
+        reference).
+        """
+        self._names = [x[0] for x in entries]
+        self._refs = dict(entries)
+        self._classes = {}
+
+    def keys(self):
+        """Return the list of registered identifiers, no class is imported."""
+        return list(self._names)
+
+    def has_key(self, name):
+        """Return whether name is registered."""
+        return self._refs.has_key(name)
+
+    def __contains__(self, name):
+        """Same as has_key()."""
+        return self.has_key(name)
+
+    def __len__(self):
+        """Return the number of registered classes."""
+        return len(self._names)
+
+    def __getitem__(self, name):
+        """Return the class registered as name, importing it if needed."""
+        if not self._classes.has_key(name):
+            module_name, class_name = self._refs[name].split(':')
+            module = __import__(module_name, fromlist=[class_name])
+            cls = getattr(module, class_name)
+            if cls.str_id != name:
+                raise ValueError('%s registered as %s' % (self._refs[name], name))
+            self._classes[name] = cls
+        return self._classes[name]
+
+    def values(self):
+        """Return the list of registered classes (all of them are imported)."""
+        return [self[x] for x in self._names]
@@ -44,8 +44,8 @@ class BaseComparator(Tool):
         if len(args) != 2:
             raise RuntimeToolError('Invalid arguments')
 
-        db0 = get_db(args[0])
-        db1 = get_db(args[1])
+        db0 = get_db(args[0], readonly=True)
+        db1 = get_db(args[1], readonly=True)
 
         if db0 is None:
             raise RuntimeToolError('Unknown database: %s' % args[0])
@@ -58,59 +58,130 @@ class BaseComparator(Tool):
         """Comparison function. Compute and display results."""
         raise NotImplementedError('Abstract method subclasses must implement')
 
-class VendorDiff(BaseComparator):
-    """Diff vendors.
-    
-    This tool performs a diff between vendors contained in two given tables. The
-    result is displayed in a "unified diff-like" fashion. See the _compare
-    docstring for more information.
+class MergeComparator(BaseComparator):
+    """Base class for comparisons of the distinct values of a field (or tuple
+    of fields) between two databases.
+
+    Both databases are read through sorted cursors which are merged in a single
+    pass, so that each value is classified as exclusively in db0 ('+'),
+    exclusively in db1 ('-') or common (' ') in linear time.
     """
-    str_id = 'vendor-diff'
 
-    def __init__(self):
-        """Initialize a new VendorDiff instance."""
-        BaseComparator.__init__(self)
-        self._diff_vendors = {}
+    # fields to compare (application wide names)
+    _fields = ['vendor']
+    # kinds of values to display
+    _show = '+- '
 
     def _compare(self, db0, db1):
-        """Select vendors that are exclusively in db0 (displayed with a '+'
-        prefix) or exclusively in db1 (displayed with a '-' prefix.
+        """Display the values selected by _show, prefixed with their kind
+        (except for common-only listings).
         """
-        for vendor in self._query(db0, db1):
-            print '+%s' % vendor[0]
+        try:
+            for kind, values in merge_diff(db0, db1, self._fields):
+                if kind not in self._show:
+                    continue
+                if self._show == ' ':
+                    kind = ''
+                print '%s%s' % (kind, ':'.join(values))
+        except KeyError, err:
+            raise RuntimeToolError('Unknown field: %s' % str(err))
+
+def merge_diff(db0, db1, fields):
+    """Compare the distinct values of fields (list of application wide field
+    names) in db0 and db1. Yield tuples (kind, values), in ascending order of
+    values, where kind is '+' for values only found in db0, '-' for values only
+    found in db1 and ' ' for values found in both.
+    """
+    cur0 = _distinct_values(db0, fields)
+    cur1 = _distinct_values(db1, fields)
+
+    val0 = next(cur0, None)
+    val1 = next(cur1, None)
+    while val0 is not None or val1 is not None:
+        if val1 is None or (val0 is not None and val0 < val1):
+            yield '+', val0
+            val0 = next(cur0, None)
+        elif val0 is None or val1 < val0:
+            yield '-', val1
+            val1 = next(cur1, None)
+        else:
+            yield ' ', val0
+            val0 = next(cur0, None)
+            val1 = next(cur1, None)
+
+def _distinct_values(db, fields):
+    """Return a cursor over the sorted distinct (non NULL) values of fields in
+    db.
+    """
+    columns = [db.dbfield(x) for x in fields]
+    return db.db_cnx.execute('select distinct %(c)s from %(t)s where %(nn)s'
+        ' and %(live)s order by %(c)s' % {'c': ','.join(columns), 't': db.str_id,
+            'nn': ' and '.join(['%s is not null' % x for x in columns]),
+            'live': db.live_filter()})
 
-        for vendor in self._query(db1, db0):
-            print '-%s' % vendor[0]
+class FieldDiff(MergeComparator):
+    """Diff the values of arbitrary fields.
 
-    def _query(self, db0, db1):
-        """Look for items that are exclusively present in db0."""
-        return db0.db_cnx.execute('select distinct %(db0)s.%(f0)s from %(db0)s where not exists (select id from %(db1)s where %(db1)s.%(f1)s = %(db0)s.%(f0)s)' \
-            % {'db0': db0.str_id, 'db1': db1.str_id, 'f0': db0.dbfield('vendor'), 'f1': db1.dbfield('vendor')})
+    The result is displayed in a "unified diff-like" fashion: values exclusively
+    in db0 are prefixed with '+', values exclusively in db1 with '-'.
+    """
+    str_id = 'diff'
+    _show = '+-'
+
+    def start(self, args):
+        """Tool entry point. Expected arguments are two databases, optionally
+        followed by a comma separated list of fields (default: vendor).
+        """
+        if len(args) == 3:
+            self._fields = args.pop().split(',')
+        BaseComparator.start(self, args)
 
     @classmethod
     def help_msg(cls, err=''):
-        """Return help message for the vendor-diff command."""
+        """Return help message for the diff command."""
         return """%s
-Usage: labctl %s <db0> <db1>
-Compares vendor entries between two databases.""" % (err, VendorDiff.str_id)
+Usage: labctl %s <db0> <db1> [field[,field...]]
+Compares the values of the given field(s) (default: vendor) between two
+databases, eg. "vendor,product".""" % (err, cls.str_id)
 
-class VendorCommon(BaseComparator):
-    """This tool looks for common vendors between two databases."""
-    str_id = 'vendor-common'
+class FieldCommon(FieldDiff):
+    """This tool looks for field values common to two databases."""
+    str_id = 'common'
+    _show = ' '
 
-    def _compare(self, db0, db1):
-        """Display vendors found in both databases."""
-        # select distinct nmapos.n_vendor from nmapos where exists (select id from cpeos where cpe_vendor = nmapos.n_vendor)
-        cursor = db0.db_cnx.execute('select distinct %(f0)s from %(db0)s where exists (select id from %(db1)s where %(f1)s = %(db0)s.%(f0)s)' \
-            % {'db0': db0.str_id, 'db1': db1.str_id, 'f0':db0.dbfield('vendor'), 'f1':db1.dbfield('vendor')})
+    @classmethod
+    def help_msg(cls, err=''):
+        """Return help message for the common command."""
+        return """%s
+Usage: labctl %s <db0> <db1> [field[,field...]]
+Display the values of the given field(s) (default: vendor) found in both
+databases.""" % (err, cls.str_id)
 
-        for vendor in cursor:
-            print vendor[0]
+class VendorDiff(MergeComparator):
+    """Diff vendors.
+    
+    This tool performs a diff between vendors contained in two given tables. The
+    result is displayed in a "unified diff-like" fashion. See the FieldDiff
+    docstring for more information.
+    """
+    str_id = 'vendor-diff'
+    _show = '+-'
 
     @classmethod
     def help_msg(cls, err=''):
         """Return help message for the vendor-diff command."""
         return """%s
 Usage: labctl %s <db0> <db1>
-Display vendors found in both databases.""" % (err, VendorDiff.str_id)
+Compares vendor entries between two databases.""" % (err, cls.str_id)
+
+class VendorCommon(MergeComparator):
+    """This tool looks for common vendors between two databases."""
+    str_id = 'vendor-common'
+    _show = ' '
 
+    @classmethod
+    def help_msg(cls, err=''):
+        """Return help message for the vendor-common command."""
+        return """%s
+Usage: labctl %s <db0> <db1>
+Display vendors found in both databases.""" % (err, cls.str_id)
@@ -0,0 +1,90 @@
+#!/usr/bin/python
+#
+# Author:
+# Henri Doreau <henri.doreau@greenbone.net>
+#
+# Copyright:
+# Copyright (C) 2011 Greenbone Networks GmbH, http://www.greenbone.net
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2
+# (or any later version), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301 USA.
+##
+
+
+
+"""Export of the databases for use by other tools"""
+
+import os
+import time
+import getopt
+
+from cpelab.tools.toolbase import Tool, RuntimeToolError
+from cpelab.databases.db import DBError, DATADIR
+from cpelab.databases.cpedict import CPEOS
+from cpelab.databases.snapshot import write_snapshot, SNAPSHOT_VERSION
+
+
+DEFAULT_SNAPSHOT_FILE = 'cpeos.snapshot'
+
+
+class Export(Tool):
+    """This tool exports the CPE dictionary into a file."""
+    str_id = 'export'
+
+    _formats = ['snapshot']
+
+    def start(self, args):
+        """Tool entry point."""
+        try:
+            opts, args = getopt.gnu_getopt(args, '', ['format=', 'output='])
+        except getopt.GetoptError, err:
+            raise RuntimeToolError('Invalid arguments (%s)' % str(err))
+
+        if len(args) > 0:
+            raise RuntimeToolError('Invalid arguments')
+
+        fmt = 'snapshot'
+        output = os.path.join(DATADIR, DEFAULT_SNAPSHOT_FILE)
+        for opt, val in opts:
+            if opt == '--format':
+                if val not in self._formats:
+                    raise RuntimeToolError('Unknown format: %s' % val)
+                fmt = val
+            elif opt == '--output':
+                output = val
+
+        start = time.time()
+        try:
+            count = write_snapshot(CPEOS(readonly=True), output)
+        except (DBError, IOError, OSError), err:
+            raise RuntimeToolError('Export failed (%s)' % str(err))
+        print '[+] %d entries exported to %s in %.2fs (%s version %d, %d bytes)' \
+            % (count, output, time.time() - start, fmt, SNAPSHOT_VERSION,
+               os.path.getsize(output))
+
+    @classmethod
+    def help_msg(cls, err=''):
+        """Return help message for the export command."""
+        return """%s
+Usage: labctl %s [--format <format>] [--output <file>]
+Export the CPE dictionary (OS and hardware entries) for use by other tools.
+
+  --format  Output format (default: snapshot)
+  --output  Output file (default: %s)
+
+Formats:
+  snapshot  Binary file meant to be memory-mapped and binary searched (see
+            cpelab.databases.snapshot.Snapshot)
+""" % (err, cls.str_id, os.path.join(DATADIR, DEFAULT_SNAPSHOT_FILE))
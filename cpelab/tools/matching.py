@@ -0,0 +1,93 @@
+#!/usr/bin/python
+#
+# Author:
+# Henri Doreau <henri.doreau@greenbone.net>
+#
+# Copyright:
+# Copyright (C) 2011 Greenbone Networks GmbH, http://www.greenbone.net
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2
+# (or any later version), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301 USA.
+##
+
+
+"""CPE name matching against the dictionary"""
+
+import getopt
+
+from cpelab.tools.toolbase import Tool, RuntimeToolError
+from cpelab.databases.db import DBError
+from cpelab.databases.cpedict import CPEOS, CPENameMatcher
+
+
+class CPEMatch(Tool):
+    """This tool lists the dictionary entries matching a CPE name."""
+    str_id = 'match'
+
+    def start(self, args):
+        """Tool entry point. The only expected argument is the CPE name to
+        match, possibly with wildcards.
+        """
+        try:
+            opts, args = getopt.gnu_getopt(args, '', ['mode=', 'limit='])
+        except getopt.GetoptError, err:
+            raise RuntimeToolError('Invalid arguments (%s)' % str(err))
+
+        if len(args) != 1:
+            raise RuntimeToolError('Invalid arguments')
+
+        mode = 'superset'
+        limit = None
+        for opt, val in opts:
+            if opt == '--mode':
+                mode = val
+            elif opt == '--limit':
+                try:
+                    limit = int(val)
+                except ValueError:
+                    raise RuntimeToolError('Invalid limit: %s' % val)
+                if limit < 1:
+                    raise RuntimeToolError('Invalid limit: %d' % limit)
+
+        matcher = CPENameMatcher(CPEOS(readonly=True))
+        count = 0
+        try:
+            for item in matcher.match(args[0], mode, limit):
+                print '%s\t%s' % (item['name'].encode('utf-8'),
+                    item['title'].encode('utf-8'))
+                count += 1
+        except DBError, err:
+            raise RuntimeToolError(str(err))
+
+        print '%d matching names' % count
+
+    @classmethod
+    def help_msg(cls, err=''):
+        """Return help message for the match command."""
+        return """%s
+Usage: labctl %s [--mode <mode>] [--limit N] <cpe name>
+List the CPE dictionary names matching a given name. Components may contain
+wildcards ('*': any characters, '?': any single character). Empty or missing
+components stand for any value in superset mode, and for an empty value in the
+other modes.
+
+  --mode   Matching mode (default: superset):
+             equal     names equal to the given one
+             superset  names the given one matches (more specific or equal)
+             subset    names matching the given one (more generic or equal)
+  --limit  Display at most N names
+
+eg. labctl %s 'cpe:/o:microsoft:windows_*:*:sp2'
+""" % (err, cls.str_id, cls.str_id)
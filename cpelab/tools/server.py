@@ -0,0 +1,431 @@
+#!/usr/bin/python
+#
+# Author:
+# Henri Doreau <henri.doreau@greenbone.net>
+#
+# Copyright:
+# Copyright (C) 2011 Greenbone Networks GmbH, http://www.greenbone.net
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2
+# (or any later version), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301 USA.
+##
+
+
+"""Long running translation service.
+
+Databases and translators are loaded once and then queried over HTTP, either on
+a local TCP port or on a Unix socket. Requests are dispatched to a fixed pool of
+worker threads, each of them owning its own (read-only) database connections
+and translator. The database file is watched in the background so that workers
+pick up new contents after an update.
+"""
+
+import os
+import sys
+import json
+import stat
+import time
+import Queue
+import getopt
+import socket
+import urlparse
+import threading
+import collections
+import SocketServer
+import BaseHTTPServer
+
+from cpelab.databases.db import DATADIR, SQLITE_DB_FILE
+from cpelab.databases.utils import get_db
+from cpelab.databases.nmapos import NmapOS
+from cpelab.databases.cpedict import CPEOS
+from cpelab.tools.toolbase import Tool, RuntimeToolError
+from cpelab.tools.translation import NmapOS2CPE
+
+
+DEFAULT_ADDRESS = '127.0.0.1'
+DEFAULT_PORT = 8380
+
+# seconds between two checks of the database file
+RELOAD_INTERVAL = 2.
+
+# number of translation results kept in memory (least recently used first out)
+MEMOIZED_RESULTS = 4096
+
+
+class Serve(Tool):
+    """This tool runs a translation server."""
+    str_id = 'serve'
+
+    def start(self, args):
+        """Tool entry point. Serve until interrupted."""
+        try:
+            opts, args = getopt.gnu_getopt(args, '', ['bind=', 'port=',
+                'socket=', 'threads=', 'translator=', 'no-cache'])
+        except getopt.GetoptError, err:
+            raise RuntimeToolError('Invalid arguments (%s)' % str(err))
+
+        if len(args) > 0:
+            raise RuntimeToolError('Invalid arguments')
+
+        address = DEFAULT_ADDRESS
+        port = DEFAULT_PORT
+        unix_socket = None
+        threads = 8
+        translator_id = NmapOS2CPE._default_translator
+        use_cache = True
+        for opt, val in opts:
+            if opt == '--bind':
+                address = val
+            elif opt in ('--port', '--threads'):
+                try:
+                    val = int(val)
+                except ValueError:
+                    raise RuntimeToolError('Invalid value for %s: %s' % (opt, val))
+                if opt == '--port':
+                    port = val
+                else:
+                    threads = val
+            elif opt == '--socket':
+                unix_socket = val
+            elif opt == '--translator':
+                if not NmapOS2CPE._translators.has_key(val):
+                    raise RuntimeToolError('Unknown translator: %s' % val)
+                translator_id = val
+                NmapOS2CPE._translators[val].check_requirements()
+            elif opt == '--no-cache':
+                use_cache = False
+
+        if threads < 1:
+            raise RuntimeToolError('Invalid number of threads: %d' % threads)
+
+        service = TranslationService(translator_id, use_cache)
+        if unix_socket is not None:
+            if os.path.exists(unix_socket):
+                # stale socket of a previous run
+                if not stat.S_ISSOCK(os.lstat(unix_socket).st_mode):
+                    raise RuntimeToolError('Cannot listen on %s (file exists'
+                        ' and is not a socket)' % unix_socket)
+                os.unlink(unix_socket)
+            server = UnixTranslationServer(unix_socket, service, threads)
+            where = unix_socket
+        else:
+            try:
+                server = TCPTranslationServer((address, port), service, threads)
+            except socket.error, err:
+                raise RuntimeToolError('Cannot listen on %s:%d (%s)' \
+                    % (address, port, str(err)))
+            where = 'http://%s:%d/' % (address, port)
+
+        print '[+] Serving %s translations on %s (%d threads)' \
+            % (translator_id, where, threads)
+        sys.stdout.flush()
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print '[+] Interrupted'
+        finally:
+            service.stop()
+            server.server_close()
+            if unix_socket is not None and os.path.exists(unix_socket):
+                os.unlink(unix_socket)
+
+    @classmethod
+    def help_msg(cls, err=''):
+        """Return help message for the serve command."""
+        return """%s
+Usage: labctl %s [--bind <address>] [--port <port>] [--socket <path>]
+                    [--threads N] [--translator <name>] [--no-cache]
+Answer translation and search requests over HTTP (JSON), without reloading the
+databases for each request.
+
+  --bind        Address to listen on (default: %s)
+  --port        TCP port to listen on (default: %d)
+  --socket      Listen on a Unix socket instead
+  --threads     Number of worker threads (default: 8)
+  --translator  Translator to use (default: %s)
+  --no-cache    Ignore the persistent translation cache
+
+Endpoints:
+  GET  /translate?q=<signature title>
+  POST /translate      JSON list of signature titles, results in the same order
+  GET  /search?db=<db>&q=<pattern>
+  GET  /status
+""" % (err, cls.str_id, DEFAULT_ADDRESS, DEFAULT_PORT,
+       NmapOS2CPE._default_translator)
+
+class TranslationService:
+    """Shared state of the server: per-thread translators, in-memory results
+    and background reload on database changes.
+    """
+    def __init__(self, translator_id, use_cache=True):
+        """Initialize a new service and start watching the database file."""
+        self.translator_id = translator_id
+        self.use_cache = use_cache
+        self.started = time.time()
+        self.requests = 0
+        self.generation = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # {pattern: results}, in order of last use
+        self._results = collections.OrderedDict()
+        self._path = os.path.join(os.getcwd(), DATADIR, SQLITE_DB_FILE)
+        self._mtime = self._db_mtime()
+        self._running = True
+        self._watcher = threading.Thread(target=self._watch)
+        self._watcher.daemon = True
+        self._watcher.start()
+
+    def stop(self):
+        """Stop the background watcher."""
+        self._running = False
+
+    def translate(self, pattern):
+        """Translate the nmap signatures matching pattern. Return a list of
+        results (dicts).
+        """
+        with self._lock:
+            self.requests += 1
+            res = self._results.pop(pattern, None)
+            if res is not None:
+                self._results[pattern] = res
+        if res is not None:
+            return res
+
+        generation = self.generation
+        translator = self._translator()
+        res = []
+        sigs = translator.db0.lookup_all(pattern)
+        translator.prepare(sigs)
+        for sig in sigs:
+            score, names = translator.translate_names(sig)
+            entry = dict(sig.fields)
+            entry['score'] = score
+            entry['cpe'] = names
+            res.append(entry)
+
+        with self._lock:
+            # don't keep results computed against outdated contents
+            if generation == self.generation:
+                self._results[pattern] = res
+                if len(self._results) > MEMOIZED_RESULTS:
+                    self._results.popitem(last=False)
+        return res
+
+    def search(self, db_name, pattern):
+        """Return the fields of the entries of db_name matching pattern, or
+        None if there is no such database.
+        """
+        with self._lock:
+            self.requests += 1
+        db = self._database(db_name)
+        if db is None:
+            return None
+        return [x.fields for x in db.lookup_all(pattern)]
+
+    def status(self):
+        """Return a dict describing the service."""
+        translator = self._translator()
+        return {
+            'translator': self.translator_id,
+            'generation': self.generation,
+            'uptime': time.time() - self.started,
+            'requests': self.requests,
+            'memoized': len(self._results),
+            'fingerprints': {
+                translator.db0.str_id: translator.db0.fingerprint(),
+                translator.db1.str_id: translator.db1.fingerprint()
+            }
+        }
+
+    def _translator(self):
+        """Return the translator of the current thread, instantiated on first
+        use and after each reload.
+        """
+        local = self._local
+        if getattr(local, 'generation', None) != self.generation:
+            local.generation = self.generation
+            local.databases = {}
+            translator = NmapOS2CPE._translators[self.translator_id]
+            local.translator = translator(NmapOS(readonly=True),
+                CPEOS(readonly=True), self.use_cache)
+        return local.translator
+
+    def _database(self, db_name):
+        """Return the database db_name, opened by the current thread, or None
+        if there is no such database.
+        """
+        self._translator()
+        databases = self._local.databases
+        if not databases.has_key(db_name):
+            databases[db_name] = get_db(db_name, readonly=True)
+        return databases[db_name]
+
+    def _db_mtime(self):
+        """Return the last modification time of the database (including its
+        write-ahead log).
+        """
+        mtime = 0
+        for path in (self._path, self._path + '-wal'):
+            try:
+                mtime = max(mtime, os.stat(path).st_mtime)
+            except OSError:
+                pass
+        return mtime
+
+    def _watch(self):
+        """Background thread: invalidate translators and results whenever the
+        database is modified.
+        """
+        while self._running:
+            time.sleep(RELOAD_INTERVAL)
+            mtime = self._db_mtime()
+            if mtime == self._mtime:
+                continue
+            self._mtime = mtime
+            with self._lock:
+                self._results = collections.OrderedDict()
+                self.generation += 1
+            print '[+] Database modified, reloading (generation %d)' \
+                % self.generation
+            sys.stdout.flush()
+
+class RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Decode requests, dispatch them to the service and encode results as
+    JSON.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    # close idle keep-alive connections, so that they don't hold a worker
+    timeout = 30
+
+    # maximum size of a request body
+    max_body = 16 * 1024 * 1024
+
+    def do_GET(self):
+        """Handle GET requests."""
+        url = urlparse.urlparse(self.path)
+        params = dict(urlparse.parse_qsl(url.query))
+        service = self.server.service
+
+        if url.path == '/translate' and params.has_key('q'):
+            self._reply(200, service.translate(params['q']))
+        elif url.path == '/search' and params.has_key('q'):
+            db_name = params.get('db', CPEOS.str_id)
+            res = service.search(db_name, params['q'])
+            if res is None:
+                self._reply(404, {'error': 'Unknown database: %s' % db_name})
+            else:
+                self._reply(200, res)
+        elif url.path == '/status':
+            self._reply(200, service.status())
+        else:
+            self._reply(404, {'error': 'Not found: %s' % self.path})
+
+    def do_POST(self):
+        """Handle POST requests (batch translation)."""
+        if urlparse.urlparse(self.path).path != '/translate':
+            self._reply(404, {'error': 'Not found: %s' % self.path})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = -1
+        if length < 0:
+            # the end of the body is unknown, the connection can't be reused
+            self.close_connection = 1
+            self._reply(400, {'error': 'Invalid Content-Length'})
+            return
+        if length > self.max_body:
+            self._reply(413, {'error': 'Request too large'})
+            return
+
+        try:
+            patterns = json.loads(self.rfile.read(length))
+        except ValueError, err:
+            self._reply(400, {'error': 'Invalid JSON (%s)' % str(err)})
+            return
+        if not isinstance(patterns, list) or \
+            not all([isinstance(x, basestring) for x in patterns]):
+            self._reply(400, {'error': 'Expected a list of signature titles'})
+            return
+
+        service = self.server.service
+        self._reply(200, [service.translate(x) for x in patterns])
+
+    def _reply(self, code, obj):
+        """Send obj, JSON encoded."""
+        body = json.dumps(obj)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        """Return the client address (Unix sockets have none)."""
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'local'
+
+    def log_message(self, format, *args):
+        """Don't log every request."""
+
+class PooledMixIn:
+    """Handle requests in a fixed pool of threads, so that per-thread state
+    (database connections, translators) outlives single requests.
+    """
+    daemon_threads = True
+
+    def start_workers(self, count):
+        """Spawn count worker threads."""
+        self._requests = Queue.Queue(count * 4)
+        for i in xrange(count):
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+
+    def process_request(self, request, client_address):
+        """Queue a new connection for the workers."""
+        self._requests.put((request, client_address))
+
+    def _work(self):
+        """Worker thread main loop."""
+        while True:
+            request, client_address = self._requests.get()
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            self.shutdown_request(request)
+
+class TCPTranslationServer(PooledMixIn, BaseHTTPServer.HTTPServer):
+    """Translation server listening on a TCP port."""
+    allow_reuse_address = True
+
+    def __init__(self, address, service, threads):
+        """Bind to address and start the workers."""
+        BaseHTTPServer.HTTPServer.__init__(self, address, RequestHandler)
+        self.service = service
+        self.start_workers(threads)
+
+class UnixTranslationServer(PooledMixIn, SocketServer.UnixStreamServer):
+    """Translation server listening on a Unix socket."""
+
+    def __init__(self, path, service, threads):
+        """Bind to path and start the workers."""
+        SocketServer.UnixStreamServer.__init__(self, path, RequestHandler)
+        self.service = service
+        self.start_workers(threads)
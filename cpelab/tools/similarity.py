@@ -0,0 +1,117 @@
+#!/usr/bin/python
+#
+# Author:
+# Henri Doreau <henri.doreau@greenbone.net>
+#
+# Copyright:
+# Copyright (C) 2011 Greenbone Networks GmbH, http://www.greenbone.net
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2
+# (or any later version), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301 USA.
+##
+
+
+"""String similarity primitives used by the translators.
+
+Edit distances are computed with Myers' bit-parallel algorithm (as described by
+Hyyro for the global distance): each column of the dynamic programming matrix
+is encoded into two integers, so that the cost is O(n) big integer operations
+instead of O(n*m) Python steps. An optional maximum distance allows to give up
+as soon as a string cannot get close enough.
+"""
+
+
+def levenshtein(str0, str1, max_dist=None):
+    """Return the Levenshtein distance between two strings, or None if it is
+    greater than max_dist.
+    """
+    if len(str0) > len(str1):
+        str0, str1 = str1, str0
+    return _distance(_pattern_masks(str0), len(str0), str1, max_dist)
+
+def best_matches(ref, candidates, max_dist=None):
+    """Compare ref against a list of candidate strings. Return a tuple
+    (distance, indexes) with the smallest distance found and the indexes of the
+    candidates at this distance, or (None, []) if no candidate is within
+    max_dist.
+
+    The best distance found so far is used as cutoff for the remaining
+    candidates.
+    """
+    masks = _pattern_masks(ref)
+    best_dist = max_dist
+    best_idx = []
+    for idx, candidate in enumerate(candidates):
+        dist = _distance(masks, len(ref), candidate, best_dist)
+        if dist is None:
+            continue
+        if len(best_idx) == 0 or dist < best_dist:
+            best_dist = dist
+            best_idx = [idx]
+        elif dist == best_dist:
+            best_idx.append(idx)
+
+    if len(best_idx) == 0:
+        return None, []
+    return best_dist, best_idx
+
+def _pattern_masks(pattern):
+    """Return the match bitmasks of pattern: for each character, an integer
+    which bit i is set if pattern[i] is this character.
+    """
+    masks = {}
+    bit = 1
+    for char in pattern:
+        masks[char] = masks.get(char, 0) | bit
+        bit <<= 1
+    return masks
+
+def _distance(masks, m, text, max_dist):
+    """Myers/Hyyro bit-vector edit distance between the pattern of length m
+    described by masks and text. Return None if the distance exceeds max_dist.
+    """
+    n = len(text)
+    if max_dist is not None and abs(n - m) > max_dist:
+        return None
+    if m == 0:
+        return n
+
+    full = (1 << m) - 1
+    last = 1 << (m - 1)
+    pos_v, neg_v = full, 0
+    score = m
+
+    for j, char in enumerate(text):
+        match = masks.get(char, 0)
+        x_v = match | neg_v
+        x_h = (((match & pos_v) + pos_v) ^ pos_v) | match
+        pos_h = neg_v | (~(x_h | pos_v) & full)
+        neg_h = pos_v & x_h
+
+        if pos_h & last:
+            score += 1
+        elif neg_h & last:
+            score -= 1
+
+        # the distance can decrease by at most one per remaining character
+        if max_dist is not None and score - (n - j - 1) > max_dist:
+            return None
+
+        pos_h = ((pos_h << 1) | 1) & full
+        neg_h = (neg_h << 1) & full
+        pos_v = neg_h | (~(x_v | pos_h) & full)
+        neg_v = pos_h & x_v
+
+    return score
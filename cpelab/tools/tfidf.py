@@ -0,0 +1,137 @@
+#!/usr/bin/python
+#
+# Author:
+# Henri Doreau <henri.doreau@greenbone.net>
+#
+# Copyright:
+# Copyright (C) 2011 Greenbone Networks GmbH, http://www.greenbone.net
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2
+# (or any later version), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301 USA.
+##
+
+
+"""Vectorized title similarity (TF-IDF weighted cosine).
+
+Titles are turned into sparse vectors of their words and character trigrams,
+weighted by inverse document frequency and normalized, so that comparing a set
+of titles against a whole database boils down to sparse matrix products. These
+are computed by blocks of rows to bound memory usage.
+
+This module requires numpy and scipy.
+"""
+
+import math
+
+import numpy
+import scipy.sparse
+
+
+# maximum number of cells of the dense similarity blocks (8 bytes each)
+MAX_BLOCK_CELLS = 4 * 1024 * 1024
+
+# similarities closer than this are considered equal
+EPSILON = 1e-9
+
+
+def tokenize(title):
+    """Return the list of features of a title: its words, and the character
+    trigrams of the whole title (padded with spaces).
+    """
+    padded = ' %s ' % title
+    return title.split() + [padded[i:i + 3] for i in xrange(len(padded) - 2)]
+
+class TfidfIndex:
+    """Sparse TF-IDF matrix of a list of documents (titles), queried for the
+    documents the most similar to other titles.
+    """
+    def __init__(self, documents):
+        """Build the index of documents (list of strings)."""
+        self._vocabulary = {}
+        tokens = [tokenize(x) for x in documents]
+
+        # features are added to the vocabulary by the documents only
+        for doc in tokens:
+            for token in doc:
+                if not self._vocabulary.has_key(token):
+                    self._vocabulary[token] = len(self._vocabulary)
+
+        freqs = numpy.zeros(len(self._vocabulary))
+        for doc in tokens:
+            for idx in set([self._vocabulary[x] for x in doc]):
+                freqs[idx] += 1
+        # smoothed inverse document frequency
+        self._idf = numpy.log((1. + len(documents)) / (1. + freqs)) + 1.
+
+        self._matrix = self._vectorize(tokens)
+        # transposed once for all the products
+        self._matrix_t = self._matrix.T.tocsr()
+
+    def __len__(self):
+        """Return the number of indexed documents."""
+        return self._matrix.shape[0]
+
+    def transform(self, texts):
+        """Return the normalized TF-IDF matrix (CSR) of texts. Features unknown
+        to the indexed documents are ignored.
+        """
+        return self._vectorize([tokenize(x) for x in texts])
+
+    def top_matches(self, texts, k, min_similarity=0.):
+        """Iterate over the best matches of each text (in the same order):
+        lists of up to k tuples (similarity, document index), most similar
+        first. Documents less similar than min_similarity are discarded.
+        """
+        if len(texts) == 0:
+            return
+        queries = self.transform(texts)
+        block_size = max(1, MAX_BLOCK_CELLS / max(1, len(self)))
+        for start in xrange(0, queries.shape[0], block_size):
+            block = queries[start:start + block_size].dot(self._matrix_t)
+            block = block.toarray()
+            for row in block:
+                yield self._best(row, k, min_similarity)
+
+    def _best(self, row, k, min_similarity):
+        """Return the top k (similarity, index) of a row of similarities."""
+        if len(row) > k:
+            best_idx = numpy.argpartition(-row, k - 1)[:k]
+        else:
+            best_idx = numpy.arange(len(row))
+        best_idx = best_idx[row[best_idx] >= max(min_similarity, EPSILON)]
+        # most similar first, lowest index first among equals
+        order = numpy.lexsort((best_idx, -row[best_idx]))
+        return [(float(row[i]), int(i)) for i in best_idx[order]]
+
+    def _vectorize(self, tokens):
+        """Return the normalized TF-IDF matrix (CSR) of lists of tokens."""
+        indptr = [0]
+        indices = []
+        data = []
+        for doc in tokens:
+            counts = {}
+            for token in doc:
+                idx = self._vocabulary.get(token)
+                if idx is not None:
+                    counts[idx] = counts.get(idx, 0) + 1
+            weights = [(idx, count * self._idf[idx]) for idx, count in counts.iteritems()]
+            norm = math.sqrt(sum([x[1] ** 2 for x in weights])) or 1.
+            for idx, weight in weights:
+                indices.append(idx)
+                data.append(weight / norm)
+            indptr.append(len(indices))
+
+        return scipy.sparse.csr_matrix((data, indices, indptr),
+            shape=(len(tokens), len(self._vocabulary)))
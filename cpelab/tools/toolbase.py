@@ -25,8 +25,15 @@
 
 """Base classes for processing modules"""
 
-from cpelab.databases.db import Database
+import sys
+import json
+import time
+import getopt
+
+from cpelab.databases.db import Database, DBError, SourceUnchanged, \
+    LoadTransaction
 from cpelab.databases.utils import DBSpecParser, DBSpecError
+from cpelab.databases.source import DOWNLOAD_DIR
 
 
 class Tool:
@@ -72,19 +79,210 @@ class UpdateDB(Tool):
     str_id = 'update'
 
     def start(self, args):
-        """Update databse from fresh upstream sources."""
+        """Update databse from fresh upstream sources, or from the source given
+        on the command line.
+        """
+        try:
+            opts, args = getopt.gnu_getopt(args, '', ['source=', 'incremental'])
+        except getopt.GetoptError, err:
+            raise RuntimeToolError('Invalid arguments (%s)' % str(err))
+
+        source = None
+        incremental = False
+        for opt, val in opts:
+            if opt == '--source':
+                source = val
+            elif opt == '--incremental':
+                incremental = True
+
         try:
-            for db_ref in DBSpecParser(' '.join(args)):
-                db_ref.populate()
+            dbs = list(DBSpecParser(' '.join(args)))
+            if source is not None and len(dbs) != 1:
+                raise RuntimeToolError('--source requires a single database')
+            if len(dbs) == 1:
+                dbs[0].populate(source=source, incremental=incremental)
+            else:
+                ConcurrentUpdate(dbs, incremental).run()
         except DBSpecError, err:
             raise RuntimeToolError('Invalid arguments (%s)' % str(err))
+        except DBError, err:
+            raise RuntimeToolError(str(err))
 
     @classmethod
     def help_msg(cls, err=''):
         """Return help message for the update command."""
         return """%s
-Usage: labctl %s <db>
-Download and extract the given database(s)""" % (err, cls.str_id)
+Usage: labctl %s [--source <path|->] [--incremental] <db>
+Download and extract the given database(s)
+
+  --source       Load a local copy (possibly .gz or .xz compressed) of the
+                 database instead of the upstream one, '-' reads from stdin.
+  --incremental  Only apply the changes since the previous update, instead of
+                 reloading the whole database.
+
+Several databases are downloaded and parsed concurrently. Downloads are cached
+(and resumed if interrupted) under %s, a database is left
+untouched if its upstream source didn't change since the last update.""" \
+    % (err, cls.str_id, DOWNLOAD_DIR)
+
+class ConcurrentUpdate:
+    """Update several databases at once. Each upstream source is downloaded and
+    parsed by its own process, which hands lists of rows over to the parent
+    process through a bounded queue. The parent is the only one writing to the
+    database, all the databases are loaded in a single transaction: if any
+    source fails, they all keep their previous content.
+    """
+
+    # maximum number of lists of rows waiting to be stored
+    queue_size = 8
+
+    # number of rows between two progress reports of a source
+    progress_step = 50000
+
+    # seconds between two checks that the readers are still running
+    poll_interval = 1
+
+    def __init__(self, dbs, incremental=False):
+        """Initialize a new update of the given databases."""
+        self.dbs = dbs
+        self.incremental = incremental
+
+    def run(self):
+        """Read all the sources and store their contents."""
+        # not imported by the module, which all the tools depend on
+        import multiprocessing
+        queue = multiprocessing.Queue(self.queue_size)
+        # set once every source is available, see _read_source()
+        go = multiprocessing.Event()
+        readers = {}
+        pending = {}
+        start = time.time()
+
+        for db_ref in self.dbs:
+            print '[+] Updating %s...' % db_ref.str_id
+            pending[db_ref.str_id] = db_ref
+            # SQLite connections can't be used across fork(): readers are
+            # given what they need from the database
+            reader = multiprocessing.Process(target=_read_source,
+                args=(queue, go, db_ref, db_ref.loaded_digest(), self.incremental))
+            reader.daemon = True
+            reader.start()
+            readers[db_ref.str_id] = reader
+
+        # tables are only modified once every source is available, readers
+        # don't send rows before that
+        digests = {}
+        ready = set()
+        loaders = {}
+        transaction = None
+        received = dict([(x, 0) for x in pending])
+        try:
+            while len(pending) > 0:
+                str_id, kind, data = self._receive(queue, readers, pending)
+                if kind == 'error':
+                    raise DBError('Cannot update %s (%s)' % (str_id, data))
+                elif kind == 'ready':
+                    ready.add(str_id)
+                    digests[str_id] = data
+                elif kind == 'unchanged':
+                    print '[+] %s: source unchanged since the last update' % str_id
+                    ready.add(str_id)
+                    del pending[str_id]
+                else:
+                    self._process(str_id, kind, data, loaders, received, pending,
+                        digests)
+
+                if transaction is None and len(ready) == len(self.dbs):
+                    # databases share the connection of the process
+                    transaction = LoadTransaction(self.dbs[0].db_cnx).__enter__()
+                    for db_ref in pending.itervalues():
+                        loaders[db_ref.str_id] = db_ref.begin_load(self.incremental)
+                    go.set()
+        except:
+            for str_id in pending:
+                if loaders.has_key(str_id):
+                    loaders[str_id].abort()
+            if transaction is not None:
+                transaction.__exit__(*sys.exc_info())
+            raise
+        finally:
+            for reader in readers.itervalues():
+                if reader.is_alive():
+                    reader.terminate()
+                reader.join()
+
+        if transaction is not None:
+            transaction.__exit__(None, None, None)
+
+        print '[+] Update complete in %.2fs!' % (time.time() - start)
+
+    def _receive(self, queue, readers, pending):
+        """Return the next message from the readers. Raise DBError if the
+        reader of a pending source exited without completing it (killed, out
+        of memory...).
+        """
+        from Queue import Empty
+        while True:
+            try:
+                return queue.get(timeout=self.poll_interval)
+            except Empty:
+                pass
+            dead = [x for x in pending if not readers[x].is_alive()]
+            if len(dead) == 0:
+                continue
+            # messages sent before exiting are in the queue by now
+            try:
+                return queue.get(timeout=self.poll_interval)
+            except Empty:
+                raise DBError('Cannot update %s (reader exited with code %s)' \
+                    % (dead[0], readers[dead[0]].exitcode))
+
+    def _process(self, str_id, kind, data, loaders, received, pending, digests):
+        """Store rows received from a source, or complete the loading of its
+        database at the end of the source.
+        """
+        if kind == 'rows':
+            count = received[str_id]
+            loaders[str_id].extend(data)
+            received[str_id] += len(data)
+            if count / self.progress_step != received[str_id] / self.progress_step:
+                print '[+] %s: %d rows received' % (str_id, received[str_id])
+        elif kind == 'done':
+            print '[+] %s: source read in %.2fs' % (str_id, data)
+            if received[str_id] == 0:
+                raise DBError('No entries found in the %s source' % str_id)
+            db_ref = pending.pop(str_id)
+            db_ref.end_load(loaders[str_id], self.incremental)
+            db_ref.set_loaded_digest(digests[str_id])
+
+def _read_source(queue, go, db_ref, loaded_digest, incremental):
+    """Concurrent update reader: parse the upstream source of db_ref and send
+    the rows to the writer. Messages are tuples (db name, kind, data), kind
+    being one of 'ready' (source opened, data is its digest), 'unchanged'
+    (source already loaded), 'rows' (data is a list of rows), 'done' (data is
+    the reading time) or 'error' (data is the message).
+
+    The database is not accessed: loaded_digest is the digest of the source
+    of its last update, read by the writer.
+
+    Parsing starts once the writer sets the event go, after all the sources
+    are ready: rows would otherwise pile up in the writer until then.
+    """
+    start = time.time()
+    db_ref.assume_loaded_digest(loaded_digest)
+    try:
+        try:
+            batches = db_ref.read_source(incremental=incremental)
+        except SourceUnchanged:
+            queue.put((db_ref.str_id, 'unchanged', None))
+            return
+        queue.put((db_ref.str_id, 'ready', db_ref.read_digest))
+        go.wait()
+        for rows in batches:
+            queue.put((db_ref.str_id, 'rows', rows))
+        queue.put((db_ref.str_id, 'done', time.time() - start))
+    except Exception, err:
+        queue.put((db_ref.str_id, 'error', str(err) or err.__class__.__name__))
 
 class StatsDB(Tool):
     """Count the number of entries and different vendors for the selected
@@ -93,46 +291,121 @@ class StatsDB(Tool):
     str_id = 'stats'
 
     def start(self, args):
-        """Compute and display statistics about existing databases."""
+        """Display statistics about existing databases."""
         try:
-            for db_ref in DBSpecParser(' '.join(args)):
-                print '%s:' % db_ref.str_id
-                print '\t%d entries loaded' % db_ref.count()
+            opts, args = getopt.gnu_getopt(args, '', ['json', 'recompute'])
+        except getopt.GetoptError, err:
+            raise RuntimeToolError('Invalid arguments (%s)' % str(err))
 
-                for field in ['vendor', 'product']:
-                    print '\t%d %ss' % (db_ref.count(field), field)
+        as_json = False
+        recompute = False
+        for opt, _ in opts:
+            if opt == '--json':
+                as_json = True
+            elif opt == '--recompute':
+                recompute = True
 
+        res = {}
+        try:
+            for db_ref in DBSpecParser(' '.join(args), readonly=not recompute):
+                if recompute:
+                    db_ref.store_stats()
+                stats = db_ref.stats()
+                if as_json:
+                    res[db_ref.str_id] = stats
+                else:
+                    self._display(db_ref.str_id, stats)
         except DBSpecError, err:
             raise RuntimeToolError('Invalid arguments (%s)' % str(err))
-            
+
+        if as_json:
+            print json.dumps(res, indent=2, sort_keys=True)
+
+    def _display(self, name, stats):
+        """Print statistics of a single database in a human readable way."""
+        print '%s:' % name
+        print '\t%d entries loaded' % stats['total']
+
+        for field in ['vendor', 'product']:
+            print '\t%d %ss' % (stats['distinct'][field], field)
+
+        print '\ttop vendors: %s' % ', '.join(['%s (%d)' % (x[0], x[1]) \
+            for x in stats['top_vendors']])
+        for field, values in sorted(stats['breakdown'].iteritems()):
+            print '\t%s: %s' % (field, ', '.join(['%s (%d)' % (k, v) \
+                for k, v in sorted(values.iteritems(), key=lambda x: -x[1])]))
+
     @classmethod
     def help_msg(cls, err=''):
         """Return help message for the stats command."""
         return """%s
-Usage: labctl %s <db>
-Display statistics about the given database(s)""" % (err, cls.str_id)
+Usage: labctl %s [--json] [--recompute] <db>
+Display statistics about the given database(s)
+
+  --json       Machine readable output
+  --recompute  Compute statistics again from the content of the database(s)""" % (err, cls.str_id)
 
 class SearchDB(Tool):
     """Search for a given pattern in the entries."""
     str_id = 'search'
 
     def start(self, args):
-        """Look for a given pattern in the selected table(s)."""
+        """Look for a given pattern in the selected table(s). Results are
+        displayed as they are read.
+        """
+        try:
+            opts, args = getopt.gnu_getopt(args, '', ['limit=', 'offset=',
+                'after=', 'count-only'])
+        except getopt.GetoptError, err:
+            raise RuntimeToolError('Invalid arguments (%s)' % str(err))
+
         if len(args) != 2:
             raise RuntimeToolError('Invalid command line')
 
         pattern = args[0]
+        limit = None
+        offset = 0
+        after = None
+        count_only = False
+        for opt, val in opts:
+            if opt == '--count-only':
+                count_only = True
+                continue
+            try:
+                val = int(val)
+            except ValueError:
+                raise RuntimeToolError('Invalid value for %s: %s' % (opt, val))
+            if val < 0:
+                raise RuntimeToolError('Invalid value for %s: %d' % (opt, val))
+            if opt == '--limit':
+                limit = val
+            elif opt == '--offset':
+                offset = val
+            elif opt == '--after':
+                after = val
 
         try:
-            for db_ref in DBSpecParser(args[1]):
-                res = db_ref.lookup_all(pattern)
-                if len(res) == 0:
+            for db_ref in DBSpecParser(args[1], readonly=True):
+                if count_only:
+                    print '%s: %d matching items' \
+                        % (db_ref.str_id, db_ref.search_count(pattern))
+                    continue
+
+                count = 0
+                last_id = None
+                for last_id, match in db_ref.search(pattern, limit, offset, after):
+                    if count == 0:
+                        print '[Matching items in %s]' % db_ref.str_id
+                    print '%s' % str(match)
+                    count += 1
+
+                if count == 0:
                     print '%s: nothing found' % db_ref.str_id
-                else:
-                    print '[Matching items in %s]' % db_ref.str_id
-                    for match in res:
-                        print '%s' % str(match)
-                    print "%d matching items in %s" % (len(res), db_ref.str_id)
+                    continue
+                print "%d matching items in %s" % (count, db_ref.str_id)
+                if count == limit:
+                    print '[+] More items may follow, use --after %d for the' \
+                        ' next ones' % last_id
         except DBSpecError, err:
             raise RuntimeToolError('Invalid arguments (%s)' % str(err))
 
@@ -140,8 +413,16 @@ class SearchDB(Tool):
     def help_msg(cls, err=''):
         """Return help message for the search command."""
         return """%s
-Usage: labctl %s <pattern> <db>
-Look for a pattern in the given database(s)""" % (err, cls.str_id)
+Usage: labctl %s [--limit N] [--offset N | --after <id>] [--count-only]
+                    <pattern> <db>
+Look for a pattern in the given database(s)
+
+  --limit       Display at most N items per database
+  --offset      Skip the first N items
+  --after       Only display items which id is greater than the given one, as
+                suggested at the end of a limited search (faster than --offset
+                for large result sets)
+  --count-only  Only display the number of matching items""" % (err, cls.str_id)
 
 class RuntimeToolError(Exception):
     """Base error for unexpected conditions while running tools."""
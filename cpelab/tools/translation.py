@@ -25,10 +25,21 @@
 
 """Processing modules to perform DB translations"""
 
+import csv
+import json
+import time
+import getopt
+import itertools
+import multiprocessing
+
+from cpelab import profiling
 from cpelab.tools.toolbase import Tool, RuntimeToolError
+from cpelab.tools.similarity import best_matches
 
-from cpelab.databases.nmapos import NmapOS
+from cpelab.databases.nmapos import NmapOS, NMAPOS_ALIAS_TABLE
 from cpelab.databases.cpedict import CPEOS
+from cpelab.databases.transcache import TranslationCache
+from cpelab.databases.versions import version_range
 
 
 #class SimpleTranslator:
@@ -53,89 +64,330 @@ from cpelab.databases.cpedict import CPEOS
 #        """
 #        pass
 
-class FuzzyTranslator:
-    """
+class Translator:
+    """Base class for translators, mapping entries from a source database to
+    entries of a destination database. Results are cached persistently (see
+    TranslationCache).
     """
-    str_id = 'fuzzy'
+    str_id = None
 
-    def __init__(self, pattern, db0, db1):
-        """Attempt to map entries from db0 that match pattern to corresponding
-        entries from db1.
+    def __init__(self, db0, db1, use_cache=True):
+        """Initialize a new translator, mapping entries from db0 to
+        corresponding entries from db1.
+        """
+        self.db0 = db0
+        self.db1 = db1
+        # classes of a same fingerprint often translate identically and come
+        # in a row: remember the last result
+        self._last_key = None
+        self._last_res = None
+        self.cache = None
+        if use_cache:
+            self.cache = TranslationCache(self.str_id, db0, db1)
+
+    def run(self, pattern):
+        """Attempt to map entries from db0 that match pattern and display the
+        results.
         """
         print '[+] Attempting to convert entries matching: %s' % pattern
 
-        src_sigs = list(db0.lookup_all(pattern))
+        src_sigs = list(self.db0.lookup_all(pattern))
         if len(src_sigs) == 0:
-            print '[+] No match for "%s" in source db %s' % (pattern, db0.str_id)
+            print '[+] No match for "%s" in source db %s' % (pattern, self.db0.str_id)
             return
 
-        print '[+] %d matches in source db %s' % (len(src_sigs), db0.str_id)
+        print '[+] %d matches in source db %s' % (len(src_sigs), self.db0.str_id)
+        self.prepare(src_sigs)
         for sig in src_sigs:
-            print '-- %s --' % sig.fields['title']
-            candidates = self._candidates(sig, db1)
-            best_res = []
-            best_score = -1
-            for item in candidates:
-                score = self._matching_score(sig, item)
-                if score > best_score:
-                    best_res = [item]
-                    best_score = score
-                elif score == best_score:
-                    best_res.append(item)
-            if len(best_res) > 0:
-                #print 'score: %.02f' % best_score
-                print '\n'.join([x.fields['name'] for x in best_res])
+            print '-- %s --' % sig['title']
+            score, names = self.translate_names(sig)
+            if len(names) > 0:
+                #print 'score: %.02f' % score
+                print '\n'.join(names)
+
+        if self.cache is not None and self.cache.enabled():
+            self.cache.commit()
+            print '[+] %d/%d results served from cache' \
+                % (self.cache.hits, self.cache.hits + self.cache.misses)
+
+    @classmethod
+    def check_requirements(cls):
+        """Raise a RuntimeToolError if the translator cannot run. Translators
+        which need optional modules override it.
+        """
+        pass
+
+    def prepare(self, sigs):
+        """Hook called with a list of entries from db0 before they are
+        translated, so that the work can be shared between them. Does nothing
+        by default.
+        """
+        pass
+
+    def translate_names(self, sig):
+        """Translate a single entry from db0, using cached results if possible.
+        Return a tuple (score, names) with the best matching score and the names
+        of the corresponding entries from db1, or (None, []) if nothing
+        matches.
+        """
+        key = (sig['title'], sig['vendor'], sig['product'], sig['version'])
+        if key == self._last_key:
+            return self._last_res
+
+        res = None
+        if self.cache is not None:
+            with profiling.timer('cache'):
+                res = self.cache.get(sig)
+
+        if res is None:
+            score, items = self.translate(sig)
+            res = score, [x['name'] for x in items]
+            if self.cache is not None:
+                self.cache.put(sig, *res)
+
+        self._last_key = key
+        self._last_res = res
+        return res
+
+    def translate(self, sig):
+        """Translate a single entry from db0. Return a tuple (score, items)
+        with the best matching score and the corresponding entries from db1,
+        or (None, []) if nothing matches.
+        """
+        raise NotImplementedError('Abstract method subclasses must implement')
+
+class FuzzyTranslator(Translator):
+    """Select candidates sharing vendor, product and version with the entry to
+    translate (or looking alike) and keep those with the closest titles.
+    """
+    str_id = 'fuzzy'
+
+    # maximum number of approximate candidates scored per signature
+    max_candidates = 50
+
+    # candidates which title is further away from the signature are discarded
+    # (ie. matching score must be at least -1)
+    max_distance = 3
+
+    # number of class tuples per candidates query
+    prepare_batch = 100
+
+    def __init__(self, db0, db1, use_cache=True):
+        """Initialize a new translator."""
+        Translator.__init__(self, db0, db1, use_cache)
+        # {(vendor, product, version): candidates}
+        self._prepared = {}
+
+    def prepare(self, sigs):
+        """Select the candidates of all the distinct (vendor, product,
+        version) tuples of sigs at once: they are joined with the entries
+        of db1 which have the same vendor and product (or one of their
+        aliases) and either the same version or a version in the range of the
+        tuple one. Candidates prepared for previous entries are dropped.
+        """
+        self._prepared = {}
+        self._add_prepared(sigs)
+
+    def _add_prepared(self, sigs):
+        """Select the candidates of the tuples of sigs which are not prepared
+        yet, see prepare().
+        """
+        tuples = set([(x['vendor'], x['product'], x['version']) for x in sigs])
+        tuples = [x for x in tuples if not self._prepared.has_key(x)]
+        for x in tuples:
+            self._prepared[x] = []
+        for i in xrange(0, len(tuples), self.prepare_batch):
+            self._join_candidates(tuples[i:i + self.prepare_batch])
+
+    def translate(self, sig):
+        """Translate a single entry from db0. Return a tuple (score, items)
+        with the best matching score and the corresponding entries from db1,
+        or (None, []) if nothing matches. Sets of candidates are tried in turn,
+        until one of them holds close enough entries.
+        """
+        for candidates in self._candidates(sig, self.db1):
+            titles = [x['title'] for x in candidates]
+            with profiling.timer('scoring'):
+                distance, best_idx = best_matches(sig['title'], titles,
+                    self.max_distance)
+            profiling.count('candidates scored', len(candidates))
+            if len(best_idx) > 0:
+                return self._matching_score(distance), \
+                    [candidates[i] for i in best_idx]
+        return None, []
 
     def _candidates(self, ref_entry, db):
-        """Return a reduced set, with the best candidates for matching-"""
+        """Iterate over reduced sets of candidates for matching, the most
+        relevant first. Empty sets are skipped.
+        """
         spec = {
-            'vendor': ref_entry.fields['vendor'],
-            'product': ref_entry.fields['product'],
-            'version': ref_entry.fields['version']
+            'vendor': ref_entry['vendor'],
+            'product': ref_entry['product'],
+            'version': ref_entry['version']
         }
-        # look for entries matching vendor, product and version
-        candidates = list(db.lookup(spec))
+        # entries matching vendor, product and version, or which version is
+        # covered by the signature one (eg. 2.6.x), see prepare()
+        key = (spec['vendor'], spec['product'], spec['version'])
+        if not self._prepared.has_key(key):
+            self._add_prepared([ref_entry])
+        candidates = self._prepared[key]
         if len(candidates) > 0:
-            return candidates
-
-        # no match: don't filter on version anymore
+            yield candidates
         del spec['version']
-        candidates = list(db.lookup(spec))
+
+        # no match: take the entries that look the most like the signature
+        if db.has_search_index():
+            text = ' '.join([ref_entry[x] for x in ['title', 'vendor', 'product']])
+            with profiling.timer('candidates'):
+                candidates = db.lookup_similar(text, self.max_candidates)
+            if len(candidates) > 0:
+                yield candidates
+            return
+
+        # no search index: don't filter on version anymore
+        with profiling.timer('candidates'):
+            candidates = list(db.lookup(spec))
         if len(candidates) > 0:
-            return candidates
+            yield candidates
+            return
 
         # no match: don't filter on product anymore
         del spec['product']
-        candidates = list(db.lookup(spec))
+        with profiling.timer('candidates'):
+            candidates = list(db.lookup(spec))
         if len(candidates) > 0:
-            return candidates
+            yield candidates
+
+    @profiling.timed('candidates')
+    def _join_candidates(self, tuples):
+        """Run the candidates query for a list of (vendor, product, version)
+        tuples and store the results into the prepared candidates.
+        """
+        values = []
+        elems = []
+        for idx, (vendor, product, version) in enumerate(tuples):
+            bounds = version_range(version) or (None, None)
+            values.append('(?,?,?,?,?,?)')
+            elems.extend([idx, vendor, product, version, bounds[0], bounds[1]])
+
+        db = self.db1
+        query = """WITH sig(id, vendor, product, version, low, high) AS
+                (VALUES %(values)s),
+            target(id, vendor, product, version, low, high) AS
+                (SELECT id, replace(vendor, ' ', '_'), replace(product, ' ', '_'),
+                    version, low, high FROM sig
+                 UNION
+                 SELECT s.id, a.cpe_vendor, a.cpe_product, s.version, s.low, s.high
+                 FROM sig s JOIN %(alias)s a
+                    ON a.n_vendor = s.vendor AND a.n_product = s.product)
+            SELECT t.id, c.*
+            FROM target t JOIN %(cpe)s c
+                ON c.%(vendor)s = t.vendor AND c.%(product)s = t.product
+            WHERE (c.%(version)s = t.version
+                   OR (c.%(key)s >= t.low AND c.%(key)s < t.high))
+                AND %(live)s""" % {'values': ','.join(values),
+            'alias': NMAPOS_ALIAS_TABLE, 'cpe': db.str_id,
+            'vendor': db.dbfield('vendor'), 'product': db.dbfield('product'),
+            'version': db.dbfield('version'), 'key': db.dbfield('version_key'),
+            'live': db.live_filter('c')}
 
-        return []
+        profiling.count('lookups')
+        for res in db.db_cnx.execute(query, elems):
+            self._prepared[tuples[res[0]]].append(db._make_item(res[1:]))
 
-    def _matching_score(self, ref, candidate):
+    def _matching_score(self, distance):
         """Return an arbitrary score (float) to express how similar are two
-        entries.
+        entries, given the edit distance between their titles.
         """
-        distance = self._levenshtein(ref.fields['title'], candidate.fields['title'])
         return 2. - distance
 
-    def _levenshtein(self, str0, str1):
-        """Calculate and return the Levenshtein distance between two strings."""
-        n, m = len(str0), len(str1)
-        if n > m:
-            str0, str1 = str1, str0
-            n, m = m, n
-
-        curr = range(n+1)
-        for i in range(1, m+1):
-            prev, curr = curr, [i] + [0]*n
-            for j in range(1, n+1):
-                add, delete = prev[j] + 1, curr[j-1] + 1
-                change = prev[j-1]
-                if str0[j-1] != str1[i-1]:
-                    change = change + 1
-                curr[j] = min(add, delete, change)
-        return curr[n]
+class TfidfTranslator(Translator):
+    """Keep the entries which titles are the most similar (TF-IDF weighted
+    cosine of words and character trigrams) to the title of the entry to
+    translate. All the titles of db1 are indexed at once, signatures are then
+    compared to them with vectorized operations.
+
+    Requires numpy and scipy.
+    """
+    str_id = 'tfidf'
+
+    # entries less similar than this are never considered as translations
+    min_similarity = 0.5
+
+    # maximum number of entries returned per signature
+    max_candidates = 50
+
+    def __init__(self, db0, db1, use_cache=True):
+        """Initialize a new translator. The index is built on first use."""
+        self.check_requirements()
+        Translator.__init__(self, db0, db1, use_cache)
+        self._index = None
+        self._items = None
+        # {title: (score, items)}
+        self._prepared = {}
+
+    @classmethod
+    def check_requirements(cls):
+        """Raise a RuntimeToolError if numpy or scipy are missing."""
+        try:
+            import numpy, scipy.sparse
+        except ImportError, err:
+            raise RuntimeToolError('The %s translator requires numpy and scipy (%s)' \
+                % (cls.str_id, str(err)))
+
+    def prepare(self, sigs):
+        """Compare the distinct titles of sigs to all the entries of db1 at
+        once. Results prepared for previous entries are dropped.
+        """
+        self._prepared = {}
+        self._add_prepared(sigs)
+
+    def _add_prepared(self, sigs):
+        """Compare the titles of sigs which are not prepared yet, see
+        prepare().
+        """
+        titles = set([x['title'] for x in sigs])
+        titles = [x for x in titles if not self._prepared.has_key(x)]
+        if len(titles) == 0:
+            return
+        index = self._get_index()
+        with profiling.timer('scoring'):
+            matches = list(index.top_matches(titles, self.max_candidates,
+                self.min_similarity))
+        for title, best in zip(titles, matches):
+            profiling.count('candidates scored', len(index))
+            if len(best) == 0:
+                self._prepared[title] = (None, [])
+                continue
+            # keep the entries as similar as the best one, like the edit
+            # distance based translator does
+            top = best[0][0]
+            items = [self._items[i] for sim, i in best if top - sim < 1e-9]
+            self._prepared[title] = (self._matching_score(top), items)
+
+    def translate(self, sig):
+        """Translate a single entry from db0. Return a tuple (score, items)
+        with the best matching score and the corresponding entries from db1,
+        or (None, []) if nothing matches.
+        """
+        if not self._prepared.has_key(sig['title']):
+            self._add_prepared([sig])
+        return self._prepared[sig['title']]
+
+    def _get_index(self):
+        """Return the index of the titles of db1, built on first call."""
+        if self._index is None:
+            from cpelab.tools.tfidf import TfidfIndex
+            with profiling.timer('indexing'):
+                self._items = list(self.db1.lookup({}))
+                self._index = TfidfIndex([x['title'] for x in self._items])
+        return self._index
+
+    def _matching_score(self, similarity):
+        """Return the score (float) of a cosine similarity, on the same scale
+        as the edit distance based translator (2. for identical titles).
+        """
+        return round(2. * similarity, 2)
 
 class NmapOS2CPE(Tool):
     """This tool attempts to translate nmap os fingerprints into CPE."""
@@ -143,14 +395,46 @@ class NmapOS2CPE(Tool):
 
     _translators = {
         #SimpleTranslator.str_id: SimpleTranslator,
-        FuzzyTranslator.str_id: FuzzyTranslator
+        FuzzyTranslator.str_id: FuzzyTranslator,
+        TfidfTranslator.str_id: TfidfTranslator
     }
     _default_translator = FuzzyTranslator.str_id
 
     def start(self, args):
         """Tool entry point. The only expected argument is a filter (expressed
-        as a pattern) to select some entries from the nmap (source) database.
+        as a pattern) to select some entries from the nmap (source) database,
+        unless the whole database is translated (--all).
         """
+        try:
+            opts, args = getopt.gnu_getopt(args, '', ['all', 'jobs=', 'output=',
+                'no-cache'])
+        except getopt.GetoptError, err:
+            raise RuntimeToolError('Invalid arguments (%s)' % str(err))
+
+        batch = False
+        jobs = multiprocessing.cpu_count()
+        output = None
+        use_cache = True
+        for opt, val in opts:
+            if opt == '--all':
+                batch = True
+            elif opt == '--jobs':
+                try:
+                    jobs = int(val)
+                except ValueError:
+                    raise RuntimeToolError('Invalid number of jobs: %s' % val)
+            elif opt == '--output':
+                output = val
+            elif opt == '--no-cache':
+                use_cache = False
+
+        if batch:
+            if len(args) > 1 or output is None or jobs < 1:
+                raise RuntimeToolError('Invalid arguments')
+            translator_id = self._get_translator_id(args)
+            BatchTranslation(translator_id, jobs, use_cache).run(output)
+            return
+
         if len(args) < 1:
             raise RuntimeToolError('Invalid arguments')
 
@@ -159,24 +443,186 @@ class NmapOS2CPE(Tool):
         nmap_db = NmapOS()
         cpe_db = CPEOS()
 
-        if len(args) == 2:
-            if self._translators.has_key(args[1]):
-                translator = self._translators[args[1]]
-            else:
-                raise RuntimeToolError('Unknown translator: %s' % args[1])
-        else:
-            translator = self._translators[self._default_translator]
+        translator = self._translators[self._get_translator_id(args[1:])]
+        translator(nmap_db, cpe_db, use_cache).run(pattern)
 
-        translator(pattern, nmap_db, cpe_db)
+    def _get_translator_id(self, args):
+        """Return the identifier of the translator selected on the command line
+        (args is the list of the remaining arguments) or of the default one.
+        """
+        translator_id = self._default_translator
+        if len(args) == 1:
+            if not self._translators.has_key(args[0]):
+                raise RuntimeToolError('Unknown translator: %s' % args[0])
+            translator_id = args[0]
+        # fail early rather than in the batch worker processes
+        self._translators[translator_id].check_requirements()
+        return translator_id
 
     @classmethod
     def help_msg(cls, err=''):
         """Return help message for the translate command."""
         return """%s
-Usage: labctl %s <signature title> [translator]
+Usage: labctl %s [--no-cache] <signature title> [translator]
+       labctl %s --all [--jobs N] --output <file.csv|file.jsonl> [translator]
 Attempt to translate nmap signature into CPE.
 
+  --all       Translate the whole nmap database and write the results to the
+              output file (CSV or JSON lines, depending on the extension)
+  --jobs      Number of worker processes (default: number of CPUs)
+  --no-cache  Ignore and don't store cached translation results
+
 Available translators are:
   %s
-""" % (err, cls.str_id, '\n  '.join(cls._translators.keys()))
+""" % (err, cls.str_id, cls.str_id, '\n  '.join(cls._translators.keys()))
+
+class BatchTranslation:
+    """Translate the whole nmap database, splitting the work across a pool of
+    worker processes. Each worker has its own read-only database connections
+    and translates ranges of signatures, results are written by the parent
+    process as they come.
+    """
+
+    # number of signatures per unit of work
+    chunk_size = 200
+
+    def __init__(self, translator_id, jobs, use_cache=True):
+        """Initialize a new batch translation."""
+        self.translator_id = translator_id
+        self.jobs = jobs
+        self.use_cache = use_cache
+
+    def run(self, output):
+        """Translate every signature and write the results into output."""
+        writer = ResultWriter(output)
+
+        nmap_db = NmapOS()
+        first, last = nmap_db.db_cnx.execute('select min(id), max(id) from %s' \
+            % nmap_db.str_id).fetchone()
+        if first is None:
+            raise RuntimeToolError('Empty source database: %s' % nmap_db.str_id)
+
+        chunks = [(x, min(x + self.chunk_size - 1, last)) \
+            for x in xrange(first, last + 1, self.chunk_size)]
+
+        # workers only read the cache, new results are stored from here
+        cache = None
+        if self.use_cache:
+            cache = TranslationCache(self.translator_id, nmap_db, CPEOS())
+
+        print '[+] Translating %s with %d job(s)...' % (nmap_db.str_id, self.jobs)
+        start = time.time()
+        total = 0
+        translated = 0
+        hits = 0
+
+        init_args = (self.translator_id, self.use_cache)
+        if self.jobs == 1:
+            _init_worker(*init_args)
+            results = itertools.imap(_translate_chunk, chunks)
+            pool = None
+        else:
+            pool = multiprocessing.Pool(self.jobs, _init_worker, init_args)
+            results = pool.imap_unordered(_translate_chunk, chunks)
+
+        for chunk, chunk_hits in results:
+            hits += chunk_hits
+            for res in chunk:
+                writer.write(res)
+                if cache is not None:
+                    cache.put(res, res['score'], res['cpe'])
+                total += 1
+                if len(res['cpe']) > 0:
+                    translated += 1
+
+        if pool is not None:
+            pool.close()
+            pool.join()
+        writer.close()
+        if cache is not None:
+            cache.commit()
+
+        elapsed = time.time() - start
+        print '[+] %d signatures translated in %.2fs (%d signatures/sec)' \
+            % (total, elapsed, total / elapsed if elapsed > 0 else 0)
+        if total > 0:
+            print '[+] Coverage: %d/%d (%.1f%%)' \
+                % (translated, total, 100. * translated / total)
+            if cache is not None and cache.enabled():
+                print '[+] %d/%d results served from cache' % (hits, total)
+        print '[+] Results written to %s' % output
+
+# Per-process translator used by batch translation workers
+_WORKER_TRANSLATOR = None
+
+def _init_worker(translator_id, use_cache):
+    """Batch translation worker initialization: open read-only connections to
+    the databases and instantiate the translator.
+    """
+    global _WORKER_TRANSLATOR
+    nmap_db = NmapOS(readonly=True)
+    cpe_db = CPEOS(readonly=True)
+    translator = NmapOS2CPE._translators[translator_id]
+    _WORKER_TRANSLATOR = translator(nmap_db, cpe_db, use_cache)
+
+def _translate_chunk(chunk):
+    """Translate the signatures which ids are in the chunk range. Return a
+    list of results (dicts) and the number of results read from the cache.
+    """
+    results = []
+    first, last = chunk
+    cache = _WORKER_TRANSLATOR.cache
+    hits = 0
+    if cache is not None:
+        hits = cache.hits
+    sigs = list(_WORKER_TRANSLATOR.db0.lookup_ids(first, last))
+    _WORKER_TRANSLATOR.prepare(sigs)
+    for sig in sigs:
+        score, names = _WORKER_TRANSLATOR.translate_names(sig)
+        res = dict(sig.fields)
+        res['score'] = score
+        res['cpe'] = names
+        results.append(res)
+    if cache is not None:
+        hits = cache.hits - hits
+    return results, hits
+
+class ResultWriter:
+    """Streaming writer for batch translation results. The output format (CSV
+    or JSON lines) depends on the file extension.
+    """
+
+    csv_fields = ['title', 'vendor', 'product', 'version', 'devtype', 'score', 'cpe']
+
+    def __init__(self, path):
+        """Open the output file."""
+        if path.endswith('.csv'):
+            self._format = 'csv'
+        elif path.endswith('.jsonl'):
+            self._format = 'jsonl'
+        else:
+            raise RuntimeToolError('Unsupported output format: %s' % path)
+
+        self._fout = open(path, 'wb')
+        if self._format == 'csv':
+            self._csv = csv.writer(self._fout)
+            self._csv.writerow(self.csv_fields)
+
+    def write(self, res):
+        """Write a single result."""
+        if self._format == 'csv':
+            row = []
+            for field in self.csv_fields:
+                val = res[field]
+                if field == 'cpe':
+                    val = ' '.join(val)
+                elif val is None:
+                    val = ''
+                row.append(unicode(val).encode('utf-8'))
+            self._csv.writerow(row)
+        else:
+            self._fout.write(json.dumps(res) + '\n')
 
+    def close(self):
+        """Flush and close the output file."""
+        self._fout.close()
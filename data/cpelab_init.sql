@@ -4,19 +4,68 @@
 
 
 /* --- TABLES CREATION --- */
+/* full-text search indexes are created when populating the tables */
+DROP TABLE IF EXISTS nmapos_fts_vocab;
+DROP TABLE IF EXISTS cpeos_fts_vocab;
+DROP TABLE IF EXISTS nmapos_fts;
+DROP TABLE IF EXISTS cpeos_fts;
 DROP TABLE IF EXISTS nmapos;
+DROP TABLE IF EXISTS nmapos_cpe;
+DROP TABLE IF EXISTS nmapos_class;
+DROP TABLE IF EXISTS nmapos_fp;
+DROP TABLE IF EXISTS nmapos_alias;
 DROP TABLE IF EXISTS cpeos;
+DROP TABLE IF EXISTS dbinfo;
+DROP TABLE IF EXISTS transcache;
+DROP TABLE IF EXISTS dbstats;
 
-CREATE TABLE nmapos (
+/* nmap OS fingerprints, their classes and the CPE hints of each class */
+CREATE TABLE nmapos_fp (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
-  n_title VARCHAR(80) NOT NULL,
+  n_title VARCHAR(80) NOT NULL
+);
+
+CREATE TABLE nmapos_class (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  fp_id INTEGER NOT NULL REFERENCES nmapos_fp (id),
   n_vendor VARCHAR(30) DEFAULT NULL,
   n_product VARCHAR(30) DEFAULT NULL,
   n_version VARCHAR(20) DEFAULT NULL,
-  n_devtype VARCHAR(20) DEFAULT NULL
+  n_devtype VARCHAR(20) DEFAULT NULL,
+  n_version_key VARCHAR(60) DEFAULT NULL
+);
+CREATE INDEX nmapos_class_fp_idx ON nmapos_class (fp_id);
+CREATE INDEX nmapos_vendor_idx ON nmapos_class (n_vendor);
+CREATE INDEX nmapos_produc_idx ON nmapos_class (n_product);
+
+CREATE TABLE nmapos_cpe (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  class_id INTEGER NOT NULL REFERENCES nmapos_class (id),
+  cpe_name VARCHAR(80) NOT NULL
+);
+CREATE INDEX nmapos_cpe_class_idx ON nmapos_cpe (class_id);
+
+/* Other CPE vendors and products of nmap classes (beyond spaces turned into
+ * underscores), entries of both spellings are candidates */
+CREATE TABLE nmapos_alias (
+  n_vendor VARCHAR(30) NOT NULL,
+  n_product VARCHAR(30) NOT NULL,
+  cpe_vendor VARCHAR(30) NOT NULL,
+  cpe_product VARCHAR(30) NOT NULL,
+  PRIMARY KEY (n_vendor, n_product, cpe_vendor, cpe_product)
 );
-CREATE INDEX nmapos_vendor_idx ON nmapos (n_vendor);
-CREATE INDEX nmapos_produc_idx ON nmapos (n_product);
+INSERT INTO nmapos_alias VALUES ('linux', 'linux', 'linux', 'linux_kernel');
+INSERT INTO nmapos_alias VALUES ('sun', 'solaris', 'sun', 'sunos');
+
+/* one row per class, as seen by lookups */
+CREATE VIEW nmapos AS
+  SELECT c.id AS id, f.n_title AS n_title, c.n_vendor AS n_vendor,
+    c.n_product AS n_product, c.n_version AS n_version,
+    c.n_devtype AS n_devtype,
+    coalesce((SELECT group_concat(cpe_name, ' ') FROM nmapos_cpe
+      WHERE class_id = c.id), '') AS n_cpe_hints,
+    c.fp_id AS fp_id, c.n_version_key AS n_version_key
+  FROM nmapos_class c JOIN nmapos_fp f ON f.id = c.fp_id;
 
 CREATE TABLE cpeos (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -30,9 +79,47 @@ CREATE TABLE cpeos (
   cpe_edition VARCHAR(10) DEFAULT NULL,
   cpe_language VARCHAR(10) DEFAULT NULL,
   deprecated BOOLEAN DEFAULT FALSE,
-  last_update DATE DEFAULT (date())
+  last_update DATE DEFAULT (date()),
+  /* sortable version (see cpelab.databases.versions) */
+  cpe_version_key VARCHAR(60) DEFAULT NULL
 );
 CREATE INDEX cpeos_name_idx ON cpeos (cpe_name);
 CREATE INDEX cpeos_vendor_idx ON cpeos (cpe_vendor);
 CREATE INDEX cpeos_product_idx ON cpeos (cpe_product);
+/* CPE name matching (see CPENameMatcher) */
+CREATE INDEX cpeos_components_idx ON cpeos (cpe_part, cpe_vendor, cpe_product,
+  cpe_version, cpe_update, cpe_edition, cpe_language);
+/* version ranges of a product */
+CREATE INDEX cpeos_version_key_idx ON cpeos (cpe_vendor, cpe_product,
+  cpe_version_key);
+
+/* content fingerprint of each database, set on update */
+CREATE TABLE dbinfo (
+  db_name VARCHAR(20) PRIMARY KEY,
+  fingerprint CHAR(40) DEFAULT NULL,
+  /* SHA-256 digest of the downloaded source of the last update */
+  source_digest CHAR(64) DEFAULT NULL,
+  last_update DATE DEFAULT (date())
+);
+
+/* statistics of each database, maintained on update */
+CREATE TABLE dbstats (
+  db_name VARCHAR(20) NOT NULL,
+  stat VARCHAR(20) NOT NULL,
+  stat_key VARCHAR(80) NOT NULL,
+  value INTEGER NOT NULL,
+  PRIMARY KEY (db_name, stat, stat_key)
+);
 
+/* translation results, valid for a given translator and databases content */
+CREATE TABLE transcache (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  fingerprint CHAR(40) NOT NULL,
+  n_title VARCHAR(80) NOT NULL,
+  n_vendor VARCHAR(30) DEFAULT NULL,
+  n_product VARCHAR(30) DEFAULT NULL,
+  n_version VARCHAR(20) DEFAULT NULL,
+  score REAL DEFAULT NULL,
+  cpe_names TEXT NOT NULL,
+  UNIQUE (fingerprint, n_title, n_vendor, n_product, n_version)
+);
@@ -0,0 +1,128 @@
+#!/usr/bin/python
+#
+# Author:
+# Henri Doreau <henri.doreau@greenbone.net>
+#
+# Copyright:
+# Copyright (C) 2011 Greenbone Networks GmbH, http://www.greenbone.net
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2
+# (or any later version), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301 USA.
+##
+
+
+
+"""cpelab unit tests. Run them from the top-level directory, eg:
+  $ python -m unittest discover -s tests -t .
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import StringIO
+from xml.sax.saxutils import quoteattr, escape
+
+from cpelab.databases import db
+
+
+# Top-level directory of the source tree
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def write_cpe_dictionary(path, names, deprecated=(), titles=None):
+    """Write a CPE dictionary holding the given names to path. Titles are
+    derived from the names, unless given in the titles dict.
+    """
+    fout = open(path, 'w')
+    fout.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    fout.write('<cpe-list xmlns="http://cpe.mitre.org/dictionary/2.0">\n')
+    for name in names:
+        attrs = 'name=%s' % quoteattr(name)
+        if name in deprecated:
+            attrs += ' deprecated="true"'
+        fout.write('  <cpe-item %s>\n' % attrs)
+        title = (titles or {}).get(name)
+        if title is None:
+            title = ' '.join(name[7:].replace('_', ' ').split(':')).title()
+        fout.write('    <title xml:lang="en-US">%s</title>\n' % escape(title))
+        fout.write('  </cpe-item>\n')
+    fout.write('</cpe-list>\n')
+    fout.close()
+
+def write_nmap_os_db(path, count):
+    """Write a nmap-os-db of count fingerprints to path."""
+    fout = open(path, 'w')
+    for idx in xrange(count):
+        fout.write('Fingerprint Linux 2.6.%d\n' % idx)
+        fout.write('Class Linux | Linux | 2.6.X | general purpose\n')
+        fout.write('CPE cpe:/o:linux:linux_kernel:2.6.%d\n' % idx)
+        fout.write('SEQ(SP=C5-CF%GCD=1-6%ISR=C8-D2%TI=Z%II=I%TS=8)\n\n')
+    fout.close()
+
+class ReaderSource:
+    """Wrap the read_source() method of a database for the reader processes
+    of ConcurrentUpdate: the connection they inherited is replaced with
+    ConnectionGuard, and exit_code, if set, makes them exit right away.
+    """
+    def __init__(self, db, exit_code=None):
+        self.db = db
+        self.read_source = db.read_source
+        self.pid = os.getpid()
+        self.exit_code = exit_code
+
+    def __call__(self, *args, **kwargs):
+        if os.getpid() != self.pid:
+            self.db.db_cnx = ConnectionGuard()
+            if self.exit_code is not None:
+                os._exit(self.exit_code)
+        return self.read_source(*args, **kwargs)
+
+class ConnectionGuard:
+    """Connection of a process which must not use the database."""
+    def __getattr__(self, name):
+        raise AssertionError('Database connection used by a reader process')
+
+class DatabaseTestCase(unittest.TestCase):
+    """Base class of the tests working on a database. Each test runs in a
+    scratch directory holding an empty database, with the standard output
+    silenced.
+    """
+    def setUp(self):
+        """Create and initialize the database."""
+        self._cwd = os.getcwd()
+        self._stdout = sys.stdout
+        self.workdir = tempfile.mkdtemp(prefix='cpelab-test-')
+        os.mkdir(os.path.join(self.workdir, db.DATADIR))
+        shutil.copy(os.path.join(TOP_DIR, db.DATADIR, db.SQLITE_INIT_SCRIPT),
+            os.path.join(self.workdir, db.DATADIR))
+        os.chdir(self.workdir)
+        sys.stdout = StringIO.StringIO()
+        db.Database().initialize()
+
+    def tearDown(self):
+        """Close the connections to the database and remove it."""
+        sys.stdout = self._stdout
+        os.chdir(self._cwd)
+        pool = getattr(db._CONNECTIONS, 'pool', {})
+        for key in pool.keys():
+            if key[0].startswith(self.workdir):
+                pool.pop(key).close()
+        shutil.rmtree(self.workdir)
+
+    def path(self, name):
+        """Return the path of a file of the scratch directory."""
+        return os.path.join(self.workdir, name)
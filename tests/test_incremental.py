@@ -0,0 +1,114 @@
+#!/usr/bin/python
+#
+# Author:
+# Henri Doreau <henri.doreau@greenbone.net>
+#
+# Copyright:
+# Copyright (C) 2011 Greenbone Networks GmbH, http://www.greenbone.net
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2
+# (or any later version), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301 USA.
+##
+
+
+
+"""Tests for the incremental updates of the CPE dictionary."""
+
+
+import unittest
+
+from tests import DatabaseTestCase, write_cpe_dictionary
+
+from cpelab.databases.cpedict import CPEOS
+
+
+NAMES = ['cpe:/o:linux:linux_kernel:2.6.%d' % x for x in xrange(20)] \
+    + ['cpe:/o:microsoft:windows_xp', 'cpe:/o:microsoft:windows_vista']
+
+class Counted:
+    """Wrap a method and count its calls."""
+    def __init__(self, method):
+        self.method = method
+        self.calls = 0
+
+    def __call__(self, *args, **kwargs):
+        self.calls += 1
+        return self.method(*args, **kwargs)
+
+class IncrementalUpdateTest(DatabaseTestCase):
+    """CPEOS.populate(incremental=True)"""
+
+    def setUp(self):
+        DatabaseTestCase.setUp(self)
+        self.db = CPEOS()
+        write_cpe_dictionary(self.path('dict.xml'), NAMES)
+        self.db.populate(self.path('dict.xml'))
+
+    def update(self, names, deprecated=(), titles=None):
+        """Apply an incremental update from a dictionary of the given names,
+        return the number of index rebuilds and statistics computations.
+        """
+        write_cpe_dictionary(self.path('dict.xml'), names, deprecated, titles)
+        self.db.build_search_index = Counted(self.db.build_search_index)
+        self.db.store_stats = Counted(self.db.store_stats)
+        try:
+            self.db.populate(self.path('dict.xml'), incremental=True)
+            return self.db.build_search_index.calls, self.db.store_stats.calls
+        finally:
+            del self.db.build_search_index
+            del self.db.store_stats
+
+    def check_consistency(self):
+        """Check that the search index and the statistics match the table."""
+        fts = self.db._fts_table()
+        self.db.db_cnx.execute("insert into %s(%s, rank) values"
+            " ('integrity-check', 1)" % (fts, fts))
+        stored = self.db.db_cnx.execute('select stat, stat_key, value from'
+            ' dbstats where db_name = ?', (self.db.str_id,)).fetchall()
+        self.assertEqual(sorted(stored), sorted(self.db._compute_stats()))
+
+    def test_unchanged(self):
+        fingerprint = self.db.fingerprint()
+        self.assertEqual(self.update(NAMES), (0, 0))
+        self.assertEqual(self.db.fingerprint(), fingerprint)
+        self.check_consistency()
+
+    def test_changes(self):
+        names = NAMES + ['cpe:/o:sun:solaris:10']
+        titles = {'cpe:/o:microsoft:windows_xp': 'Microsoft Windows XP Home'}
+        self.assertEqual(self.update(names, ['cpe:/o:linux:linux_kernel:2.6.0'],
+            titles), (0, 1))
+        self.check_consistency()
+        self.assertEqual(self.db.stats()['total'], len(NAMES))
+        self.assertEqual(self.db.search_count('%solaris%'), 1)
+        self.assertEqual([x['name'] for x in self.db.lookup_all('%xp home%')],
+            ['cpe:/o:microsoft:windows_xp'])
+        self.assertEqual(self.db.search_count('%kernel 2.6.0'), 0)
+
+        # title changes leave the statistics alone
+        self.assertEqual(self.update(names, ['cpe:/o:linux:linux_kernel:2.6.0']),
+            (0, 0))
+        self.assertEqual(self.db.search_count('%xp home%'), 0)
+        self.check_consistency()
+
+        # deprecated items may come back
+        self.update(names)
+        self.assertEqual(self.db.search_count('%kernel 2.6.0'), 1)
+        self.assertEqual(self.db.stats()['total'], len(names))
+        self.check_consistency()
+
+
+if __name__ == '__main__':
+    unittest.main()
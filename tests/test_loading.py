@@ -0,0 +1,175 @@
+#!/usr/bin/python
+#
+# Author:
+# Henri Doreau <henri.doreau@greenbone.net>
+#
+# Copyright:
+# Copyright (C) 2011 Greenbone Networks GmbH, http://www.greenbone.net
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2
+# (or any later version), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301 USA.
+##
+
+
+
+"""Tests for the loading of the databases: failed loads must leave the
+previous content in place.
+"""
+
+
+import unittest
+
+from tests import DatabaseTestCase, ReaderSource, write_cpe_dictionary
+from tests import write_nmap_os_db
+
+from cpelab.databases import nmapos, cpedict
+from cpelab.databases.db import DBError, BulkLoader
+from cpelab.tools.toolbase import ConcurrentUpdate
+
+
+class FailingSource:
+    """Wrap the read_source() method of a database so that reading fails with
+    IOError after a number of batches.
+    """
+    def __init__(self, db, batches):
+        self.read_source = db.read_source
+        self.batches = batches
+
+    def __call__(self, *args, **kwargs):
+        for idx, rows in enumerate(self.read_source(*args, **kwargs)):
+            if idx == self.batches:
+                raise IOError('Connection reset by peer')
+            yield rows
+
+class LoadTest(DatabaseTestCase):
+    """Database.populate() and BulkLoader"""
+
+    def setUp(self):
+        DatabaseTestCase.setUp(self)
+        self._batch_sizes = (nmapos.BULK_BATCH_SIZE, cpedict.BULK_BATCH_SIZE)
+        nmapos.BULK_BATCH_SIZE = cpedict.BULK_BATCH_SIZE = 10
+        # upstream sources of the concurrent updates
+        self._locations = (nmapos.NMAP_OS_DICT_LOCATION, cpedict.CPE_DICT_LOCATION)
+        nmapos.NMAP_OS_DICT_LOCATION = self.path('nmap-os-db')
+        cpedict.CPE_DICT_LOCATION = self.path('dict.xml')
+
+        write_nmap_os_db(self.path('nmap-os-db'), 100)
+        self.nmapos = nmapos.NmapOS()
+        self.nmapos.populate(self.path('nmap-os-db'))
+        self.cpeos = cpedict.CPEOS()
+        write_cpe_dictionary(self.path('dict.xml'),
+            ['cpe:/o:linux:linux_kernel:2.6.%d' % x for x in xrange(100)])
+        self.cpeos.populate(self.path('dict.xml'))
+        self.initial = self.content()
+
+    def tearDown(self):
+        nmapos.BULK_BATCH_SIZE, cpedict.BULK_BATCH_SIZE = self._batch_sizes
+        nmapos.NMAP_OS_DICT_LOCATION, cpedict.CPE_DICT_LOCATION = self._locations
+        DatabaseTestCase.tearDown(self)
+
+    def content(self):
+        """Return the row counts of the tables, their indexes and the
+        bookkeeping information.
+        """
+        cnx = self.nmapos.db_cnx
+        res = {}
+        for table in ['nmapos_fp', 'nmapos_class', 'nmapos_cpe', 'cpeos', 'dbstats']:
+            res[table] = cnx.execute('select count(*) from %s' % table).fetchone()[0]
+        res['indexes'] = cnx.execute("select name from sqlite_master where"
+            " type = 'index' order by name").fetchall()
+        res['dbinfo'] = cnx.execute('select * from dbinfo order by db_name').fetchall()
+        return res
+
+    def test_initial_content(self):
+        self.assertEqual(self.initial['nmapos_fp'], 100)
+        self.assertEqual(self.initial['cpeos'], 100)
+        self.assertTrue(len(self.initial['indexes']) > 0)
+
+    def test_failed_load(self):
+        write_nmap_os_db(self.path('nmap-os-db'), 50)
+        self.nmapos.read_source = FailingSource(self.nmapos, 2)
+        self.assertRaises(IOError, self.nmapos.populate, self.path('nmap-os-db'))
+        self.assertEqual(self.content(), self.initial)
+
+        # the connection is usable again
+        del self.nmapos.read_source
+        self.nmapos.populate(self.path('nmap-os-db'))
+        self.assertEqual(self.nmapos.count(), 50)
+        self.assertEqual(self.content()['indexes'], self.initial['indexes'])
+
+    def test_truncated_source(self):
+        data = open(self.path('dict.xml')).read()
+        open(self.path('dict.xml'), 'w').write(data[:len(data) / 2])
+        self.assertRaises(Exception, self.cpeos.populate, self.path('dict.xml'))
+        self.assertEqual(self.content(), self.initial)
+
+    def test_empty_source(self):
+        open(self.path('nmap-os-db'), 'w').close()
+        self.assertRaises(DBError, self.nmapos.populate, self.path('nmap-os-db'))
+        self.assertEqual(self.content(), self.initial)
+
+    def test_loader_abort(self):
+        # the table is emptied and its indexes dropped when the loader starts
+        loader = BulkLoader(self.cpeos, ['db_name'], table='dbstats')
+        loader.start()
+        self.assertEqual(self.content()['dbstats'], 0)
+        loader.abort()
+        self.assertEqual(self.content(), self.initial)
+
+    def concurrent_update(self, nmapos_exit_code=None):
+        """Update both databases with ConcurrentUpdate."""
+        self.nmapos.read_source = ReaderSource(self.nmapos, nmapos_exit_code)
+        self.cpeos.read_source = ReaderSource(self.cpeos)
+        update = ConcurrentUpdate([self.nmapos, self.cpeos])
+        update.poll_interval = 0.1
+        update.run()
+
+    def test_concurrent_update(self):
+        write_nmap_os_db(self.path('nmap-os-db'), 50)
+        write_cpe_dictionary(self.path('dict.xml'),
+            ['cpe:/o:linux:linux_kernel:3.%d' % x for x in xrange(60)])
+        self.concurrent_update()
+        self.assertEqual(self.nmapos.count(), 50)
+        self.assertEqual(self.cpeos.count(), 60)
+        self.assertEqual(self.content()['indexes'], self.initial['indexes'])
+
+    def test_concurrent_empty_source(self):
+        open(self.path('nmap-os-db'), 'w').write('# no fingerprints\n')
+        self.assertRaises(DBError, self.concurrent_update)
+        self.assertEqual(self.content(), self.initial)
+
+    def test_concurrent_dead_reader(self):
+        try:
+            self.concurrent_update(nmapos_exit_code=3)
+        except DBError, err:
+            self.assertTrue('exited with code 3' in str(err))
+        else:
+            self.fail('DBError not raised')
+        self.assertEqual(self.content(), self.initial)
+
+    def test_multi_loader_summary(self):
+        loader = self.nmapos.begin_load()
+        for rows in self.nmapos.read_source(self.path('nmap-os-db')):
+            loader.extend(rows)
+        loader.finish()
+        self.assertEqual(loader.count, 300)
+        self.assertTrue(loader.elapsed > 0)
+        self.assertTrue(str(loader).startswith('nmapos: 300 rows stored in '))
+        self.assertTrue(' rows/sec: 100 nmapos_fp, 100 nmapos_class,'
+            ' 100 nmapos_cpe)' in str(loader))
+
+
+if __name__ == '__main__':
+    unittest.main()
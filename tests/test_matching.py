@@ -0,0 +1,126 @@
+#!/usr/bin/python
+#
+# Author:
+# Henri Doreau <henri.doreau@greenbone.net>
+#
+# Copyright:
+# Copyright (C) 2011 Greenbone Networks GmbH, http://www.greenbone.net
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2
+# (or any later version), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301 USA.
+##
+
+
+
+"""Tests for CPE name matching (cpelab.databases.cpedict.CPENameMatcher)."""
+
+
+import unittest
+
+from tests import DatabaseTestCase, write_cpe_dictionary
+
+from cpelab.databases.db import DBError
+from cpelab.databases.cpedict import CPEOS, CPENameMatcher
+from cpelab.tools.toolbase import RuntimeToolError
+from cpelab.tools.matching import CPEMatch
+
+
+NAMES = [
+    'cpe:/o:microsoft:windows_xp::sp2',
+    'cpe:/o:microsoft:windows_xp::sp3',
+    'cpe:/o:microsoft:windows_2000',
+    'cpe:/o:microsoft:windows_2000::sp4',
+    'cpe:/o:microsoft:windows_vista',
+    'cpe:/o:linux:linux_kernel',
+    'cpe:/o:linux:linux_kernel:2.6.32',
+    'cpe:/o:linux:linux_kernel:2.6.38',
+    'cpe:/h:cisco:router_1700',
+    'cpe:/a:apache:http_server:2.2',
+]
+
+class CPENameMatcherTest(DatabaseTestCase):
+    """CPENameMatcher.match()"""
+
+    def setUp(self):
+        DatabaseTestCase.setUp(self)
+        write_cpe_dictionary(self.path('dict.xml'), NAMES,
+            deprecated=['cpe:/o:microsoft:windows_vista'])
+        self.db = CPEOS()
+        self.db.populate(self.path('dict.xml'))
+        self.matcher = CPENameMatcher(self.db)
+
+    def match(self, name, mode='superset', limit=None):
+        return [x['name'] for x in self.matcher.match(name, mode, limit)]
+
+    def test_equal(self):
+        self.assertEqual(self.match('cpe:/o:microsoft:windows_2000', 'equal'),
+            ['cpe:/o:microsoft:windows_2000'])
+        self.assertEqual(self.match('cpe:/o:microsoft', 'equal'), [])
+
+    def test_superset(self):
+        self.assertEqual(self.match('cpe:/o:microsoft:windows_2000'),
+            ['cpe:/o:microsoft:windows_2000', 'cpe:/o:microsoft:windows_2000::sp4'])
+        self.assertEqual(self.match('cpe:/o:linux'), ['cpe:/o:linux:linux_kernel',
+            'cpe:/o:linux:linux_kernel:2.6.32', 'cpe:/o:linux:linux_kernel:2.6.38'])
+
+    def test_subset(self):
+        self.assertEqual(self.match('cpe:/o:linux:linux_kernel:2.6.32', 'subset'),
+            ['cpe:/o:linux:linux_kernel', 'cpe:/o:linux:linux_kernel:2.6.32'])
+
+    def test_missing_components(self):
+        # any value in superset mode only, '*' is any value in every mode
+        self.assertEqual(len(self.match('cpe:/o:microsoft:windows_xp')), 2)
+        self.assertEqual(self.match('cpe:/o:microsoft:windows_xp', 'subset'), [])
+        self.assertEqual(self.match('cpe:/o:microsoft:windows_xp', 'equal'), [])
+        self.assertEqual(self.match('cpe:/o:microsoft:windows_2000', 'subset'),
+            ['cpe:/o:microsoft:windows_2000'])
+        for mode in CPENameMatcher.modes:
+            self.assertEqual(len(self.match('cpe:/o:microsoft:windows_xp:*:*:*:*',
+                mode)), 2)
+
+    def test_wildcards(self):
+        self.assertEqual(self.match('cpe:/o:microsoft:windows_*:*:sp?'),
+            ['cpe:/o:microsoft:windows_2000::sp4', 'cpe:/o:microsoft:windows_xp::sp2',
+             'cpe:/o:microsoft:windows_xp::sp3'])
+        self.assertEqual(self.match('cpe:/o:linux:linux_kernel:2.6.3?'),
+            ['cpe:/o:linux:linux_kernel:2.6.32', 'cpe:/o:linux:linux_kernel:2.6.38'])
+        # leading wildcard
+        self.assertEqual(self.match('cpe:/?:*:*_1700'), ['cpe:/h:cisco:router_1700'])
+        # wildcards in the query match the dictionary, not the opposite
+        self.assertEqual(self.match('cpe:/o:linux:linux_kernel:2.6.3[2]'), [])
+
+    def test_subset_wildcards(self):
+        self.assertEqual(self.match('cpe:/o:microsoft:windows_xp:*:sp*', 'subset'),
+            ['cpe:/o:microsoft:windows_xp::sp2', 'cpe:/o:microsoft:windows_xp::sp3'])
+
+    def test_filtered_items(self):
+        # deprecated items and applications are not loaded
+        self.assertEqual(self.match('cpe:/o:microsoft:windows_vista'), [])
+        self.assertEqual(self.match('cpe:/a:apache'), [])
+
+    def test_limit(self):
+        self.assertEqual(len(self.match('cpe:/o:microsoft', limit=2)), 2)
+        for limit in ['0', '-1', 'x']:
+            self.assertRaises(RuntimeToolError, CPEMatch().start,
+                ['--limit', limit, 'cpe:/o:microsoft'])
+
+    def test_invalid_queries(self):
+        self.assertRaises(DBError, self.match, 'cpe:/o:linux', 'fuzzy')
+        self.assertRaises(DBError, self.match, 'linux')
+        self.assertRaises(DBError, self.match, 'cpe:/o:a:b:c:d:e:f:g')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/python
+#
+# Author:
+# Henri Doreau <henri.doreau@greenbone.net>
+#
+# Copyright:
+# Copyright (C) 2011 Greenbone Networks GmbH, http://www.greenbone.net
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2
+# (or any later version), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301 USA.
+##
+
+
+
+"""Tests for the edit distance engine of cpelab.tools.similarity."""
+
+
+import random
+import unittest
+
+from cpelab.tools.similarity import levenshtein, best_matches
+
+
+def reference_distance(str0, str1):
+    """Textbook dynamic programming Levenshtein distance."""
+    curr = range(len(str0) + 1)
+    for i in xrange(1, len(str1) + 1):
+        prev, curr = curr, [i] + [0] * len(str0)
+        for j in xrange(1, len(str0) + 1):
+            change = prev[j - 1] + (str0[j - 1] != str1[i - 1])
+            curr[j] = min(prev[j] + 1, curr[j - 1] + 1, change)
+    return curr[len(str0)]
+
+class LevenshteinTest(unittest.TestCase):
+    """levenshtein()"""
+
+    def test_known_distances(self):
+        self.assertEqual(levenshtein('kitten', 'sitting'), 3)
+        self.assertEqual(levenshtein('linux 2.6.32', 'linux 2.6.38'), 1)
+        self.assertEqual(levenshtein('', 'abc'), 3)
+        self.assertEqual(levenshtein('abc', ''), 3)
+        self.assertEqual(levenshtein('', ''), 0)
+        self.assertEqual(levenshtein('same', 'same'), 0)
+
+    def test_matches_reference(self):
+        rnd = random.Random(42)
+        for _ in xrange(500):
+            str0 = ''.join([rnd.choice('ab. 12') for _ in xrange(rnd.randint(0, 80))])
+            str1 = ''.join([rnd.choice('ab. 12') for _ in xrange(rnd.randint(0, 80))])
+            self.assertEqual(levenshtein(str0, str1), reference_distance(str0, str1))
+
+    def test_max_distance(self):
+        self.assertEqual(levenshtein('kitten', 'sitting', 3), 3)
+        self.assertEqual(levenshtein('kitten', 'sitting', 2), None)
+        # length difference alone exceeds the bound
+        self.assertEqual(levenshtein('a', 'abcdef', 2), None)
+
+    def test_long_strings(self):
+        # patterns longer than a machine word
+        str0 = 'microsoft windows server 2008 r2 enterprise edition sp1 ' * 3
+        str1 = str0.replace('2008', '2012')
+        self.assertEqual(levenshtein(str0, str1), 6)
+
+class BestMatchesTest(unittest.TestCase):
+    """best_matches()"""
+
+    def test_ties(self):
+        dist, idx = best_matches('linux 2.6', ['linux 2.4', 'linux 3.6', 'bsd'])
+        self.assertEqual(dist, 1)
+        self.assertEqual(idx, [0, 1])
+
+    def test_best_first_found_later(self):
+        dist, idx = best_matches('abcd', ['wxyz', 'abxx', 'abcd'], 3)
+        self.assertEqual((dist, idx), (0, [2]))
+
+    def test_nothing_within_bound(self):
+        self.assertEqual(best_matches('abcd', ['wxyz', 'abcdefgh'], 3), (None, []))
+
+    def test_bound_is_inclusive(self):
+        self.assertEqual(best_matches('abc', ['abcxyz'], 3), (3, [0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+#!/usr/bin/python
+#
+# Author:
+# Henri Doreau <henri.doreau@greenbone.net>
+#
+# Copyright:
+# Copyright (C) 2011 Greenbone Networks GmbH, http://www.greenbone.net
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2
+# (or any later version), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301 USA.
+##
+
+
+
+"""Tests for the CPE dictionary snapshots (cpelab.databases.snapshot)."""
+
+
+import os
+import unittest
+
+from tests import DatabaseTestCase, write_cpe_dictionary
+
+from cpelab.databases.db import DBError
+from cpelab.databases.cpedict import CPEOS
+from cpelab.databases import snapshot
+from cpelab.databases.snapshot import write_snapshot, Snapshot
+
+
+NAMES = [
+    'cpe:/o:microsoft:windows_xp::sp2',
+    'cpe:/o:microsoft:windows_xp::sp3',
+    'cpe:/o:microsoft:windows_2000',
+    'cpe:/o:microsoft:windows_2000::sp4',
+    'cpe:/o:microsoft:windows_vista',
+    'cpe:/o:linux:linux_kernel:2.6.32',
+    'cpe:/o:linux:linux_kernel:2.6.38',
+    'cpe:/h:cisco:router_1700',
+    u'cpe:/o:caf\xe9:caf\xe9_os:1.0',
+]
+
+class SnapshotTest(DatabaseTestCase):
+    """write_snapshot() and Snapshot"""
+
+    def setUp(self):
+        DatabaseTestCase.setUp(self)
+        write_cpe_dictionary(self.path('dict.xml'),
+            [x.encode('utf-8') for x in NAMES],
+            deprecated=['cpe:/o:microsoft:windows_vista'])
+        self.db = CPEOS()
+        self.db.populate(self.path('dict.xml'))
+        self.count = write_snapshot(self.db, self.path('cpeos.snapshot'))
+        self.snapshot = Snapshot(self.path('cpeos.snapshot'))
+
+    def tearDown(self):
+        self.snapshot.close()
+        DatabaseTestCase.tearDown(self)
+
+    def names(self, items):
+        return [x['name'] for x in items]
+
+    def test_round_trip(self):
+        self.assertEqual(self.count, len(NAMES) - 1)
+        self.assertEqual(len(self.snapshot), self.count)
+        expected = sorted([x.fields for x in self.db.lookup({})],
+            key=lambda x: (x['vendor'], x['product'], x['name']))
+        self.assertEqual([x.fields for x in self.snapshot], expected)
+        self.assertEqual(self.snapshot.fingerprint, self.db.fingerprint())
+
+    def test_lookup_name(self):
+        for name in NAMES:
+            if name == 'cpe:/o:microsoft:windows_vista':
+                continue
+            item = self.snapshot.lookup_name(name)
+            self.assertEqual(item['name'], name)
+            self.assertEqual(item.fields, self.db.lookup({'name': name}).next().fields)
+        self.assertEqual(self.snapshot.lookup_name('cpe:/o:microsoft:windows_vista'), None)
+        self.assertEqual(self.snapshot.lookup_name('cpe:/o:microsoft:windows'), None)
+        self.assertEqual(self.snapshot.lookup_name('cpe:/z'), None)
+
+    def test_lookup(self):
+        self.assertEqual(self.names(self.snapshot.lookup('microsoft')), [
+            'cpe:/o:microsoft:windows_2000', 'cpe:/o:microsoft:windows_2000::sp4',
+            'cpe:/o:microsoft:windows_xp::sp2', 'cpe:/o:microsoft:windows_xp::sp3'])
+        self.assertEqual(self.names(self.snapshot.lookup('microsoft', 'windows_xp')),
+            ['cpe:/o:microsoft:windows_xp::sp2', 'cpe:/o:microsoft:windows_xp::sp3'])
+        self.assertEqual(self.names(self.snapshot.lookup(u'caf\xe9')),
+            [u'cpe:/o:caf\xe9:caf\xe9_os:1.0'])
+        self.assertEqual(self.snapshot.lookup('microsoft', 'windows'), [])
+        self.assertEqual(self.snapshot.lookup('zzz'), [])
+
+    def test_invalid_file(self):
+        open(self.path('junk'), 'w').write('x' * 100)
+        self.assertRaises(DBError, Snapshot, self.path('junk'))
+        self.assertRaises(DBError, Snapshot, self.path('missing'))
+
+    def test_failed_write(self):
+        def rename(src, dst):
+            raise OSError('Simulated failure')
+        real_rename, snapshot.os.rename = snapshot.os.rename, rename
+        try:
+            self.assertRaises(OSError, write_snapshot, self.db, self.path('other'))
+        finally:
+            snapshot.os.rename = real_rename
+        self.assertFalse(os.path.exists(self.path('other.tmp')))
+        self.assertFalse(os.path.exists(self.path('other')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,186 @@
+#!/usr/bin/python
+#
+# Author:
+# Henri Doreau <henri.doreau@greenbone.net>
+#
+# Copyright:
+# Copyright (C) 2011 Greenbone Networks GmbH, http://www.greenbone.net
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2
+# (or any later version), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301 USA.
+##
+
+
+
+"""Tests for the cache of remote sources (cpelab.databases.source.download)
+against a local HTTP server.
+"""
+
+
+import os
+import json
+import hashlib
+import unittest
+import threading
+import BaseHTTPServer
+
+from tests import DatabaseTestCase, ReaderSource, write_nmap_os_db
+
+from cpelab.databases import nmapos
+from cpelab.databases.db import DBError
+from cpelab.databases.source import download, open_source
+from cpelab.tools.toolbase import ConcurrentUpdate
+
+
+class SourceHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serve the content of the server, with an ETag, honouring conditional
+    and range requests. If the cut attribute of the server is set, responses
+    are interrupted after that many bytes of body.
+    """
+    def do_GET(self):
+        server = self.server
+        etag = '"%s"' % hashlib.md5(server.content).hexdigest()
+        server.requests.append(dict(self.headers))
+
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        start = 0
+        ranges = self.headers.get('Range')
+        if ranges is not None and self.headers.get('If-Range') in (None, etag):
+            start = int(ranges[len('bytes='):-1])
+        body = server.content[start:]
+
+        self.send_response(206 if start > 0 else 200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        if start > 0:
+            self.send_header('Content-Range', 'bytes %d-%d/%d' \
+                % (start, len(server.content) - 1, len(server.content)))
+        self.end_headers()
+        if server.cut is not None:
+            body = body[:server.cut]
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class DownloadTest(DatabaseTestCase):
+    """download()"""
+
+    def setUp(self):
+        DatabaseTestCase.setUp(self)
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), SourceHandler)
+        self.server.content = ''.join(['line %d\n' % x for x in xrange(100000)])
+        self.server.cut = None
+        self.server.requests = []
+        thread = threading.Thread(target=self.server.serve_forever, args=(0.05,))
+        thread.daemon = True
+        thread.start()
+        self.url = 'http://127.0.0.1:%d/feeds/nmap-os-db' % self.server.server_port
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        DatabaseTestCase.tearDown(self)
+
+    def test_concurrent_update(self):
+        write_nmap_os_db(self.path('nmap-os-db'), 10)
+        self.server.content = open(self.path('nmap-os-db')).read()
+        location = nmapos.NMAP_OS_DICT_LOCATION
+        nmapos.NMAP_OS_DICT_LOCATION = self.url
+        try:
+            db = nmapos.NmapOS()
+            db.read_source = ReaderSource(db)
+            ConcurrentUpdate([db]).run()
+            self.assertEqual(db.count(), 10)
+            digest = db.loaded_digest()
+            self.assertTrue(digest is not None)
+
+            # readers compare the source with the one loaded without using
+            # the database
+            db.db_cnx.execute('delete from nmapos_fp')
+            db.commit()
+            ConcurrentUpdate([db]).run()
+            self.assertEqual(db.count(), 0)
+            self.assertEqual(db.loaded_digest(), digest)
+        finally:
+            nmapos.NMAP_OS_DICT_LOCATION = location
+
+    def check_copy(self, path, digest):
+        """Check the local copy and its digest against the served content."""
+        self.assertEqual(open(path, 'rb').read(), self.server.content)
+        self.assertEqual(digest, hashlib.sha256(self.server.content).hexdigest())
+
+    def test_download(self):
+        path, digest = download(self.url)
+        self.check_copy(path, digest)
+        self.assertEqual(open_source(self.url).digest, digest)
+
+    def test_not_modified(self):
+        path, digest = download(self.url)
+        mtime = os.path.getmtime(path)
+        self.assertEqual(download(self.url), (path, digest))
+        self.assertEqual(self.server.requests[-1]['if-none-match'],
+            '"%s"' % hashlib.md5(self.server.content).hexdigest())
+        self.assertEqual(os.path.getmtime(path), mtime)
+
+    def test_modified(self):
+        path, digest = download(self.url)
+        self.server.content += 'new line\n'
+        path, new_digest = download(self.url)
+        self.assertNotEqual(new_digest, digest)
+        self.check_copy(path, new_digest)
+
+    def test_resume(self):
+        self.server.cut = 1000
+        self.assertRaises(DBError, download, self.url)
+        self.server.cut = None
+        path, digest = download(self.url)
+        self.assertEqual(self.server.requests[-1]['range'], 'bytes=1000-')
+        self.assertTrue(self.server.requests[-1].has_key('if-range'))
+        self.check_copy(path, digest)
+
+    def test_resume_changed(self):
+        # the remote file changed since the interrupted transfer: If-Range
+        # makes the server send it whole
+        self.server.cut = 1000
+        self.assertRaises(DBError, download, self.url)
+        self.server.cut = None
+        self.server.content = 'other content\n' * 1000
+        path, digest = download(self.url)
+        self.assertEqual(self.server.requests[-1]['range'], 'bytes=1000-')
+        self.check_copy(path, digest)
+
+    def test_truncated(self):
+        self.server.cut = 1000
+        self.assertRaises(DBError, download, self.url)
+        self.assertRaises(DBError, open_source, self.url)
+
+    def test_cache_key(self):
+        # same file name, different sources
+        other_url = self.url.replace('/feeds/', '/mirror/')
+        path, digest = download(self.url)
+        other_path, other_digest = download(other_url)
+        self.assertNotEqual(path, other_path)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(download(self.url), (path, digest))
+        self.assertEqual(json.load(open(path + '.json'))['url'], self.url)
+
+
+if __name__ == '__main__':
+    unittest.main()
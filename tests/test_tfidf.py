@@ -0,0 +1,97 @@
+#!/usr/bin/python
+#
+# Author:
+# Henri Doreau <henri.doreau@greenbone.net>
+#
+# Copyright:
+# Copyright (C) 2011 Greenbone Networks GmbH, http://www.greenbone.net
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2
+# (or any later version), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301 USA.
+##
+
+
+
+"""Tests for the TF-IDF similarity index (cpelab.tools.tfidf)."""
+
+
+import unittest
+
+try:
+    from cpelab.tools import tfidf
+    from cpelab.tools.tfidf import TfidfIndex, tokenize
+except ImportError:
+    # numpy or scipy missing
+    TfidfIndex = None
+
+
+TITLES = [
+    'Microsoft Windows XP SP2',
+    'Microsoft Windows XP SP3',
+    'Microsoft Windows 2000',
+    'Linux Kernel 2.6.32',
+    'Linux Kernel 2.6.38',
+    'Cisco IOS 12.4',
+]
+
+@unittest.skipIf(TfidfIndex is None, 'requires numpy and scipy')
+class TfidfIndexTest(unittest.TestCase):
+    """TfidfIndex"""
+
+    def setUp(self):
+        self.index = TfidfIndex(TITLES)
+
+    def best(self, text, k=3, min_similarity=0.):
+        return list(self.index.top_matches([text], k, min_similarity))[0]
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize('ab c'), ['ab', 'c', ' ab', 'ab ', 'b c', ' c '])
+
+    def test_identical(self):
+        sim, idx = self.best('Cisco IOS 12.4')[0]
+        self.assertEqual(idx, 5)
+        self.assertAlmostEqual(sim, 1.)
+
+    def test_ranking(self):
+        res = self.best('linux kernel 2.6.32')
+        self.assertEqual([x[1] for x in res[:2]], [3, 4])
+        self.assertTrue(res[0][0] > res[1][0])
+
+    def test_ties(self):
+        # equally similar documents come in index order
+        res = self.best('Microsoft Windows XP', k=2)
+        self.assertEqual([x[1] for x in res], [0, 1])
+        self.assertAlmostEqual(res[0][0], res[1][0])
+
+    def test_thresholds(self):
+        self.assertEqual(len(self.best('Linux', k=10)), 2)
+        self.assertEqual(self.best('Linux', min_similarity=0.99), [])
+        # nothing in common with the indexed titles
+        self.assertEqual(self.best('zzzz'), [])
+
+    def test_blocks(self):
+        # several blocks of 2 rows
+        max_cells, tfidf.MAX_BLOCK_CELLS = tfidf.MAX_BLOCK_CELLS, 2 * len(TITLES)
+        try:
+            texts = [TITLES[i % len(TITLES)] for i in xrange(50)]
+            res = list(self.index.top_matches(texts, 1))
+        finally:
+            tfidf.MAX_BLOCK_CELLS = max_cells
+        self.assertEqual([x[0][1] for x in res], [i % len(TITLES) for i in xrange(50)])
+        self.assertEqual(list(self.index.top_matches([], 1)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
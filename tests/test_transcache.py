@@ -0,0 +1,87 @@
+#!/usr/bin/python
+#
+# Author:
+# Henri Doreau <henri.doreau@greenbone.net>
+#
+# Copyright:
+# Copyright (C) 2011 Greenbone Networks GmbH, http://www.greenbone.net
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2
+# (or any later version), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301 USA.
+##
+
+
+
+
+"""Tests for the persistent translation cache."""
+
+
+import unittest
+
+from tests import DatabaseTestCase, write_cpe_dictionary, write_nmap_os_db
+
+from cpelab.databases.nmapos import NmapOS
+from cpelab.databases.cpedict import CPEOS
+from cpelab.databases.transcache import TranslationCache
+
+
+SIG = {'title': 'Linux 2.6.0', 'vendor': 'linux', 'product': 'linux',
+    'version': '2.6.x'}
+
+class TranslationCacheTest(DatabaseTestCase):
+    """TranslationCache"""
+
+    def setUp(self):
+        DatabaseTestCase.setUp(self)
+        write_nmap_os_db(self.path('nmap-os-db'), 10)
+        self.nmapos = NmapOS()
+        self.nmapos.populate(self.path('nmap-os-db'))
+        write_cpe_dictionary(self.path('dict.xml'),
+            ['cpe:/o:linux:linux_kernel:2.6.%d' % x for x in xrange(10)])
+        self.cpeos = CPEOS()
+        self.cpeos.populate(self.path('dict.xml'))
+
+        cache = TranslationCache('test', self.nmapos, self.cpeos)
+        cache.put(SIG, 0.9, ['cpe:/o:linux:linux_kernel:2.6.0'])
+        cache.commit()
+
+    def cached(self):
+        """Return the cached translation of SIG."""
+        return TranslationCache('test', self.nmapos, self.cpeos).get(SIG)
+
+    def test_hit(self):
+        self.assertEqual(self.cached(), (0.9, ['cpe:/o:linux:linux_kernel:2.6.0']))
+        cache = TranslationCache('other', self.nmapos, self.cpeos)
+        self.assertEqual(cache.get(SIG), None)
+
+    def test_content_change(self):
+        write_nmap_os_db(self.path('nmap-os-db'), 5)
+        self.nmapos.populate(self.path('nmap-os-db'))
+        self.assertEqual(self.cached(), None)
+
+    def test_alias_change(self):
+        self.nmapos.db_cnx.execute("insert into nmapos_alias values"
+            " ('linux', 'linux', 'linux', 'linux')")
+        self.nmapos.db_cnx.commit()
+        self.assertEqual(self.cached(), None)
+
+        self.nmapos.db_cnx.execute("delete from nmapos_alias where"
+            " cpe_product = 'linux'")
+        self.nmapos.db_cnx.commit()
+        self.assertEqual(self.cached(), (0.9, ['cpe:/o:linux:linux_kernel:2.6.0']))
+
+
+if __name__ == '__main__':
+    unittest.main()
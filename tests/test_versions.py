@@ -0,0 +1,88 @@
+#!/usr/bin/python
+#
+# Author:
+# Henri Doreau <henri.doreau@greenbone.net>
+#
+# Copyright:
+# Copyright (C) 2011 Greenbone Networks GmbH, http://www.greenbone.net
+#
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2
+# (or any later version), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301 USA.
+##
+
+
+
+"""Tests for version keys and ranges (cpelab.databases.versions)."""
+
+
+import unittest
+
+from cpelab.databases.versions import version_key, version_range
+
+
+def covers(version, other):
+    """Return whether the range of version covers the key of other."""
+    low, high = version_range(version)
+    return low <= version_key(other) < high
+
+class VersionKeyTest(unittest.TestCase):
+    """version_key()"""
+
+    def test_numeric_order(self):
+        versions = ['1', '1.0', '1.0.1', '1.2', '1.10', '2', '2.4.37', '2.6',
+            '2.6.9', '2.6.10', '2.6.32', '3.0', '10.5.8', '11']
+        keys = [version_key(x) for x in versions]
+        self.assertEqual(keys, sorted(keys))
+        self.assertEqual(len(set(keys)), len(keys))
+
+    def test_suffix(self):
+        self.assertTrue(version_key('10.5.8-rc1').startswith(version_key('10.5.8')))
+        self.assertTrue(version_key('10.5.8-rc1') < version_key('10.5.9'))
+
+    def test_wildcards(self):
+        self.assertEqual(version_key('2.6.x'), version_key('2.6'))
+        self.assertEqual(version_key('2.6.X'), version_key('2.6'))
+        self.assertEqual(version_key('2.*'), version_key('2'))
+
+    def test_normalization(self):
+        self.assertEqual(version_key(' 2.06 '), version_key('2.6'))
+
+    def test_non_numeric(self):
+        for version in ['xp', 'vista', 'sp2', '', None]:
+            self.assertEqual(version_key(version), None)
+
+class VersionRangeTest(unittest.TestCase):
+    """version_range()"""
+
+    def test_prefix(self):
+        for version in ['2.6', '2.6.x']:
+            for other in ['2.6', '2.6.0', '2.6.9', '2.6.32', '2.6.32.1']:
+                self.assertTrue(covers(version, other), (version, other))
+            for other in ['2.5.99', '2.7', '2.60', '3.6', '12.6']:
+                self.assertFalse(covers(version, other), (version, other))
+
+    def test_interval(self):
+        for other in ['2.4', '2.4.37', '2.5', '2.6.32']:
+            self.assertTrue(covers('2.4 - 2.6', other), other)
+        for other in ['2.3.99', '2.7', '3.0']:
+            self.assertFalse(covers('2.4 - 2.6', other), other)
+
+    def test_non_numeric(self):
+        for version in ['xp', 'vista - 7', '2.4 - sp2', None]:
+            self.assertEqual(version_range(version), None)
+
+
+if __name__ == '__main__':
+    unittest.main()